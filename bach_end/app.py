@@ -5,7 +5,7 @@ import boto3
 import mysql.connector
 from openai import OpenAI
 import json
-from flask import Flask, request, jsonify, g, Response
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
@@ -17,8 +17,11 @@ import re
 import markdown
 from PIL import Image as PILImage
 import urllib.parse
-from rag import initialize_medical_rag
+from rag import get_rag_service
+from rag.runtime import RAG_REQUEST_WAIT_SECONDS
 from logger_config import log_info, log_error, log_user_interaction, log_system_startup
+from repetition_guard import repetition_stats
+from completion_cache import get_completion_cache
 
 # PDF生成相关导入
 try:
@@ -48,17 +51,37 @@ CORS(app) # Enable CORS for all routes
 # 配置Flask以确保JSON响应中的中文字符不被转义
 app.config['JSON_AS_ASCII'] = False
 
-# 全局SymptomExtractor实例，避免重复初始化RAG系统
-print("🚀 正在初始化全局医疗AI系统...")
+# 全局RAG服务：进程启动时在后台预热，请求最多等待 RAG_REQUEST_WAIT_SECONDS 秒，未就绪则不使用RAG
+rag_service = get_rag_service()
+
+def start_rag_warmup():
+    """在服务进程中启动RAG后台预热
+
+    debug 模式下 werkzeug 重载器的监控进程同样会执行 __main__，但不处理请求，
+    只在实际服务请求的子进程（WERKZEUG_RUN_MAIN=true）或被WSGI服务器导入时预热。
+    """
+    if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        rag_service.start()
+
+start_rag_warmup()
+
+# 全局SymptomExtractor实例（共享RAG服务，创建本身不加载模型）
 global_extractor = None
 
+# 图片诊断使用异步工作流程（aiohttp + 共享事件循环线程），未安装 aiohttp 时回退为同步调用
+CHAT_ASYNC_PIPELINE = os.environ.get('CHAT_ASYNC_PIPELINE', '1') == '1'
+if CHAT_ASYNC_PIPELINE:
+    try:
+        from async_chat import run_chat_top
+    except ImportError as e:
+        print(f"⚠️ 异步工作流程不可用，使用同步调用: {e}")
+        CHAT_ASYNC_PIPELINE = False
+
 def get_symptom_extractor():
     """获取全局SymptomExtractor实例"""
     global global_extractor
     if global_extractor is None:
-        print("🔄 首次初始化SymptomExtractor...")
-        global_extractor = SymptomExtractor()
-        print("✅ 全局SymptomExtractor初始化完成")
+        global_extractor = SymptomExtractor(rag_service=rag_service, rag_wait_timeout=RAG_REQUEST_WAIT_SECONDS)
     return global_extractor
 
 # --- Configurations ---
@@ -105,6 +128,53 @@ def close_db(e=None):
     if db is not None:
         db.close()
 
+# --- Health Checks ---
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """存活检查：进程能处理请求即返回200，附带RAG各组件状态、重复生成提前中止和补全缓存的统计"""
+    completion_cache = get_completion_cache()
+    return jsonify({
+        'status': 'ok',
+        'rag': rag_service.status(),
+        'repetition_guard': repetition_stats(),
+        'completion_cache': completion_cache.stats() if completion_cache is not None else None
+    })
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """就绪检查：RAG预热结束前返回503；预热失败时以降级模式（不使用RAG）对外服务"""
+    status = rag_service.status()
+    if status['state'] == 'ready':
+        return jsonify({'ready': True, 'mode': 'rag', 'rag': status})
+    if status['state'] == 'failed':
+        return jsonify({'ready': True, 'mode': 'degraded', 'rag': status})
+    return jsonify({'ready': False, 'mode': 'warming_up', 'rag': status}), 503
+
+
+# --- RAG Admin ---
+# 管理接口需在请求头 X-Admin-Token 中携带 RAG_ADMIN_TOKEN；未设置令牌时管理接口关闭（服务监听 0.0.0.0）
+RAG_ADMIN_TOKEN = os.environ.get('RAG_ADMIN_TOKEN')
+
+@app.route('/admin/rag/reload', methods=['POST'])
+def reload_rag():
+    """热重载知识库：后台构建新版本，就绪后原子切换，在途请求继续使用旧版本直到结束
+
+    请求体（可选）：{"full_rebuild": true} 从空目录全量建库，默认按内容哈希增量同步
+    """
+    if not RAG_ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': 'Admin API is disabled: RAG_ADMIN_TOKEN is not set'}), 403
+    if request.headers.get('X-Admin-Token') != RAG_ADMIN_TOKEN:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+
+    data = request.get_json(silent=True) or {}
+    if not rag_service.reload(full_rebuild=bool(data.get('full_rebuild'))):
+        status = rag_service.status()
+        message = 'RAG service is not ready' if status['state'] != 'ready' else 'A reload is already in progress'
+        return jsonify({'success': False, 'message': message, 'rag': status}), 409
+    return jsonify({'success': True, 'message': 'Reload started', 'rag': rag_service.status()}), 202
+
+
 # --- API Endpoints ---
 @app.route('/register', methods=['POST'])
 def register():
@@ -472,6 +542,13 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def completion_cache_allowed():
+    """请求头 X-Cache-Bypass: 1 或 Cache-Control: no-cache/no-store 时本次请求绕过补全缓存"""
+    if request.headers.get('X-Cache-Bypass', '').strip().lower() in ('1', 'true'):
+        return False
+    cache_control = request.headers.get('Cache-Control', '').lower()
+    return 'no-cache' not in cache_control and 'no-store' not in cache_control
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """Chat endpoint that delegates to SymptomExtractor.chat_top."""
@@ -479,6 +556,7 @@ def chat():
     
     content_type = request.content_type or ''
     extractor = get_symptom_extractor()  # 使用全局实例
+    use_cache = completion_cache_allowed()
     
     # Debug logging
     app.logger.info(f'Content-Type: {content_type}')
@@ -509,7 +587,10 @@ def chat():
                         app.logger.info(f'File {file.filename} is allowed, processing...')
                         image_bytes = file.read()
                         app.logger.info(f'Read {len(image_bytes)} bytes from file')
-                        reply = extractor.chat_top(prompt, image_bytes)
+                        if CHAT_ASYNC_PIPELINE:
+                            reply = run_chat_top(prompt, image_bytes, extractor=extractor, use_cache=use_cache)
+                        else:
+                            reply = extractor.chat_top(prompt, image_bytes, use_cache=use_cache)
                         app.logger.info('Successfully processed image')
                         return jsonify({'success': True, 'reply': reply})
                     else:
@@ -525,7 +606,7 @@ def chat():
             if not prompt:
                 return jsonify({'success': False, 'message': 'No message provided'}), 400
             # 无图文本对话
-            reply = extractor.chat_with_gpt(prompt, '')
+            reply = extractor.chat_with_gpt(prompt, '', use_cache=use_cache)
             return jsonify({'success': True, 'reply': reply})
         else:
             return jsonify({'success': False, 'message': 'Unsupported Content-Type'}), 415
@@ -536,6 +617,41 @@ def chat():
         return jsonify({'success': False, 'message': f'Internal error: {e}'}), 500
 
 
+def format_sse(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """流式图片诊断：以SSE逐步推送上传、症状提取、RAG判断和诊断建议，参数与 /chat 的 multipart 请求相同"""
+    log_user_interaction(action="流式聊天请求", details=f"IP: {request.remote_addr}, Content-Type: {request.content_type}")
+    
+    if not (request.content_type or '').startswith('multipart/form-data'):
+        return jsonify({'success': False, 'message': 'Unsupported Content-Type'}), 415
+    
+    prompt = (request.form.get('prompt') or '').strip()
+    if not prompt:
+        return jsonify({'success': False, 'message': 'Prompt is required'}), 400
+    
+    files = [f for f in request.files.getlist('file') if f and f.filename and allowed_file(f.filename)]
+    if not files:
+        return jsonify({'success': False, 'message': 'No valid image files provided'}), 400
+    image_bytes = files[0].read()
+    extractor = get_symptom_extractor()
+    use_cache = completion_cache_allowed()
+    
+    def generate():
+        for event, data in extractor.chat_top_stream(prompt, image_bytes, use_cache=use_cache):
+            yield format_sse(event, data)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # 关闭反向代理（nginx）的响应缓冲，事件到达即转发
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @app.route('/generate-case', methods=['POST'])
 def generate_case():
     """生成病例报告的API端点，支持文本数据和图片附件"""
@@ -899,19 +1015,7 @@ if __name__ == '__main__':
     # 记录系统启动
     log_system_startup()
     
-    # 初始化RAG系统
-    print("🚀 正在初始化医学RAG系统...")
-    log_info("开始初始化医学RAG系统")
-    try:
-        # initialize_medical_rag已在文件顶部导入
-        initialize_medical_rag()
-        print("✅ 医学RAG系统初始化完成")
-        log_info("医学RAG系统初始化完成")
-    except Exception as e:
-        print(f"⚠️ RAG系统初始化失败: {e}")
-        print("系统将继续运行，但诊断建议功能可能受影响")
-        log_error(f"RAG系统初始化失败: {e}", exc_info=True)
-    
+    # RAG系统已在服务进程中后台预热（见 start_rag_warmup），可通过 /readyz 查看进度
     print("🏥 医疗AI聊天系统启动中...")
     log_info("医疗AI聊天系统启动，监听端口3000")
     app.run(debug=True, host='0.0.0.0', port=3000)
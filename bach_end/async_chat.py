@@ -0,0 +1,324 @@
+"""
+异步医疗AI工作流程
+chat_top 的 asyncio 版本：图片上传、症状提取和诊断建议使用 aiohttp 异步请求，
+RAG检索与提示词构建在线程池中执行。每个上游主机一个全局信号量限制并发请求数，
+等待上游响应时不占用操作系统线程，单个进程可同时处理数百个诊断请求。
+
+同步代码（Flask 路由）通过共享的事件循环线程调用 run_chat_top()，异步路由可直接 await chat_top()。
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from chat import (DEEPSEEK_CHAT_URL, DIAGNOSIS_API_URL, SMMS_UPLOAD_URL, UPLOAD_READ_TIMEOUT,
+                  UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_POOL_SIZE, UPSTREAM_READ_TIMEOUT,
+                  SymptomExtractor, is_event_stream, parse_stream_line, parse_upload_result, upload_headers)
+from logger_config import log_api_call, log_info, log_user_interaction
+from repetition_guard import DIAGNOSIS_REPETITION_GUARD, RepetitionGuard
+
+# 每个上游主机同时进行的请求数上限
+ASYNC_UPSTREAM_CONCURRENCY = int(os.environ.get('ASYNC_UPSTREAM_CONCURRENCY', '64'))
+# 执行RAG检索和提示词构建的线程数
+ASYNC_RAG_WORKERS = int(os.environ.get('ASYNC_RAG_WORKERS', '8'))
+# 同步调用方等待整个工作流程的最长时间（秒）
+ASYNC_PIPELINE_TIMEOUT = float(os.environ.get('ASYNC_PIPELINE_TIMEOUT', '600'))
+
+
+class AsyncUpstreamClient:
+    """aiohttp 上游客户端：共享连接池（keep-alive）+ 每个上游主机一个并发信号量
+
+    会话和信号量在首次使用时于当前事件循环中创建，之后只能在该事件循环中使用。
+    """
+
+    def __init__(self, concurrency: int = None, pool_size: int = None,
+                 connect_timeout: float = None, read_timeout: float = None):
+        self.concurrency = concurrency or ASYNC_UPSTREAM_CONCURRENCY
+        self.pool_size = pool_size or UPSTREAM_POOL_SIZE
+        self.connect_timeout = UPSTREAM_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.read_timeout = UPSTREAM_READ_TIMEOUT if read_timeout is None else read_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    @staticmethod
+    def _host(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def semaphore(self, url: str) -> asyncio.Semaphore:
+        """url 所在上游主机的并发信号量"""
+        host = self._host(url)
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+
+    def in_flight(self) -> Dict[str, int]:
+        """各上游主机正在进行的请求数"""
+        return dict(self._in_flight)
+
+    def _timeout(self, read_timeout: float = None) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout if read_timeout is None else read_timeout
+        )
+
+    async def post(self, url: str, read_timeout: float = None, **kwargs):
+        """发送POST请求，返回 (状态码, 响应文本)；连接超时和读取超时与同步客户端一致"""
+        host = self._host(url)
+        async with self.semaphore(url):
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+            try:
+                async with self._get_session().post(url, timeout=self._timeout(read_timeout), **kwargs) as response:
+                    return response.status, await response.text()
+            finally:
+                self._in_flight[host] -= 1
+
+    @asynccontextmanager
+    async def stream(self, url: str, read_timeout: float = None, **kwargs):
+        """发送POST请求，产出未读取响应体的响应对象，供调用方逐行读取流式接口的输出
+
+        读取超时作用于每次读取。调用方提前退出时若响应体未读完，连接被关闭而不是放回连接池，上游随之停止生成。
+        """
+        host = self._host(url)
+        async with self.semaphore(url):
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+            try:
+                async with self._get_session().post(url, timeout=self._timeout(read_timeout), **kwargs) as response:
+                    try:
+                        yield response
+                    finally:
+                        if not response.content.at_eof():
+                            response.close()
+            finally:
+                self._in_flight[host] -= 1
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class AsyncSymptomExtractor:
+    """SymptomExtractor 的异步工作流程，请求构造、响应解析和提示词构建复用同步版本的实现"""
+
+    def __init__(self, extractor: SymptomExtractor = None, client: AsyncUpstreamClient = None,
+                 rag_workers: int = None):
+        """
+        Args:
+            extractor: 同步版本的提取器（共享RAG服务和提示词）
+            client: 异步上游客户端
+            rag_workers: 执行RAG检索和补全缓存读写的线程数
+        """
+        self.extractor = extractor or SymptomExtractor()
+        self.client = client or AsyncUpstreamClient()
+        self.rag_executor = ThreadPoolExecutor(max_workers=rag_workers or ASYNC_RAG_WORKERS,
+                                               thread_name_prefix='async-rag')
+
+    async def cached_completion(self, url, data, use_cache=True):
+        """在线程池中查询补全缓存（SQLite读写不阻塞事件循环）"""
+        if not use_cache or self.extractor.completion_cache is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.rag_executor, self.extractor.cached_completion, url, data)
+
+    async def store_completion(self, url, data, content, use_cache=True):
+        """在线程池中写入补全缓存"""
+        if not use_cache or self.extractor.completion_cache is None:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.rag_executor, self.extractor.store_completion, url, data, content)
+
+    async def upload_image(self, image_bytes: bytes, filename: str = 'image.png', max_retries: int = 3):
+        """异步上传图片到SM.MS，返回图片URL，失败时返回 None"""
+        for attempt in range(max_retries):
+            try:
+                print(f"尝试上传图片... ({attempt + 1}/{max_retries})")
+                form = aiohttp.FormData()
+                form.add_field('smfile', image_bytes, filename=filename)
+                status, body = await self.client.post(SMMS_UPLOAD_URL, read_timeout=UPLOAD_READ_TIMEOUT,
+                                                      headers=upload_headers(), data=form)
+                if status >= 400:
+                    raise aiohttp.ClientError(f"HTTP {status}: {body[:200]}")
+                return parse_upload_result(json.loads(body))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"第{attempt + 1}次尝试失败: {e!r}")
+                if attempt < max_retries - 1:
+                    print(f"等待 {2 ** attempt} 秒后重试...")
+                    await asyncio.sleep(2 ** attempt)
+                else:
+                    print("所有重试均失败")
+                    return None
+        return None
+
+    async def chat_with_gpt(self, prompt, img_url=None, use_reasoner=False, use_cache=True):
+        """异步调用DeepSeek API（第一步：症状提取）"""
+        model, headers, data = self.extractor.build_gpt_request(prompt, img_url, use_reasoner)
+        cached = await self.cached_completion(DEEPSEEK_CHAT_URL, data, use_cache)
+        if cached is not None:
+            return cached
+        start_time = time.time()
+        log_api_call("POST", DEEPSEEK_CHAT_URL, status_code=None)
+        try:
+            status, body = await self.client.post(DEEPSEEK_CHAT_URL, headers=headers, json=data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return self.extractor.gpt_request_failed(repr(e), time.time() - start_time)
+        content = self.extractor.parse_gpt_response(model, status, body, time.time() - start_time)
+        if status == 200:
+            await self.store_completion(DEEPSEEK_CHAT_URL, data, content, use_cache)
+        return content
+
+    async def chat_with_diagnosis_api(self, prompt, use_cache=True, repetition_guard=True):
+        """异步调用诊断API（第二步：诊断建议生成）；repetition_guard=False 时不做重复检测"""
+        if DIAGNOSIS_REPETITION_GUARD and repetition_guard:
+            return await self.stream_diagnosis(prompt, use_cache)
+        headers, data = self.extractor.build_diagnosis_request(prompt)
+        cached = await self.cached_completion(DIAGNOSIS_API_URL, data, use_cache)
+        if cached is not None:
+            return cached
+        start_time = time.time()
+        log_api_call("POST", DIAGNOSIS_API_URL, status_code=None)
+        try:
+            status, body = await self.client.post(DIAGNOSIS_API_URL, headers=headers, json=data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return self.extractor.diagnosis_request_failed(repr(e), time.time() - start_time)
+        content = self.extractor.parse_diagnosis_response(status, body, time.time() - start_time)
+        if status == 200:
+            await self.store_completion(DIAGNOSIS_API_URL, data, content, use_cache)
+        return content
+
+    async def stream_diagnosis(self, prompt, use_cache=True):
+        """以流式请求诊断API并检测重复生成：发现循环时立即关闭上游连接，返回去重后的前缀"""
+        headers, data = self.extractor.build_diagnosis_request(prompt)
+        cached = await self.cached_completion(DIAGNOSIS_API_URL, data, use_cache)
+        if cached is not None:
+            return cached
+        guard = RepetitionGuard(max_tokens=data['max_tokens'])
+        start_time = time.time()
+        log_api_call("POST", DIAGNOSIS_API_URL, status_code=None)
+        try:
+            async with self.client.stream(DIAGNOSIS_API_URL, headers=headers, json=dict(data, stream=True)) as response:
+                # 错误响应和不支持流式的上游（返回完整JSON）按非流式响应处理
+                if response.status != 200 or not is_event_stream(response.headers):
+                    status, body = response.status, await response.text()
+                    content = self.extractor.parse_diagnosis_response(status, body, time.time() - start_time)
+                    if status == 200:
+                        await self.store_completion(DIAGNOSIS_API_URL, data, content, use_cache)
+                    return content
+                async for line in response.content:
+                    done, text = parse_stream_line(line)
+                    if done or (text and not guard.feed(text)):
+                        break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return self.extractor.diagnosis_request_failed(repr(e), time.time() - start_time)
+
+        log_api_call("POST", DIAGNOSIS_API_URL, 200, time.time() - start_time)
+        if guard.tripped:
+            print(f"✂️ [第二步] 检测到重复生成，已提前中止，节省约 {guard.tokens_saved} 个token")
+        else:
+            # 截断的结果不完整，只缓存完整生成的诊断
+            await self.store_completion(DIAGNOSIS_API_URL, data, guard.text, use_cache)
+        return guard.text
+
+    async def generate_diagnosis_advice(self, symptoms, use_cache=True):
+        """第二步：RAG检索和提示词构建在线程池中执行，再异步请求诊断API"""
+        print("🩺 第二步：基于症状生成诊断建议...")
+        loop = asyncio.get_running_loop()
+        prompt = await loop.run_in_executor(self.rag_executor, self.extractor.build_diagnosis_prompt, symptoms)
+        return await self.chat_with_diagnosis_api(prompt, use_cache)
+
+    async def chat_top(self, prompt, image_bytes, use_cache=True):
+        """异步医疗AI两步工作流程：图片上传 → 症状提取 → RAG检索 → 诊断建议（use_cache=False 时绕过补全缓存）"""
+        print("🎯 开始医疗AI两步工作流程（异步）...")
+        log_user_interaction(action="医疗影像分析", details=f"提示词长度: {len(prompt)}字符")
+
+        img_url = await self.upload_image(image_bytes)
+        print("img_url:", img_url)
+        if img_url is None:
+            return "图片上传失败，无法处理图片。请稍后重试或检查网络连接。"
+
+        try:
+            print("🔍 第一步：分析医疗影像，提取症状...")
+            symptoms = await self.chat_with_gpt(self.extractor.medical_image_prompt, img_url, use_cache=use_cache)
+            diagnosis = await self.generate_diagnosis_advice(symptoms, use_cache)
+            return self.extractor.format_report(symptoms, diagnosis)
+        except Exception as e:
+            return f"分析过程中出现错误：{str(e)}。请稍后重试。"
+
+    async def close(self):
+        await self.client.close()
+        self.rag_executor.shutdown(wait=False)
+
+
+class EventLoopThread:
+    """在后台线程中常驻运行的事件循环，同步代码通过 run() 提交协程并等待结果"""
+
+    def __init__(self, name: str = 'async-pipeline'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coroutine, timeout: float = None):
+        """在事件循环中执行协程，阻塞等待结果；超时后取消协程并抛出 concurrent.futures.TimeoutError"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except Exception:
+            future.cancel()
+            raise
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+_loop_thread: Optional[EventLoopThread] = None
+_async_extractor: Optional[AsyncSymptomExtractor] = None
+_lock = threading.Lock()
+
+
+def get_event_loop_thread() -> EventLoopThread:
+    """获取进程内共享的事件循环线程"""
+    global _loop_thread
+    if _loop_thread is None:
+        with _lock:
+            if _loop_thread is None:
+                _loop_thread = EventLoopThread()
+                log_info("异步工作流程事件循环线程已启动")
+    return _loop_thread
+
+
+def get_async_extractor(extractor: SymptomExtractor = None) -> AsyncSymptomExtractor:
+    """获取进程内共享的异步提取器（首次调用时可传入已有的同步提取器）"""
+    global _async_extractor
+    if _async_extractor is None:
+        with _lock:
+            if _async_extractor is None:
+                _async_extractor = AsyncSymptomExtractor(extractor)
+    return _async_extractor
+
+
+def run_chat_top(prompt, image_bytes, extractor: SymptomExtractor = None, timeout: float = None,
+                 use_cache: bool = True):
+    """从同步代码执行异步工作流程（在共享的事件循环线程中运行）"""
+    async_extractor = get_async_extractor(extractor)
+    return get_event_loop_thread().run(async_extractor.chat_top(prompt, image_bytes, use_cache),
+                                       ASYNC_PIPELINE_TIMEOUT if timeout is None else timeout)
@@ -1,10 +1,150 @@
-
-
+import json
+import os
+import threading
 import requests
 import config
 import time
-from rag import initialize_medical_rag, MedicalRAGRetriever
+from contextlib import closing
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from rag import extract_medical_terms, get_rag_service
 from logger_config import log_info, log_error, log_api_call, log_rag_operation, log_user_interaction
+from repetition_guard import DIAGNOSIS_REPETITION_GUARD, RepetitionGuard
+from completion_cache import get_completion_cache
+
+# 上游服务地址
+SMMS_UPLOAD_URL = 'https://sm.ms/api/v2/upload'
+DEEPSEEK_CHAT_URL = 'https://api.deepseek.com/chat/completions'
+DIAGNOSIS_API_URL = 'http://86f3e642154b475c98092f118c62c793.qhdcloud.lanyun.net:10240/v1/chat/completions'
+
+# 上游HTTP连接池：每个上游主机一个保持长连接的会话，连接数上限与超时可通过环境变量调整
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', '32'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', '5'))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', '180'))
+# 图片上传的读取超时（秒）
+UPLOAD_READ_TIMEOUT = float(os.environ.get('UPLOAD_READ_TIMEOUT', '30'))
+
+
+class UpstreamClient:
+    """按上游主机复用连接的HTTP客户端
+
+    每个 scheme://host:port 一个 requests.Session，连接池大小为 pool_size，连接保持复用（keep-alive），
+    省去每次调用的TCP连接和TLS握手。所有请求都带连接/读取超时，上游卡住时不会无限占用工作线程。
+    会话只用于发送请求、不修改会话状态，可在Flask的多个工作线程间共享。
+    """
+
+    def __init__(self, pool_size: int = None, connect_timeout: float = None, read_timeout: float = None):
+        self.pool_size = pool_size or UPSTREAM_POOL_SIZE
+        self.connect_timeout = UPSTREAM_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        self.read_timeout = UPSTREAM_READ_TIMEOUT if read_timeout is None else read_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        """获取 url 所在主机的会话（首次访问时创建）"""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount(host, adapter)
+                    self._sessions[host] = session
+        return session
+
+    def post(self, url: str, read_timeout: float = None, **kwargs) -> requests.Response:
+        """发送POST请求，超时为 (连接超时, 读取超时)"""
+        timeout = (self.connect_timeout, self.read_timeout if read_timeout is None else read_timeout)
+        return self.session(url).post(url, timeout=timeout, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_upstream_client = None
+_upstream_client_lock = threading.Lock()
+
+
+def get_upstream_client() -> UpstreamClient:
+    """获取进程内共享的上游HTTP客户端"""
+    global _upstream_client
+    if _upstream_client is None:
+        with _upstream_client_lock:
+            if _upstream_client is None:
+                _upstream_client = UpstreamClient()
+    return _upstream_client
+
+
+def upload_headers() -> dict:
+    """SM.MS上传请求头"""
+    return {
+        # IMPORTANT: Replace with your own API token from https://sm.ms/home/apitoken
+        'Authorization': config.API_TOKEN 
+    }
+
+
+def parse_upload_result(result: dict):
+    """解析SM.MS上传结果，返回图片URL，失败时返回 None"""
+    if result.get('success'):
+        print(f"图片上传成功: {result['data']['url']}")
+        return result['data']['url']
+    elif result.get('code') == 'image_repeated':
+        # If the image is a duplicate, the API returns the URL of the existing image.
+        print(f"图片已存在: {result['images']}")
+        return result['images']
+    else:
+        print(f"Failed to upload image: {result.get('message')}")
+        return None
+
+
+def parse_stream_line(line: bytes):
+    """解析OpenAI兼容接口流式响应（stream: true，SSE格式）中的一行，返回 (是否结束, 增量文本)
+
+    每个事件形如 `data: {"choices": [{"delta": {"content": "..."}}]}`，以 `data: [DONE]` 结束。
+    按字节读取再以UTF-8解码，避免 text/event-stream 未声明字符集时中文被按 ISO-8859-1 解码。
+    无法解析的行（空的保活事件、截断或格式错误的JSON）跳过，不中断整个流。
+    """
+    line = line.strip()
+    if not line.startswith(b'data:'):
+        return False, None
+    payload = line[5:].strip()
+    if payload == b'[DONE]':
+        return True, None
+    if not payload:
+        return False, None
+    try:
+        chunk = json.loads(payload.decode('utf-8'))
+        choices = chunk.get('choices') or []
+        delta = (choices[0].get('delta') or {}) if choices else {}
+        text = delta.get('content')
+    except (ValueError, AttributeError, TypeError, KeyError, IndexError) as e:
+        print(f"⚠️ 跳过无法解析的流式数据: {payload[:100]!r} ({e})")
+        return False, None
+    return False, text if isinstance(text, str) and text else None
+
+
+def is_event_stream(headers) -> bool:
+    """响应是否为SSE流；上游不支持 stream 参数时会直接返回完整的JSON"""
+    return headers.get('Content-Type', '').startswith('text/event-stream')
+
+
+def iter_completion_stream(response: requests.Response):
+    """逐段产出流式补全响应中的增量文本
+
+    chunk_size=None 按上游发送的分块（chunked）即到即读，而不是凑满固定字节数。
+    """
+    for line in response.iter_lines(chunk_size=None):
+        done, text = parse_stream_line(line)
+        if done:
+            break
+        if text:
+            yield text
 
 
 def upload_image(image_bytes: bytes, filename: str = 'image.png', max_retries: int = 3):
@@ -16,11 +156,8 @@ def upload_image(image_bytes: bytes, filename: str = 'image.png', max_retries: i
     :param max_retries: Maximum number of retry attempts.
     :return: The URL of the uploaded image, or None if the upload fails.
     """
-    api_url = 'https://sm.ms/api/v2/upload'
-    headers = {
-        # IMPORTANT: Replace with your own API token from https://sm.ms/home/apitoken
-        'Authorization': config.API_TOKEN 
-    }
+    api_url = SMMS_UPLOAD_URL
+    headers = upload_headers()
     files = {
         'smfile': (filename, image_bytes)
     }
@@ -28,21 +165,10 @@ def upload_image(image_bytes: bytes, filename: str = 'image.png', max_retries: i
     for attempt in range(max_retries):
         try:
             print(f"尝试上传图片... ({attempt + 1}/{max_retries})")
-            response = requests.post(api_url, headers=headers, files=files, timeout=30)
+            response = get_upstream_client().post(api_url, read_timeout=UPLOAD_READ_TIMEOUT, headers=headers, files=files)
             response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
             
-            result = response.json()
-
-            if result.get('success'):
-                print(f"图片上传成功: {result['data']['url']}")
-                return result['data']['url']
-            elif result.get('code') == 'image_repeated':
-                # If the image is a duplicate, the API returns the URL of the existing image.
-                print(f"图片已存在: {result['images']}")
-                return result['images']
-            else:
-                print(f"Failed to upload image: {result.get('message')}")
-                return None
+            return parse_upload_result(response.json())
 
         except requests.exceptions.SSLError as e:
             print(f"第{attempt + 1}次尝试 SSL 错误: {e}")
@@ -67,7 +193,13 @@ def upload_image(image_bytes: bytes, filename: str = 'image.png', max_retries: i
 class SymptomExtractor:
     """医疗影像症状提取与诊断建议生成器"""
     
-    def __init__(self):
+    def __init__(self, rag_service=None, rag_wait_timeout=None, completion_cache=None):
+        """
+        Args:
+            rag_service: 共享的RAG服务，默认使用进程内单例
+            rag_wait_timeout: 每次诊断等待RAG预热的最长秒数，None 表示一直等到预热结束
+            completion_cache: 补全缓存，默认使用进程内共享的缓存（COMPLETION_CACHE=0 时不缓存）
+        """
         self.medical_image_prompt = """
 作为专业的医疗影像分析助手，请仔细分析这张医疗影像并提取可见的症状和异常表现。
 
@@ -116,21 +248,38 @@ class SymptomExtractor:
 4. 回答完毕后立即停止，不要继续生成内容
 """
         
-        # 初始化RAG系统
-        print("🔄 正在初始化医学RAG系统...")
-        log_info("开始初始化医学RAG系统")
-        try:
-            self.knowledge_base, self.rag_retriever = initialize_medical_rag()
-            print("✅ RAG系统初始化成功")
-            log_info("RAG系统初始化成功")
-        except Exception as e:
-            print(f"⚠️ RAG系统初始化失败: {e}")
-            log_error(f"RAG系统初始化失败: {e}", exc_info=True)
-            self.knowledge_base = None
-            self.rag_retriever = None
+        # 共享的RAG服务：后台预热，多个实例不会重复加载模型和知识库
+        self.rag_service = rag_service or get_rag_service()
+        self.rag_wait_timeout = rag_wait_timeout
+        self.rag_service.start()
+        
+        self.completion_cache = completion_cache if completion_cache is not None else get_completion_cache()
     
-    def chat_with_gpt(self, prompt, img_url=None, use_reasoner=False):
-        """调用DeepSeek API（用于第一步：症状提取）"""
+    @property
+    def rag_retriever(self):
+        """RAG检索器；预热未在等待时间内完成或预热失败时为 None"""
+        return self.rag_service.get_retriever(self.rag_wait_timeout)
+    
+    @property
+    def knowledge_base(self):
+        return self.rag_service.get_knowledge_base(self.rag_wait_timeout)
+    
+    def cached_completion(self, url, data, use_cache=True):
+        """查询补全缓存，未命中、请求要求绕过缓存（use_cache=False）或未启用缓存时返回 None"""
+        if not use_cache or self.completion_cache is None:
+            return None
+        content = self.completion_cache.get(url, data)
+        if content is not None:
+            print(f"⚡ 补全缓存命中: {url}")
+        return content
+    
+    def store_completion(self, url, data, content, use_cache=True):
+        """缓存成功的补全；绕过缓存的请求（use_cache=False）既不读取也不写入"""
+        if use_cache and self.completion_cache is not None:
+            self.completion_cache.set(url, data, content)
+    
+    def build_gpt_request(self, prompt, img_url=None, use_reasoner=False):
+        """构造症状提取（DeepSeek）请求，返回 (模型, 请求头, 请求体)"""
         api_key = config.DEEPSEEK_API_KEY
         # 根据是否需要推理能力和是否有图片选择模型
         if img_url:
@@ -138,7 +287,6 @@ class SymptomExtractor:
         else:
             model = "deepseek-reasoner" if use_reasoner else "deepseek-chat"
             
-        url = "https://api.deepseek.com/chat/completions"
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
@@ -162,26 +310,23 @@ class SymptomExtractor:
             "temperature": 0.1
         }
         
-        print(f"📤 [第一步] 发送API请求到: {url}")
+        print(f"📤 [第一步] 发送API请求到: {DEEPSEEK_CHAT_URL}")
         print(f"🤖 使用模型: {model}")
         print(f"📝 内容长度: {len(str(content))} 字符")
+        return model, headers, data
+    
+    def parse_gpt_response(self, model, status_code, body, response_time):
+        """处理症状提取API的响应（状态码 + 响应文本），返回回复内容或错误提示"""
+        url = DEEPSEEK_CHAT_URL
+        print(f"📶 API响应 - 模型: {model}, 状态: {status_code}")
         
-        # 记录API调用开始
-        start_time = time.time()
-        log_api_call("POST", url, status_code=None)
-        
-        response = requests.post(url, headers=headers, json=data)
-        response_time = time.time() - start_time
-        
-        print(f"📶 API响应 - 模型: {model}, 状态: {response.status_code}")
-        
-        if response.status_code == 200:
-            response_data = response.json()
+        if status_code == 200:
+            response_data = json.loads(body)
             content = response_data['choices'][0]['message']['content']
             print(f"✅ [第一步] API调用成功，返回内容长度: {len(content)} 字符")
             
             # 记录成功API调用
-            log_api_call("POST", url, response.status_code, response_time)
+            log_api_call("POST", url, status_code, response_time)
             
             # 如果有reasoning_content，也一并返回
             if 'reasoning_content' in response_data['choices'][0]['message']:
@@ -189,14 +334,40 @@ class SymptomExtractor:
                 print(f"🧠 推理过程长度: {len(reasoning)} 字符")
             return content
         else:
-            error_msg = f"API调用失败: {response.status_code} - {response.text}"
+            error_msg = f"API调用失败: {status_code} - {body}"
             print(f"❌ [第一步] {error_msg}")
-            log_api_call("POST", url, response.status_code, response_time, error_msg)
+            log_api_call("POST", url, status_code, response_time, error_msg)
             return f"抱歉，症状提取失败: {error_msg}"
     
-    def chat_with_diagnosis_api(self, prompt):
-        """调用新的诊断API（用于第二步：诊断建议生成）"""
-        url = "http://86f3e642154b475c98092f118c62c793.qhdcloud.lanyun.net:10240/v1/chat/completions"
+    def gpt_request_failed(self, error, response_time):
+        """症状提取请求异常（连接失败、超时）时的错误提示"""
+        error_msg = f"API请求异常: {str(error)}"
+        print(f"❌ [第一步] {error_msg}")
+        log_api_call("POST", DEEPSEEK_CHAT_URL, 0, response_time, error_msg)
+        return f"抱歉，症状提取失败: {error_msg}"
+    
+    def chat_with_gpt(self, prompt, img_url=None, use_reasoner=False, use_cache=True):
+        """调用DeepSeek API（用于第一步：症状提取）"""
+        model, headers, data = self.build_gpt_request(prompt, img_url, use_reasoner)
+        cached = self.cached_completion(DEEPSEEK_CHAT_URL, data, use_cache)
+        if cached is not None:
+            return cached
+        
+        # 记录API调用开始
+        start_time = time.time()
+        log_api_call("POST", DEEPSEEK_CHAT_URL, status_code=None)
+        
+        try:
+            response = get_upstream_client().post(DEEPSEEK_CHAT_URL, headers=headers, json=data)
+        except requests.exceptions.RequestException as e:
+            return self.gpt_request_failed(e, time.time() - start_time)
+        content = self.parse_gpt_response(model, response.status_code, response.text, time.time() - start_time)
+        if response.status_code == 200:
+            self.store_completion(DEEPSEEK_CHAT_URL, data, content, use_cache)
+        return content
+    
+    def build_diagnosis_request(self, prompt):
+        """构造诊断建议API请求，返回 (请求头, 请求体)"""
         headers = {
             "Authorization": "Bearer test-key",
             "Content-Type": "application/json"
@@ -218,84 +389,154 @@ class SymptomExtractor:
             "stop": ["参考资料：", "《", "祝您", "本平台", "以上信息", "如有疑问", "本分析仅供参考", "请务必咨询"]  # 更多停止词，避免重复免责声明
         }
         
-        print(f"📤 [第二步] 发送诊断API请求到: {url}")
+        print(f"📤 [第二步] 发送诊断API请求到: {DIAGNOSIS_API_URL}")
         print(f"🤖 使用诊断模型: gpt-3.5-turbo")
         print(f"📝 内容长度: {len(str(prompt))} 字符")
+        return headers, data
+    
+    def parse_diagnosis_response(self, status_code, body, response_time):
+        """处理诊断API的响应（状态码 + 响应文本），返回诊断建议或错误提示"""
+        url = DIAGNOSIS_API_URL
+        print(f"📶 诊断API响应 - 状态: {status_code}")
+        
+        if status_code == 200:
+            response_data = json.loads(body)
+            content = response_data['choices'][0]['message']['content']
+            print(f"✅ [第二步] 诊断API调用成功，返回内容长度: {len(content)} 字符")
+            
+            # 记录成功API调用
+            log_api_call("POST", url, status_code, response_time)
+            
+            return content
+        else:
+            error_msg = f"诊断API调用失败: {status_code} - {body}"
+            print(f"❌ [第二步] {error_msg}")
+            log_api_call("POST", url, status_code, response_time, error_msg)
+            return f"抱歉，诊断建议生成失败: {error_msg}"
+    
+    def diagnosis_request_failed(self, error, response_time):
+        """诊断请求异常（连接失败、超时）时的错误提示"""
+        error_msg = f"诊断API请求异常: {str(error)}"
+        print(f"❌ [第二步] {error_msg}")
+        log_api_call("POST", DIAGNOSIS_API_URL, 0, response_time, error_msg)
+        return f"抱歉，诊断API连接失败: {str(error)}"
+    
+    def chat_with_diagnosis_api(self, prompt, use_cache=True, repetition_guard=True):
+        """调用新的诊断API（用于第二步：诊断建议生成）
+        
+        repetition_guard=False 时不做重复检测（病例报告等按模板逐项重复行的输出）
+        """
+        if DIAGNOSIS_REPETITION_GUARD and repetition_guard:
+            return self.stream_diagnosis(prompt, use_cache)
+        headers, data = self.build_diagnosis_request(prompt)
+        cached = self.cached_completion(DIAGNOSIS_API_URL, data, use_cache)
+        if cached is not None:
+            return cached
         
         # 记录API调用开始
         start_time = time.time()
-        log_api_call("POST", url, status_code=None)
+        log_api_call("POST", DIAGNOSIS_API_URL, status_code=None)
         
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=180)
-            response_time = time.time() - start_time
-            
-            print(f"📶 诊断API响应 - 状态: {response.status_code}")
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                content = response_data['choices'][0]['message']['content']
-                print(f"✅ [第二步] 诊断API调用成功，返回内容长度: {len(content)} 字符")
-                
-                # 记录成功API调用
-                log_api_call("POST", url, response.status_code, response_time)
-                
-                return content
-            else:
-                error_msg = f"诊断API调用失败: {response.status_code} - {response.text}"
-                print(f"❌ [第二步] {error_msg}")
-                log_api_call("POST", url, response.status_code, response_time, error_msg)
-                return f"抱歉，诊断建议生成失败: {error_msg}"
-                
+            response = get_upstream_client().post(DIAGNOSIS_API_URL, headers=headers, json=data)
         except requests.exceptions.RequestException as e:
-            response_time = time.time() - start_time
-            error_msg = f"诊断API请求异常: {str(e)}"
-            print(f"❌ [第二步] {error_msg}")
-            log_api_call("POST", url, 0, response_time, error_msg)
-            return f"抱歉，诊断API连接失败: {str(e)}"
+            return self.diagnosis_request_failed(e, time.time() - start_time)
+        content = self.parse_diagnosis_response(response.status_code, response.text, time.time() - start_time)
+        if response.status_code == 200:
+            self.store_completion(DIAGNOSIS_API_URL, data, content, use_cache)
+        return content
     
-    def extract_symptoms_from_image(self, img_url):
+    def stream_diagnosis(self, prompt, use_cache=True):
+        """以流式请求诊断API并检测重复生成：发现循环时立即关闭上游流，返回去重后的前缀"""
+        headers, data = self.build_diagnosis_request(prompt)
+        cached = self.cached_completion(DIAGNOSIS_API_URL, data, use_cache)
+        if cached is not None:
+            return cached
+        guard = RepetitionGuard(max_tokens=data['max_tokens'])
+        start_time = time.time()
+        
+        try:
+            with closing(self.stream_completion(DIAGNOSIS_API_URL, headers, data)) as chunks:
+                for text in chunks:
+                    if not guard.feed(text):
+                        break
+        except requests.exceptions.HTTPError as e:
+            # stream_completion 已记录失败的API调用
+            print(f"❌ [第二步] 诊断{e}")
+            return f"抱歉，诊断建议生成失败: 诊断{e}"
+        except requests.exceptions.RequestException as e:
+            return self.diagnosis_request_failed(e, time.time() - start_time)
+        
+        if guard.tripped:
+            # 提前关闭的流不经过 stream_completion 末尾的调用记录
+            log_api_call("POST", DIAGNOSIS_API_URL, 200, time.time() - start_time)
+            print(f"✂️ [第二步] 检测到重复生成，已提前中止，节省约 {guard.tokens_saved} 个token")
+        print(f"✅ [第二步] 诊断API调用成功，返回内容长度: {len(guard.text)} 字符")
+        # 截断的结果不完整，不缓存；下次请求重新生成
+        if not guard.tripped:
+            self.store_completion(DIAGNOSIS_API_URL, data, guard.text, use_cache)
+        return guard.text
+    
+    def extract_symptoms_from_image(self, img_url, use_cache=True):
         """第一步：从医疗影像中提取症状"""
         print("🔍 第一步：分析医疗影像，提取症状...")
-        return self.chat_with_gpt(self.medical_image_prompt, img_url)
+        return self.chat_with_gpt(self.medical_image_prompt, img_url, use_cache=use_cache)
     
-    def generate_diagnosis_advice(self, symptoms):
+    def generate_diagnosis_advice(self, symptoms, use_cache=True):
         """第二步：根据症状生成诊断建议（RAG增强版）"""
         print("🩺 第二步：基于症状生成诊断建议...")
-        
+        return self.chat_with_diagnosis_api(self.build_diagnosis_prompt(symptoms), use_cache)
+    
+    def build_diagnosis_prompt(self, symptoms):
+        """检索相关医学知识，匹配度超过阈值时构建RAG增强的诊断提示词，否则使用传统提示词"""
+        return self.prepare_diagnosis_prompt(symptoms)[0]
+    
+    def prepare_diagnosis_prompt(self, symptoms):
+        """构建诊断提示词，返回 (提示词, 是否使用RAG, 最高匹配度)"""
         # 使用RAG检索相关医学知识并检查匹配度
         use_rag = False
         relevant_knowledge = ""
         max_relevance_score = 0.0
         
-        if self.rag_retriever:
-            try:
-                print("📚 正在检索相关医学知识...")
-                # 直接调用知识库的搜索方法获取详细的匹配度信息
-                knowledge_results = self.knowledge_base.search_relevant_knowledge(symptoms, top_k=3)
-                
-                if knowledge_results:
-                    # 获取最高匹配度
-                    max_relevance_score = max([k['relevance_score'] for k in knowledge_results])
-                    print(f"📊 最高匹配度: {max_relevance_score:.3f}")
+        # 持有当前知识库版本直到检索和格式化完成，期间的热重载不会释放该版本
+        with self.rag_service.lease(self.rag_wait_timeout) as rag_retriever:
+            if rag_retriever is None:
+                print(f"⚠️ RAG系统未就绪（{self.rag_service.state}），使用传统诊断方式")
+                log_rag_operation("传统诊断", f"RAG系统未就绪: {self.rag_service.state}")
+            else:
+                try:
+                    # 识别症状文本中的规范症状/疾病术语，检索时对精确命中的知识加权
+                    query_terms = extract_medical_terms(symptoms)
+                    if query_terms:
+                        print(f"🏷️ 识别到术语 - 症状: {', '.join(query_terms.symptoms) or '无'}；疾病: {', '.join(query_terms.diseases) or '无'}")
+                        log_rag_operation("术语识别", f"症状: {query_terms.symptoms}; 疾病: {query_terms.diseases}")
                     
-                    # 记录RAG检索结果
-                    log_rag_operation("知识检索", f"症状匹配", max_relevance_score, len(knowledge_results))
+                    print("📚 正在检索相关医学知识...")
+                    # 单次检索：阈值判断和提示词构建复用同一份检索结果
+                    retrieval = rag_retriever.retrieve(symptoms, top_k=3, query_terms=query_terms)
                     
-                    # 只有当匹配度超过0.7时才使用RAG
-                    if max_relevance_score > 0.7:
-                        use_rag = True
-                        relevant_knowledge = self.rag_retriever.retrieve_and_format(symptoms, top_k=3)
-                        print(f"✅ 匹配度 {max_relevance_score:.3f} > 0.7，使用RAG增强诊断")
-                        log_rag_operation("RAG增强诊断", "匹配度超过阈值", max_relevance_score)
+                    if retrieval:
+                        # 获取最高匹配度
+                        max_relevance_score = retrieval.max_score
+                        print(f"📊 最高匹配度: {max_relevance_score:.3f}")
+                        
+                        # 记录RAG检索结果
+                        log_rag_operation("知识检索", f"症状匹配", max_relevance_score, len(retrieval))
+                        
+                        # 只有当匹配度超过0.7时才使用RAG
+                        if max_relevance_score > 0.7:
+                            use_rag = True
+                            relevant_knowledge = retrieval.formatted_context
+                            print(f"✅ 匹配度 {max_relevance_score:.3f} > 0.7，使用RAG增强诊断")
+                            log_rag_operation("RAG增强诊断", "匹配度超过阈值", max_relevance_score)
+                        else:
+                            print(f"⚠️ 匹配度 {max_relevance_score:.3f} ≤ 0.7，使用传统诊断方式")
+                            log_rag_operation("传统诊断", "匹配度未达阈值", max_relevance_score)
                     else:
-                        print(f"⚠️ 匹配度 {max_relevance_score:.3f} ≤ 0.7，使用传统诊断方式")
-                        log_rag_operation("传统诊断", "匹配度未达阈值", max_relevance_score)
-                else:
-                    print("📚 未找到相关医学知识")
-                    
-            except Exception as e:
-                print(f"⚠️ RAG检索失败，使用传统方式: {e}")
+                        print("📚 未找到相关医学知识")
+                        
+                except Exception as e:
+                    print(f"⚠️ RAG检索失败，使用传统方式: {e}")
         
         # 根据匹配度决定使用哪种诊断方式
         if use_rag and relevant_knowledge:
@@ -343,10 +584,10 @@ class SymptomExtractor:
             if max_relevance_score > 0:
                 enhanced_prompt += f"\n\n注：已检索医学知识库，但最高匹配度仅为 {max_relevance_score:.3f}，未达到使用阈值(0.7)。"
         
-        return self.chat_with_diagnosis_api(enhanced_prompt)
+        return enhanced_prompt, use_rag and bool(relevant_knowledge), max_relevance_score
     
-    def chat_top(self, prompt, image_bytes):
-        """医疗AI两步工作流程：症状提取 → 诊断建议"""
+    def chat_top(self, prompt, image_bytes, use_cache=True):
+        """医疗AI两步工作流程：症状提取 → 诊断建议（use_cache=False 时绕过补全缓存）"""
         print("🎯 开始医疗AI两步工作流程...")
         log_user_interaction(action="医疗影像分析", details=f"提示词长度: {len(prompt)}字符")
         
@@ -360,13 +601,112 @@ class SymptomExtractor:
         
         try:
             # 第一步：从医疗影像提取症状
-            symptoms = self.extract_symptoms_from_image(img_url)
+            symptoms = self.extract_symptoms_from_image(img_url, use_cache)
             
             # 第二步：基于症状生成诊断建议
-            diagnosis = self.generate_diagnosis_advice(symptoms)
+            diagnosis = self.generate_diagnosis_advice(symptoms, use_cache)
             
             # 组合最终回复
-            final_response = f"""
+            return self.format_report(symptoms, diagnosis)
+            
+        except Exception as e:
+            return f"分析过程中出现错误：{str(e)}。请稍后重试。"
+    
+    def stream_completion(self, url, headers, data):
+        """以流式方式（stream: true）调用补全接口，逐段产出生成的文本；非200响应抛出 requests.HTTPError
+        
+        生成器被提前关闭（如客户端断开、检测到重复生成）时关闭上游连接，上游随之停止生成。
+        上游忽略 stream 参数返回完整JSON时，整段内容作为一个增量产出。
+        """
+        start_time = time.time()
+        log_api_call("POST", url, status_code=None)
+        
+        response = get_upstream_client().post(url, headers=headers, json=dict(data, stream=True), stream=True)
+        with response:
+            if response.status_code != 200:
+                error_msg = f"API调用失败: {response.status_code} - {response.text}"
+                log_api_call("POST", url, response.status_code, time.time() - start_time, error_msg)
+                raise requests.exceptions.HTTPError(error_msg, response=response)
+            if is_event_stream(response.headers):
+                yield from iter_completion_stream(response)
+            else:
+                yield json.loads(response.content)['choices'][0]['message']['content']
+        
+        log_api_call("POST", url, 200, time.time() - start_time)
+    
+    def chat_top_stream(self, prompt, image_bytes, use_cache=True):
+        """流式的两步工作流程，逐个产出 (事件名, 数据) 供 /chat/stream 以SSE发送
+        
+        事件顺序：started → uploaded → symptoms_delta* → symptoms → rag → diagnosis_delta* → done，
+        任一步失败时产出 error 并结束。started 在上传图片之前立即产出，客户端无需等待任何上游调用即可收到首字节；
+        done 中的 reply 与 chat_top 的返回值格式相同。诊断出现重复循环时在 done 之前产出 diagnosis_truncated，
+        其 content 为去重后的完整诊断（已发送的增量中可能包含重复开头的部分）。
+        补全缓存命中的步骤不请求上游，整段内容作为一个增量产出。
+        """
+        print("🎯 开始医疗AI两步工作流程（流式）...")
+        log_user_interaction(action="医疗影像分析（流式）", details=f"提示词长度: {len(prompt)}字符")
+        yield 'started', {}
+        
+        img_url = upload_image(image_bytes)
+        if img_url is None:
+            yield 'error', {'message': "图片上传失败，无法处理图片。请稍后重试或检查网络连接。"}
+            return
+        yield 'uploaded', {'url': img_url}
+        
+        try:
+            # 第一步：流式提取症状（缓存命中时整段作为一个增量发送）
+            print("🔍 第一步：分析医疗影像，提取症状（流式）...")
+            model, headers, data = self.build_gpt_request(self.medical_image_prompt, img_url)
+            symptoms = self.cached_completion(DEEPSEEK_CHAT_URL, data, use_cache)
+            if symptoms is not None:
+                yield 'symptoms_delta', {'text': symptoms}
+            else:
+                parts = []
+                for text in self.stream_completion(DEEPSEEK_CHAT_URL, headers, data):
+                    parts.append(text)
+                    yield 'symptoms_delta', {'text': text}
+                symptoms = ''.join(parts)
+                self.store_completion(DEEPSEEK_CHAT_URL, data, symptoms, use_cache)
+            yield 'symptoms', {'content': symptoms}
+            
+            # RAG检索与阈值判断
+            print("🩺 第二步：基于症状生成诊断建议（流式）...")
+            diagnosis_prompt, use_rag, max_relevance_score = self.prepare_diagnosis_prompt(symptoms)
+            yield 'rag', {'use_rag': use_rag, 'max_relevance_score': round(max_relevance_score, 3)}
+            
+            # 第二步：流式生成诊断建议
+            headers, data = self.build_diagnosis_request(diagnosis_prompt)
+            diagnosis = self.cached_completion(DIAGNOSIS_API_URL, data, use_cache)
+            if diagnosis is not None:
+                yield 'diagnosis_delta', {'text': diagnosis}
+            else:
+                guard = RepetitionGuard(max_tokens=data['max_tokens'])
+                parts = []
+                with closing(self.stream_completion(DIAGNOSIS_API_URL, headers, data)) as chunks:
+                    for text in chunks:
+                        # 检测到循环时不再转发，关闭上游流
+                        if DIAGNOSIS_REPETITION_GUARD and not guard.feed(text):
+                            break
+                        parts.append(text)
+                        yield 'diagnosis_delta', {'text': text}
+                if guard.tripped:
+                    # 截断的结果不完整，不缓存
+                    diagnosis = guard.text
+                    yield 'diagnosis_truncated', {'content': diagnosis, 'tokens_saved': guard.tokens_saved}
+                else:
+                    diagnosis = ''.join(parts)
+                    self.store_completion(DIAGNOSIS_API_URL, data, diagnosis, use_cache)
+            
+            yield 'done', {'reply': self.format_report(symptoms, diagnosis)}
+            
+        except Exception as e:
+            log_error(f"流式诊断失败: {e}")
+            yield 'error', {'message': f"分析过程中出现错误：{str(e)}。请稍后重试。"}
+    
+    @staticmethod
+    def format_report(symptoms, diagnosis):
+        """组合两步结果的最终回复"""
+        return f"""
 ═══════════════════════════════════════
 🏥 医疗影像智能分析报告
 ═══════════════════════════════════════
@@ -382,11 +722,6 @@ class SymptomExtractor:
 ═══════════════════════════════════════
 ⚠️  **重要提醒**：此分析结果仅供参考，不能替代专业医生的诊断。如有健康问题，请及时就医。
 """
-            
-            return final_response
-            
-        except Exception as e:
-            return f"分析过程中出现错误：{str(e)}。请稍后重试。"
     
     def generate_case_report(self, patient_data, image_attachments=None):
         """基于患者信息生成病例报告"""
@@ -475,7 +810,9 @@ class SymptomExtractor:
         
         # 使用诊断API生成病例报告
         print("🤖 调用诊断API生成病例报告...")
-        case_report = self.chat_with_diagnosis_api(prompt)
+        # 病例提示词包含患者身份信息且几乎不会重复，不写入补全缓存；
+        # 病例报告的各项检查、各条医嘱常套用相同的行模板，不做重复检测，避免截断正常报告
+        case_report = self.chat_with_diagnosis_api(prompt, use_cache=False, repetition_guard=False)
         
         # 在病例报告末尾添加图片附件信息
         if image_attachments and len(image_attachments) > 0:
@@ -0,0 +1,110 @@
+"""
+大模型补全结果缓存
+两次上游调用都使用低温度（0.1），相同的症状提取请求（同一图片）和相同的诊断提示词（相同症状 + 相同RAG上下文）
+得到的结果基本一致。以 上游地址 + 模型 + 消息 + 采样参数 的哈希为键缓存补全结果，命中时无需再等待10–60秒的生成。
+
+缓存存放在SQLite文件中（rag.disk_cache.SQLiteCache，WAL模式），同一台机器上的多个worker进程共享；
+条目超过有效期后失效，条目数超过上限后按最近访问时间淘汰。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from logger_config import log_error, log_info
+from rag.disk_cache import SQLiteCache
+
+# 是否启用补全缓存
+COMPLETION_CACHE_ENABLED = os.environ.get('COMPLETION_CACHE', '1') == '1'
+# 缓存文件路径（默认位于 bach_end/cache 目录）
+COMPLETION_CACHE_PATH = os.environ.get(
+    'COMPLETION_CACHE_PATH', str(Path(__file__).parent / "cache" / "completions.sqlite3"))
+# 条目有效期（秒）和条目数上限
+COMPLETION_CACHE_TTL = float(os.environ.get('COMPLETION_CACHE_TTL', '86400'))
+COMPLETION_CACHE_MAX_ENTRIES = int(os.environ.get('COMPLETION_CACHE_MAX_ENTRIES', '20000'))
+
+# 不影响生成结果的请求字段
+_IGNORED_FIELDS = ('stream',)
+
+
+def completion_key(url: str, data: dict) -> str:
+    """生成缓存键：sha256(上游地址 + 规范化的请求体)
+
+    请求体包含模型、消息和全部采样参数（temperature、top_p、max_tokens、stop 等），
+    任一项变化都对应不同的键；是否流式返回不影响结果，不参与计算。
+    """
+    body = {name: value for name, value in data.items() if name not in _IGNORED_FIELDS}
+    raw = url + '\x00' + json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class CompletionCache:
+    """补全结果缓存，只应写入成功的补全（错误提示不缓存）"""
+
+    def __init__(self, path: str = None, ttl: float = None, max_entries: int = None):
+        """
+        Args:
+            path: SQLite缓存文件路径
+            ttl: 条目有效期（秒）
+            max_entries: 条目数上限
+        """
+        self.disk = SQLiteCache(path or COMPLETION_CACHE_PATH, namespace='completions',
+                                max_entries=max_entries or COMPLETION_CACHE_MAX_ENTRIES,
+                                ttl=COMPLETION_CACHE_TTL if ttl is None else ttl)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str, data: dict) -> Optional[str]:
+        """查询缓存的补全内容，未命中返回 None；缓存读取失败时按未命中处理"""
+        try:
+            value = self.disk.get(completion_key(url, data))
+        except Exception as e:
+            log_error(f"补全缓存读取失败: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if value is None else bytes(value).decode('utf-8')
+
+    def set(self, url: str, data: dict, content: str):
+        """写入补全内容；缓存写入失败不影响请求"""
+        if not content:
+            return
+        try:
+            self.disk.set(completion_key(url, data), content.encode('utf-8'))
+        except Exception as e:
+            log_error(f"补全缓存写入失败: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        self.disk.close()
+
+
+_completion_cache: Optional[CompletionCache] = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """获取进程内共享的补全缓存；未启用或缓存文件无法打开时返回 None"""
+    global _completion_cache
+    if not COMPLETION_CACHE_ENABLED:
+        return None
+    if _completion_cache is None:
+        with _completion_cache_lock:
+            if _completion_cache is None:
+                try:
+                    _completion_cache = CompletionCache()
+                    log_info(f"补全缓存已启用: {COMPLETION_CACHE_PATH}")
+                except Exception as e:
+                    log_error(f"补全缓存不可用: {e}")
+                    return None
+    return _completion_cache
@@ -3,6 +3,11 @@ RAG (Retrieval-Augmented Generation) 模块
 包含医学知识检索和增强生成相关功能
 """
 
-from .medical_rag import MedicalKnowledgeBase, MedicalRAGRetriever, initialize_medical_rag
+from .medical_rag import MedicalKnowledgeBase, MedicalRAGRetriever, RetrievalResult, initialize_medical_rag
+from .embedding import SentenceTransformerEmbedder
+from .term_matcher import MedicalTerms, MedicalTermMatcher, extract_medical_terms
+from .runtime import RAGService, get_rag_service
 
-__all__ = ['MedicalKnowledgeBase', 'MedicalRAGRetriever', 'initialize_medical_rag']
+__all__ = ['MedicalKnowledgeBase', 'MedicalRAGRetriever', 'RetrievalResult', 'initialize_medical_rag',
+           'SentenceTransformerEmbedder', 'MedicalTerms', 'MedicalTermMatcher', 'extract_medical_terms',
+           'RAGService', 'get_rag_service']
@@ -0,0 +1,145 @@
+"""
+RAG 命令行工具（在 bach_end 目录下运行）
+
+    python -m rag build-index [选项]             构建/增量同步知识库索引（可断点续建）
+    python -m rag export-artifact [选项]         把已建好的知识库导出为预构建索引制品
+    python -m rag reload [选项]                  让运行中的后端热重载知识库（蓝绿切换）
+    python -m rag benchmark-quantization [选项]  量化检索 recall@k 基准
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from .artifact import DEFAULT_ARTIFACT_PATH
+
+
+def _build_index_parser(subparsers):
+    from .medical_rag import DEFAULT_DB_PATH
+
+    parser = subparsers.add_parser('build-index', help='构建或增量同步知识库索引')
+    parser.add_argument('--db-path', default=DEFAULT_DB_PATH, help='知识库目录')
+    parser.add_argument('--data', dest='data_path', help='JSONL 知识数据文件（默认读取 RAG_KNOWLEDGE_DATA）')
+    parser.add_argument('--backend', dest='vector_backend', choices=['chroma', 'numpy'], help='向量存储后端')
+    parser.add_argument('--sharded', action='store_true', default=None, help='按疾病类别分片')
+    parser.add_argument('--model', dest='model_name', help='句向量模型名称')
+    parser.add_argument('--device', help='编码设备，如 cpu、cuda')
+    parser.add_argument('--batch-size', type=int, help='编码批大小')
+    parser.add_argument('--chunk-size', type=int, help='每次写入并记录断点的记录数')
+    parser.add_argument('--workers', type=int, default=1, help='编码进程数（大于1时使用多进程池）')
+    parser.add_argument('--threads', type=int, help='单进程编码时的 PyTorch 线程数')
+    parser.add_argument('--rebuild', action='store_true', help='忽略已有清单，全量重建')
+    return parser
+
+
+def _export_artifact_parser(subparsers):
+    from .medical_rag import DEFAULT_DB_PATH
+
+    parser = subparsers.add_parser('export-artifact', help='把已建好的知识库导出为预构建索引制品')
+    parser.add_argument('--db-path', default=DEFAULT_DB_PATH, help='知识库目录')
+    parser.add_argument('--output', help='制品文件路径（默认读取 RAG_INDEX_ARTIFACT）')
+    parser.add_argument('--backend', dest='vector_backend', choices=['chroma', 'numpy'], help='向量存储后端')
+    parser.add_argument('--sharded', action='store_true', default=None, help='按疾病类别分片')
+    parser.add_argument('--model', dest='model_name', help='句向量模型名称')
+    return parser
+
+
+def export_artifact(db_path: str, output=None, vector_backend=None, sharded=None, model_name=None):
+    """打开（必要时同步）知识库并导出索引制品"""
+    from . import medical_rag
+    from .medical_rag import MedicalKnowledgeBase
+
+    # 导出的是当前知识库本身，不从已有制品装载
+    medical_rag.INDEX_ARTIFACT_PATH = None
+    knowledge_base = MedicalKnowledgeBase(db_path=db_path, embedding_model_name=model_name,
+                                          vector_backend=vector_backend, hybrid_search=False, sharded=sharded)
+    output = output or os.environ.get('RAG_INDEX_ARTIFACT') or DEFAULT_ARTIFACT_PATH
+    header = knowledge_base.export_artifact(output)
+    print(f"📦 已导出索引制品: {output}")
+    print(f"   {header['count']} 条记录，维度 {header['dimension']}，编码模型 {header['model_id']}")
+    print(f"   语料哈希 {header['corpus_hash']}，文件大小 {os.path.getsize(output) / 1e6:.1f} MB")
+    return header
+
+
+def _reload_parser(subparsers):
+    parser = subparsers.add_parser('reload', help='让运行中的后端热重载知识库')
+    parser.add_argument('--url', default=os.environ.get('RAG_ADMIN_URL', 'http://127.0.0.1:3000'), help='后端服务地址')
+    parser.add_argument('--token', default=os.environ.get('RAG_ADMIN_TOKEN'), help='管理令牌（RAG_ADMIN_TOKEN）')
+    parser.add_argument('--full-rebuild', action='store_true', help='从空目录全量建库')
+    parser.add_argument('--no-wait', dest='wait', action='store_false', help='发起后立即返回，不等待切换完成')
+    parser.add_argument('--timeout', type=float, default=3600, help='等待切换完成的最长秒数')
+    return parser
+
+
+def reload_service(url: str, token=None, full_rebuild: bool = False, wait: bool = True, timeout: float = 3600) -> bool:
+    """调用后端管理接口发起热重载，并轮询 /healthz 直到新版本切换完成或失败"""
+    import requests
+
+    url = url.rstrip('/')
+    headers = {'X-Admin-Token': token} if token else {}
+    response = requests.post(f"{url}/admin/rag/reload", json={'full_rebuild': full_rebuild}, headers=headers, timeout=30)
+    body = response.json()
+    if response.status_code != 202:
+        print(f"❌ 热重载未开始: {body.get('message')}")
+        return False
+    previous = body['rag'].get('version', {}).get('version')
+    print(f"🔄 已发起热重载（当前版本 {previous}）")
+    if not wait:
+        return True
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(2)
+        status = requests.get(f"{url}/healthz", timeout=30).json()['rag']
+        reload_state = status['reload']['state']
+        if reload_state == 'failed':
+            print(f"❌ 新版本构建失败: {status['reload']['error']}")
+            return False
+        if reload_state == 'ready' and status.get('version', {}).get('version') != previous:
+            version = status['version']
+            print(f"✅ 已切换到版本 {version['version']}，包含 {version['knowledge_count']} 条记录，"
+                  f"构建用时 {status['reload']['elapsed_seconds']}s")
+            return True
+    print(f"⚠️ 等待超过 {timeout:.0f}s，新版本仍在构建中")
+    return False
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog='python -m rag', description='医学RAG命令行工具')
+    subparsers = parser.add_subparsers(dest='command')
+    _build_index_parser(subparsers)
+    _export_artifact_parser(subparsers)
+    _reload_parser(subparsers)
+    subparsers.add_parser('benchmark-quantization', help='量化检索 recall@k / 内存 / 延迟基准', add_help=False)
+
+    args, rest = parser.parse_known_args(argv)
+    if args.command == 'build-index':
+        if rest:
+            parser.error(f"无法识别的参数: {' '.join(rest)}")
+        from .build_index import build_index
+        options = vars(args)
+        options.pop('command')
+        build_index(**options)
+    elif args.command == 'export-artifact':
+        if rest:
+            parser.error(f"无法识别的参数: {' '.join(rest)}")
+        options = vars(args)
+        options.pop('command')
+        export_artifact(**options)
+    elif args.command == 'reload':
+        if rest:
+            parser.error(f"无法识别的参数: {' '.join(rest)}")
+        options = vars(args)
+        options.pop('command')
+        sys.exit(0 if reload_service(**options) else 1)
+    elif args.command == 'benchmark-quantization':
+        from .benchmark_quantization import main as benchmark_main
+        benchmark_main(rest)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+预构建索引制品（artifact）
+把已建好的知识库导出为单个带版本的文件：向量矩阵、记录ID、向量库metadata、docstore 和清单。
+新部署的实例在知识库目录为空时直接加载该文件（NumPy后端直接内存映射向量矩阵），不再运行编码模型。
+
+文件布局：
+    8 字节魔数 MEDRAGIX
+    4 字节小端 uint32：头部JSON长度
+    头部JSON：格式版本、编码模型标识、语料哈希、记录数、维度，以及各数据段的偏移、长度和 sha256
+    数据段（各段起始位置按 64 字节对齐，偏移量相对于头部之后对齐的数据区起点）：
+        vectors    float32 矩阵（行优先），可直接 np.memmap
+        ids        记录ID列表（JSON）
+        metadatas  与向量行对齐的向量库metadata（JSON）
+        docstore   KnowledgeDocStore 二进制（JSON + 原始编号数组，不含 pickle，装载制品不会执行任意代码）
+        manifest   清单内容（JSON）
+
+头部同时记录导出时知识数据文件的 sha256：装载时数据文件未变化即直接使用制品中的 docstore，
+否则按清单中的内容哈希增量同步（只编码有差异的记录）。
+"""
+
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .docstore import KnowledgeDocStore
+from .knowledge_data import DATA_DIR
+
+ARTIFACT_MAGIC = b'MEDRAGIX'
+ARTIFACT_FORMAT_VERSION = 1
+SECTION_ALIGNMENT = 64
+# 校验哈希时每次读取的字节数
+HASH_READ_SIZE = 1 << 20
+
+DEFAULT_ARTIFACT_PATH = os.path.join(DATA_DIR, 'medical_knowledge_index.ragidx')
+# 由制品装载（且没有知识数据文件）时 docstore 指纹的前缀
+ARTIFACT_FINGERPRINT_PREFIX = 'artifact:'
+
+
+def corpus_hash(records: Dict[str, str]) -> str:
+    """语料哈希：按记录ID排序后的 (记录ID, 内容哈希) 的 sha256"""
+    digest = hashlib.sha256()
+    for record_id in sorted(records):
+        digest.update(f"{record_id}\t{records[record_id]}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """流式计算文件的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _aligned(position: int) -> int:
+    return (position + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
+
+
+def write_artifact(path: str, model_id: str, ids: List[str], vectors: np.ndarray, metadatas: List[Dict],
+                   docstore: KnowledgeDocStore, manifest_data: Dict, source_sha256: Optional[str] = None) -> Dict:
+    """写出制品文件（写临时文件后原子替换），返回头部
+
+    Args:
+        source_sha256: 导出时知识数据文件的 sha256（没有数据文件时为 None）
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    sections = {
+        'vectors': vectors.tobytes(),
+        'ids': json.dumps(ids, ensure_ascii=False).encode('utf-8'),
+        'metadatas': json.dumps(metadatas, ensure_ascii=False).encode('utf-8'),
+        'docstore': docstore.to_bytes(),
+        'manifest': json.dumps(manifest_data, ensure_ascii=False).encode('utf-8'),
+    }
+
+    layout = {}
+    offset = 0
+    for name, data in sections.items():
+        layout[name] = {'offset': offset, 'length': len(data), 'sha256': hashlib.sha256(data).hexdigest()}
+        offset = _aligned(offset + len(data))
+
+    header = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'model_id': model_id,
+        'corpus_hash': corpus_hash(manifest_data.get('records', {})),
+        'count': len(ids),
+        'dimension': int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        'dtype': 'float32',
+        'source_sha256': source_sha256,
+        'sections': layout,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = _aligned(len(ARTIFACT_MAGIC) + 4 + len(header_bytes))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(ARTIFACT_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for name, data in sections.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(data)
+        f.truncate(data_start + offset)
+    os.replace(path + '.tmp', path)
+    return header
+
+
+class KnowledgeArtifact:
+    """只读的索引制品文件"""
+
+    def __init__(self, path: str = DEFAULT_ARTIFACT_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(ARTIFACT_MAGIC)) != ARTIFACT_MAGIC:
+                raise ValueError(f"不是索引制品文件: {path}")
+            header_length, = struct.unpack('<I', f.read(4))
+            self.header = json.loads(f.read(header_length).decode('utf-8'))
+        if self.header.get('format_version') != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"不支持的索引制品格式版本: {self.header.get('format_version')}")
+        self.data_start = _aligned(len(ARTIFACT_MAGIC) + 4 + header_length)
+
+    @property
+    def model_id(self) -> str:
+        return self.header['model_id']
+
+    @property
+    def corpus_hash(self) -> str:
+        return self.header['corpus_hash']
+
+    @property
+    def source_sha256(self) -> Optional[str]:
+        return self.header.get('source_sha256')
+
+    def __len__(self) -> int:
+        return self.header['count']
+
+    def _section(self, name: str) -> Dict:
+        return self.header['sections'][name]
+
+    def verify(self):
+        """逐段校验 sha256，不一致时抛出 ValueError"""
+        with open(self.path, 'rb') as f:
+            for name, section in self.header['sections'].items():
+                f.seek(self.data_start + section['offset'])
+                digest = hashlib.sha256()
+                remaining = section['length']
+                while remaining > 0:
+                    chunk = f.read(min(HASH_READ_SIZE, remaining))
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+                if remaining or digest.hexdigest() != section['sha256']:
+                    raise ValueError(f"索引制品数据段 {name} 校验失败: {self.path}")
+
+    def read_section(self, name: str) -> bytes:
+        section = self._section(name)
+        with open(self.path, 'rb') as f:
+            f.seek(self.data_start + section['offset'])
+            return f.read(section['length'])
+
+    def vectors(self) -> np.ndarray:
+        """以只读 mmap 方式映射向量矩阵"""
+        shape = (self.header['count'], self.header['dimension'])
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=np.float32)
+        return np.memmap(self.path, dtype=np.float32, mode='r',
+                         offset=self.data_start + self._section('vectors')['offset'], shape=shape)
+
+    def ids(self) -> List[str]:
+        return json.loads(self.read_section('ids'))
+
+    def metadatas(self) -> List[Dict]:
+        return json.loads(self.read_section('metadatas'))
+
+    def docstore(self) -> Optional[KnowledgeDocStore]:
+        return KnowledgeDocStore.from_bytes(self.read_section('docstore'))
+
+    def manifest_data(self) -> Dict:
+        return json.loads(self.read_section('manifest'))
@@ -0,0 +1,120 @@
+"""
+量化检索基准测试
+对比 int8 / 二值量化 + 精确重排与 float32 全量扫描的 recall@k、首轮扫描内存和单次查询延迟。
+
+用法（在 bach_end 目录下）：
+    python -m rag benchmark-quantization                                   # 使用现有知识库的NumPy向量索引
+    python -m rag benchmark-quantization --index-dir ./rag/data/medical_knowledge_db/vector_index
+    python -m rag benchmark-quantization --synthetic 50000 --dim 384       # 合成数据（模拟大规模语料）
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from .medical_rag import DEFAULT_DB_PATH
+from .vector_index import QUANTIZATION_BINARY, QUANTIZATION_INT8, QUANTIZATION_NONE, VectorIndex
+
+
+def load_index_vectors(index_dir: str) -> np.ndarray:
+    """读取现有NumPy向量索引中的全部向量（float32）"""
+    index = VectorIndex(index_dir)
+    if index.count() == 0:
+        raise ValueError(f"向量索引为空或不存在: {index_dir}")
+    return np.asarray(index._state.vectors, dtype=np.float32)
+
+
+def synthetic_vectors(count: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """生成成簇分布的归一化向量（比各向同性随机向量更接近真实句向量的分布）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size=count)] + 0.6 * rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def sample_queries(vectors: np.ndarray, count: int, noise: float = 0.3, seed: int = 1) -> np.ndarray:
+    """从库中抽样并加噪声作为查询向量"""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), size=count)]
+    queries = queries + noise * rng.normal(size=queries.shape).astype(np.float32) / np.sqrt(vectors.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def recall_at_k(results: List[List[str]], ground_truth: List[List[str]]) -> float:
+    """各查询 top-k 结果与精确 top-k 交集占比的平均值"""
+    recalls = [len(set(found) & set(expected)) / len(expected) for found, expected in zip(results, ground_truth) if expected]
+    return float(np.mean(recalls)) if recalls else 0.0
+
+
+def _timed_query(index: VectorIndex, queries: np.ndarray, top_k: int):
+    start = time.perf_counter()
+    hits = [index.query(query, top_k)[0] for query in queries]
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return [[hit[0] for hit in query_hits] for query_hits in hits], elapsed_ms
+
+
+def run_benchmark(vectors: np.ndarray, queries: np.ndarray, top_k: int = 10,
+                  rerank_candidates: Sequence[int] = (50, 200, 500)) -> List[Dict]:
+    """在临时目录中分别建立 float32 / int8 / 二值索引，返回每种配置的测量结果"""
+    ids = [f"r{i}" for i in range(len(vectors))]
+    work_dir = tempfile.mkdtemp(prefix='rag-quant-bench-')
+    rows = []
+    try:
+        exact_index = VectorIndex(os.path.join(work_dir, 'exact'))
+        exact_index.add(ids, vectors)
+        ground_truth, exact_ms = _timed_query(exact_index, queries, top_k)
+        rows.append({'mode': QUANTIZATION_NONE, 'rerank': '-', 'recall': 1.0,
+                     'scan_bytes': exact_index.memory_usage()['vectors'], 'latency_ms': exact_ms})
+
+        for mode in (QUANTIZATION_INT8, QUANTIZATION_BINARY):
+            index = VectorIndex(os.path.join(work_dir, 'exact'), quantization=mode)
+            for candidates in rerank_candidates:
+                index.rerank_candidates = max(candidates, top_k)
+                results, elapsed_ms = _timed_query(index, queries, top_k)
+                rows.append({'mode': mode, 'rerank': index.rerank_candidates,
+                             'recall': recall_at_k(results, ground_truth),
+                             'scan_bytes': index.memory_usage()['codes'], 'latency_ms': elapsed_ms})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return rows
+
+
+def print_report(rows: List[Dict], top_k: int):
+    baseline = rows[0]['scan_bytes']
+    print(f"\n📊 量化检索基准（recall@{top_k} 以 float32 全量扫描为准）")
+    print(f"{'量化方式':<10}{'重排候选':>10}{'recall@k':>12}{'扫描内存(MB)':>16}{'压缩比':>10}{'延迟(ms)':>12}")
+    for row in rows:
+        print(f"{row['mode']:<10}{str(row['rerank']):>10}{row['recall']:>12.4f}"
+              f"{row['scan_bytes'] / 1e6:>16.2f}{baseline / max(row['scan_bytes'], 1):>9.1f}x{row['latency_ms']:>12.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rag benchmark-quantization', description="量化检索 recall@k / 内存 / 延迟基准")
+    parser.add_argument('--index-dir', default=os.path.join(DEFAULT_DB_PATH, 'vector_index'),
+                        help='现有NumPy向量索引目录（默认使用知识库目录下的 vector_index）')
+    parser.add_argument('--synthetic', type=int, default=0, help='使用指定条数的合成向量代替现有索引')
+    parser.add_argument('--dim', type=int, default=384, help='合成向量维度')
+    parser.add_argument('--queries', type=int, default=200, help='查询条数')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--rerank', type=int, nargs='+', default=[50, 200, 500], help='精确重排的候选数')
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        print(f"🧪 生成 {args.synthetic} 条 {args.dim} 维合成向量...")
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    else:
+        print(f"📂 读取向量索引: {args.index_dir}")
+        vectors = load_index_vectors(args.index_dir)
+    queries = sample_queries(vectors, args.queries)
+    print(f"🔍 {len(vectors)} 条向量，{len(queries)} 条查询，top_k={args.top_k}")
+
+    print_report(run_benchmark(vectors, queries, args.top_k, args.rerank), args.top_k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+知识库索引构建
+独立于 Flask 服务预先构建/增量同步向量索引，流式读取知识数据、分块编码写入，每块写入后更新清单，
+中断后重新运行会从已写入的位置继续。编码可使用多进程池或指定 PyTorch 线程数，结束时报告写入速度。
+
+用法（在 bach_end 目录下）：
+    python -m rag build-index
+    python -m rag build-index --workers 4 --batch-size 128 --chunk-size 2000
+    python -m rag build-index --backend numpy --sharded --rebuild
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from . import medical_rag
+from .embedding import SentenceTransformerEmbedder
+from .manifest import KnowledgeManifest
+from .medical_rag import DEFAULT_DB_PATH, MedicalKnowledgeBase, create_embedder, manifest_path
+
+
+class MultiProcessEmbedder:
+    """把建库编码分发到 sentence-transformers 多进程池的编码器包装
+
+    查询（use_cache=True）仍在当前进程中编码，其余接口与被包装的编码器一致。
+    """
+
+    def __init__(self, embedder: SentenceTransformerEmbedder, workers: int, device: str = 'cpu'):
+        self.embedder = embedder
+        self.workers = workers
+        self.pool = embedder.model.start_multi_process_pool([device] * workers)
+
+    @property
+    def model_id(self) -> str:
+        return self.embedder.model_id
+
+    @property
+    def model(self):
+        return self.embedder.model
+
+    @property
+    def dimension(self) -> int:
+        return self.embedder.dimension
+
+    def encode(self, texts: Sequence[str], batch_size: Optional[int] = None, use_cache: bool = False) -> np.ndarray:
+        texts = list(texts)
+        if use_cache or len(texts) < self.workers:
+            return self.embedder.encode(texts, batch_size=batch_size, use_cache=use_cache)
+        vectors = np.asarray(self.embedder.model.encode_multi_process(
+            texts, self.pool, batch_size=batch_size or self.embedder.batch_size), dtype=np.float32)
+        if self.embedder.normalize:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self.embedder(input)
+
+    def close(self):
+        self.embedder.model.stop_multi_process_pool(self.pool)
+
+
+def _set_torch_threads(threads: int):
+    """设置 PyTorch 算子内线程数（单进程编码时使用）"""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        print(f"🧵 PyTorch 线程数: {threads}")
+    except ImportError:
+        print("⚠️ 未安装 PyTorch，忽略线程数设置")
+
+
+def build_index(db_path: str = DEFAULT_DB_PATH, data_path: Optional[str] = None,
+                vector_backend: Optional[str] = None, sharded: Optional[bool] = None,
+                model_name: Optional[str] = None, device: Optional[str] = None,
+                batch_size: Optional[int] = None, chunk_size: Optional[int] = None,
+                workers: int = 1, threads: Optional[int] = None, rebuild: bool = False) -> Dict:
+    """构建或增量同步知识库索引，返回同步统计
+
+    Args:
+        db_path: 知识库目录
+        data_path: JSONL 知识数据文件，默认读取 RAG_KNOWLEDGE_DATA
+        vector_backend: 向量存储后端，默认读取 RAG_VECTOR_BACKEND
+        sharded: 是否按类别分片，默认读取 RAG_SHARDING
+        model_name / device / batch_size: 编码模型、设备和编码批大小
+        chunk_size: 每次写入向量存储并更新清单的记录数（断点粒度）
+        workers: 编码进程数，大于1时使用多进程池
+        threads: 单进程编码时的 PyTorch 线程数
+        rebuild: 清空清单，不装载索引制品，按知识数据全量重建
+    """
+    if data_path:
+        medical_rag.KNOWLEDGE_DATA_PATH = data_path
+    if chunk_size:
+        medical_rag.INDEX_ADD_CHUNK_SIZE = chunk_size
+    if threads:
+        _set_torch_threads(threads)
+
+    start = time.time()
+    embedder = create_embedder(db_path, model_name, device, batch_size)
+    pooled = None
+    if workers > 1:
+        print(f"⚙️ 启动 {workers} 个编码进程")
+        pooled = embedder = MultiProcessEmbedder(embedder, workers, device or 'cpu')
+    model_seconds = time.time() - start
+
+    if rebuild:
+        # 清单的模型标识置空后，同步时会清空向量存储并全量重建
+        KnowledgeManifest(manifest_path(
+            db_path,
+            vector_backend or medical_rag.VECTOR_BACKEND,
+            medical_rag.SHARDING_ENABLED if sharded is None else sharded
+        )).reset(None)
+        print("♻️ 已清空知识库清单，将全量重建索引")
+
+    try:
+        # 全量重建时不装载预构建的索引制品，否则清空后的知识库会直接装入制品中的旧向量
+        knowledge_base = MedicalKnowledgeBase(db_path=db_path, embedder=embedder, vector_backend=vector_backend,
+                                              sharded=sharded, use_artifact=not rebuild, index_only=True)
+    finally:
+        if pooled is not None:
+            pooled.close()
+
+    stats = dict(knowledge_base.sync_stats or {'added': 0, 'changed': 0, 'removed': 0, 'indexed': 0, 'seconds': 0.0})
+    stats['records'] = knowledge_base.get_knowledge_count()
+    stats['model_seconds'] = model_seconds
+    stats['total_seconds'] = time.time() - start
+    stats['records_per_second'] = stats['indexed'] / stats['seconds'] if stats['seconds'] else 0.0
+
+    print(f"\n📊 索引构建完成：共 {stats['records']} 条记录")
+    print(f"   新增 {stats['added']}，变更 {stats['changed']}，删除 {stats['removed']}，写入 {stats['indexed']} 条")
+    print(f"   模型加载 {model_seconds:.1f}s，编码写入 {stats['seconds']:.1f}s，总计 {stats['total_seconds']:.1f}s")
+    if stats['indexed']:
+        print(f"   ⚡ {stats['records_per_second']:.1f} 条/秒")
+    return stats
@@ -0,0 +1,185 @@
+"""
+基于SQLite的磁盘键值缓存
+同一台机器上的多个worker进程可共享同一个缓存文件（WAL模式）
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+
+class SQLiteCache:
+    """SQLite 键值缓存，支持命名空间、TTL 和条目数上限
+
+    Args:
+        path: 缓存文件路径
+        namespace: 命名空间，不同用途的缓存可共用一个文件
+        max_entries: 命名空间内的最大条目数，超出后按最近访问时间淘汰
+        ttl: 条目有效期（秒），None 表示永不过期
+    """
+
+    # 每写入多少次检查一次容量，避免每次写入都统计行数
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path: str, namespace: str = 'default',
+                 max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (namespace, accessed)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_meta ("
+            " namespace TEXT NOT NULL, name TEXT NOT NULL, value TEXT,"
+            " PRIMARY KEY (namespace, name))"
+        )
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取单个条目，不存在或已过期返回 None"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        """批量读取，返回命中的 key -> value"""
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        now = time.time()
+        found = {}
+        expired = []
+        with self._lock:
+            # SQLite 默认最多 999 个绑定参数，分批查询
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, value, created FROM cache_entries"
+                    f" WHERE namespace = ? AND key IN ({placeholders})",
+                    [self.namespace] + chunk
+                ).fetchall()
+                for key, value, created in rows:
+                    if self._expired(created, now):
+                        expired.append(key)
+                    else:
+                        found[key] = value
+
+            if found:
+                self._conn.executemany(
+                    "UPDATE cache_entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                    [(now, self.namespace, key) for key in found]
+                )
+            if expired:
+                self._conn.executemany(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                    [(self.namespace, key) for key in expired]
+                )
+        return found
+
+    def set(self, key: str, value: bytes):
+        """写入单个条目"""
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, bytes]):
+        """批量写入"""
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(self.namespace, key, sqlite3.Binary(value), now, now) for key, value in items.items()]
+            )
+            self._writes += len(items)
+            if self._writes >= self.PRUNE_INTERVAL:
+                self._writes = 0
+                self._prune_locked(now)
+
+    def delete(self, key: str):
+        """删除单个条目"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            )
+
+    def _prune_locked(self, now: float):
+        """清理过期条目，并按最近访问时间淘汰超出上限的条目"""
+        if self.ttl is not None:
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND created < ?",
+                (self.namespace, now - self.ttl)
+            )
+        if self.max_entries is not None:
+            count = self._conn.execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM cache_entries WHERE rowid IN ("
+                    " SELECT rowid FROM cache_entries WHERE namespace = ?"
+                    " ORDER BY accessed ASC LIMIT ?)",
+                    (self.namespace, overflow)
+                )
+
+    def prune(self):
+        """立即执行一次清理"""
+        with self._lock:
+            self._prune_locked(time.time())
+
+    def clear(self):
+        """清空当前命名空间的所有条目"""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def get_meta(self, name: str) -> Optional[str]:
+        """读取命名空间级别的元数据"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache_meta WHERE namespace = ? AND name = ?",
+                (self.namespace, name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name: str, value: str):
+        """写入命名空间级别的元数据"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_meta (namespace, name, value) VALUES (?, ?, ?)",
+                (self.namespace, name, value)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,235 @@
+"""
+紧凑的知识记录存储（docstore）
+按列保存全部知识字段，向量库只保存记录ID。疾病类别和症状/诊断方法/影像表现等短词条
+统一驻留（intern）到词表中，列表字段以 array('I') 词表编号 + 偏移量保存；
+检索命中时才按需还原为字典，整个存储序列化为单个二进制文件。
+每条记录还保存建库时预渲染的知识片段（见 snippets.py），请求时格式化知识上下文不再拼接字符串。
+
+二进制格式（不使用 pickle，docstore 会随索引制品分发，加载时不能执行任意代码）：
+    8 字节魔数 MEDDOCST
+    4 字节小端 uint32：头部JSON长度
+    头部JSON：格式版本、指纹、记录ID、类别、词表、文本列、预渲染片段，以及各编号数组的类型码和长度
+    编号数组：按头部中的顺序依次存放的小端原始字节
+"""
+
+import json
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from .snippets import SNIPPET_STYLES
+
+DOCSTORE_MAGIC = b'MEDDOCST'
+DOCSTORE_FORMAT_VERSION = 3
+
+# 以字符串保存的字段
+TEXT_FIELDS = ('disease', 'causes', 'prevention', 'treatment', 'severity', 'description')
+# 以逗号分隔、按词条保存的列表字段
+LIST_FIELDS = ('symptoms', 'diagnosis_methods', 'imaging_findings')
+LIST_SEPARATOR = ', '
+
+
+class KnowledgeDocStore:
+    """列式知识记录存储
+
+    每条记录占用：类别编号（array('H')）、各文本字段一个字符串引用、各列表字段在编号数组中的一段，
+    以及每种样式一个预渲染片段。
+    同ID重复添加时追加新行并指向新行，旧行不再被引用。
+    """
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.fingerprint: Optional[str] = None
+        self._id_to_row: Dict[str, int] = {}
+        self._categories: List[str] = []
+        self._category_codes = array('H')
+        self._vocab: List[str] = []
+        self._vocab_index: Dict[str, int] = {}
+        self._text: Dict[str, List[str]] = {field: [] for field in TEXT_FIELDS}
+        self._list_codes: Dict[str, array] = {field: array('I') for field in LIST_FIELDS}
+        self._list_offsets: Dict[str, array] = {field: array('I', [0]) for field in LIST_FIELDS}
+        self._snippets: Dict[str, List[str]] = {style: [] for style in SNIPPET_STYLES}
+
+    def __len__(self) -> int:
+        return len(self._id_to_row)
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self._id_to_row
+
+    @property
+    def record_ids(self) -> List[str]:
+        """当前有效的记录ID（重复添加的记录只出现一次）"""
+        return list(self._id_to_row)
+
+    def _intern(self, term: str) -> int:
+        code = self._vocab_index.get(term)
+        if code is None:
+            code = len(self._vocab)
+            term = sys.intern(term)
+            self._vocab.append(term)
+            self._vocab_index[term] = code
+        return code
+
+    def _category_code(self, category: str) -> int:
+        try:
+            return self._categories.index(category)
+        except ValueError:
+            self._categories.append(sys.intern(category))
+            return len(self._categories) - 1
+
+    def add(self, ids: Sequence[str], metadatas: Iterable[Dict], snippets: Optional[Iterable[Dict[str, str]]] = None):
+        """添加记录
+
+        Args:
+            ids: 记录ID
+            metadatas: 向量库格式的 metadata（列表字段以 ', ' 连接的字符串）
+            snippets: 每条记录 {样式: 预渲染片段}，未提供时不保存片段
+        """
+        if snippets is None:
+            snippets = ({} for _ in ids)
+        for record_id, metadata, record_snippets in zip(ids, metadatas, snippets):
+            row = len(self.ids)
+            self.ids.append(record_id)
+            self._id_to_row[record_id] = row
+            self._category_codes.append(self._category_code(metadata.get('category', '')))
+            for field in TEXT_FIELDS:
+                value = metadata.get(field) or ''
+                self._text[field].append(sys.intern(value) if field == 'disease' else value)
+            for field in LIST_FIELDS:
+                value = metadata.get(field) or ''
+                terms = value.split(LIST_SEPARATOR) if isinstance(value, str) else list(value)
+                codes = self._list_codes[field]
+                codes.extend(self._intern(term) for term in terms if term)
+                self._list_offsets[field].append(len(codes))
+            for style in SNIPPET_STYLES:
+                self._snippets[style].append(record_snippets.get(style, ''))
+
+    def _list_field(self, row: int, field: str) -> List[str]:
+        offsets = self._list_offsets[field]
+        vocab = self._vocab
+        return [vocab[code] for code in self._list_codes[field][offsets[row]:offsets[row + 1]]]
+
+    def category(self, record_id: str) -> Optional[str]:
+        row = self._id_to_row.get(record_id)
+        return self._categories[self._category_codes[row]] if row is not None else None
+
+    def record_terms(self, record_id: str) -> List[str]:
+        """记录的疾病名与症状列表（不构造完整记录）"""
+        row = self._id_to_row.get(record_id)
+        if row is None:
+            return []
+        return [self._text['disease'][row]] + self._list_field(row, 'symptoms')
+
+    def snippet(self, record_id: str, style: str) -> Optional[str]:
+        """记录的预渲染片段，记录不存在或未保存片段时返回 None"""
+        row = self._id_to_row.get(record_id)
+        if row is None:
+            return None
+        return self._snippets[style][row] or None
+
+    def get_metadata(self, record_id: str) -> Optional[Dict]:
+        """按需还原为向量库格式的 metadata 字典，记录不存在时返回 None"""
+        row = self._id_to_row.get(record_id)
+        if row is None:
+            return None
+        metadata = {
+            'id': f"{self._categories[self._category_codes[row]]}_{self._text['disease'][row]}",
+            'record_id': record_id,
+            'category': self._categories[self._category_codes[row]],
+        }
+        for field in TEXT_FIELDS:
+            metadata[field] = self._text[field][row]
+        for field in LIST_FIELDS:
+            metadata[field] = LIST_SEPARATOR.join(self._list_field(row, field))
+        return metadata
+
+    def iter_metadata(self) -> Iterator[Dict]:
+        """逐条还原全部记录的 metadata（用于构建词法/症状索引）"""
+        for record_id in self._id_to_row:
+            yield self.get_metadata(record_id)
+
+    def _arrays(self) -> Dict[str, array]:
+        """需要按原始字节保存的编号数组"""
+        arrays = {'category_codes': self._category_codes}
+        for field in LIST_FIELDS:
+            arrays[f'list_codes.{field}'] = self._list_codes[field]
+            arrays[f'list_offsets.{field}'] = self._list_offsets[field]
+        return arrays
+
+    def to_bytes(self) -> bytes:
+        """序列化为二进制：字符串列存为JSON，编号数组存为原始字节"""
+        arrays = self._arrays()
+        header = {
+            'version': DOCSTORE_FORMAT_VERSION,
+            'fingerprint': self.fingerprint,
+            'ids': self.ids,
+            'categories': self._categories,
+            'vocab': self._vocab,
+            'text': self._text,
+            'snippets': self._snippets,
+            'arrays': [[name, values.typecode, len(values)] for name, values in arrays.items()],
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        chunks = [DOCSTORE_MAGIC, struct.pack('<I', len(header_bytes)), header_bytes]
+        for values in arrays.values():
+            if sys.byteorder == 'big':
+                values = array(values.typecode, values)
+                values.byteswap()
+            chunks.append(values.tobytes())
+        return b''.join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Optional['KnowledgeDocStore']:
+        """从二进制还原，格式版本不符（包括旧版 pickle 格式）时返回 None，数据损坏时抛出 ValueError"""
+        prefix = len(DOCSTORE_MAGIC) + 4
+        if len(data) < prefix or data[:len(DOCSTORE_MAGIC)] != DOCSTORE_MAGIC:
+            return None
+        header_length, = struct.unpack_from('<I', data, len(DOCSTORE_MAGIC))
+        header = json.loads(data[prefix:prefix + header_length])
+        if header.get('version') != DOCSTORE_FORMAT_VERSION:
+            return None
+
+        arrays = {}
+        position = prefix + header_length
+        for name, typecode, count in header['arrays']:
+            values = array(typecode)
+            end = position + count * values.itemsize
+            if end > len(data):
+                raise ValueError(f"docstore 数据不完整: {name}")
+            values.frombytes(data[position:end])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            arrays[name] = values
+            position = end
+
+        store = cls()
+        store.fingerprint = header['fingerprint']
+        store.ids = header['ids']
+        store._id_to_row = {record_id: row for row, record_id in enumerate(store.ids)}
+        store._categories = [sys.intern(category) for category in header['categories']]
+        store._category_codes = arrays['category_codes']
+        store._vocab = [sys.intern(term) for term in header['vocab']]
+        store._vocab_index = {term: code for code, term in enumerate(store._vocab)}
+        store._text = header['text']
+        store._text['disease'] = [sys.intern(disease) for disease in store._text['disease']]
+        store._list_codes = {field: arrays[f'list_codes.{field}'] for field in LIST_FIELDS}
+        store._list_offsets = {field: arrays[f'list_offsets.{field}'] for field in LIST_FIELDS}
+        store._snippets = header['snippets']
+        return store
+
+    def save(self, path: str):
+        """保存为单个二进制文件（写临时文件后原子替换）"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['KnowledgeDocStore']:
+        """从二进制文件加载，文件不存在或格式版本不符时返回 None"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
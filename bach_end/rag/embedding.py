@@ -0,0 +1,203 @@
+"""
+句向量编码后端
+知识库建库和查询都通过同一个编码器完成，保证每个进程只加载一份模型
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .disk_cache import SQLiteCache
+
+# 编码器默认配置（可通过环境变量覆盖）
+DEFAULT_EMBEDDING_MODEL = os.environ.get('RAG_EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+DEFAULT_EMBEDDING_DEVICE = os.environ.get('RAG_EMBEDDING_DEVICE') or None  # None 表示自动选择 CPU/GPU
+DEFAULT_EMBEDDING_BATCH_SIZE = int(os.environ.get('RAG_EMBEDDING_BATCH_SIZE', '64'))
+
+# 查询向量缓存配置
+EMBEDDING_CACHE_SIZE = int(os.environ.get('RAG_EMBEDDING_CACHE_SIZE', '4096'))
+EMBEDDING_DISK_CACHE_ENABLED = os.environ.get('RAG_EMBEDDING_DISK_CACHE', '1') == '1'
+EMBEDDING_DISK_CACHE_MAX_ENTRIES = int(os.environ.get('RAG_EMBEDDING_DISK_CACHE_MAX_ENTRIES', '200000'))
+
+
+def normalize_query_text(text: str) -> str:
+    """规范化查询文本：去除首尾空白并合并连续空白"""
+    return ' '.join(text.split())
+
+
+class EmbeddingCache:
+    """查询向量缓存：进程内LRU + 可选的SQLite磁盘缓存
+
+    缓存键为 sha1(模型标识 + 规范化文本)，模型变化时旧条目自然失效；
+    磁盘缓存还会记录模型标识，发现模型变化时直接清空。
+    """
+
+    def __init__(self, model_id: str, max_entries: int = EMBEDDING_CACHE_SIZE,
+                 disk_path: Optional[str] = None,
+                 disk_max_entries: Optional[int] = EMBEDDING_DISK_CACHE_MAX_ENTRIES):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.disk = None
+        if disk_path:
+            self.disk = SQLiteCache(disk_path, namespace='query_embeddings', max_entries=disk_max_entries)
+            if self.disk.get_meta('model_id') != model_id:
+                self.disk.clear()
+                self.disk.set_meta('model_id', model_id)
+
+    def make_key(self, text: str) -> str:
+        """生成缓存键"""
+        raw = f"{self.model_id}\x00{normalize_query_text(text)}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """批量查询缓存，未命中的位置为 None"""
+        keys = [self.make_key(text) for text in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        pending: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = vector
+                    self.hits += 1
+                else:
+                    pending.setdefault(key, []).append(i)
+
+        if pending and self.disk is not None:
+            found = self.disk.get_many(pending.keys())
+            with self._lock:
+                for key, blob in found.items():
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    for i in pending.pop(key):
+                        results[i] = vector
+                        self.hits += 1
+                        self.disk_hits += 1
+
+        with self._lock:
+            self.misses += sum(len(positions) for positions in pending.values())
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        """写入缓存"""
+        items = {}
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(text)
+                vector = np.array(vector, dtype=np.float32)
+                vector.setflags(write=False)
+                self._remember(key, vector)
+                items[key] = vector.tobytes()
+        if self.disk is not None:
+            self.disk.set_many(items)
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """清空内存与磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'model_id': self.model_id,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'memory_entries': len(self._memory),
+            }
+
+
+class SentenceTransformerEmbedder:
+    """基于 sentence-transformers 的编码器
+
+    同时实现 ChromaDB 的 EmbeddingFunction 协议（``__call__(input)``），
+    可直接作为集合的 embedding_function 使用，ChromaDB 不会再加载自带的默认模型。
+    """
+
+    def __init__(self, model_name: Optional[str] = None, device: Optional[str] = None,
+                 batch_size: Optional[int] = None, normalize: bool = True,
+                 cache_size: int = EMBEDDING_CACHE_SIZE, cache_path: Optional[str] = None):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name or DEFAULT_EMBEDDING_MODEL
+        self.device = device or DEFAULT_EMBEDDING_DEVICE
+        self.batch_size = batch_size or DEFAULT_EMBEDDING_BATCH_SIZE
+        self.normalize = normalize
+        self.model = SentenceTransformer(self.model_name, device=self.device)
+        self.cache = EmbeddingCache(self.model_id, max_entries=cache_size, disk_path=cache_path) if cache_size > 0 else None
+
+    @property
+    def model_id(self) -> str:
+        """模型标识，模型名或归一化方式变化时随之变化"""
+        return f"{self.model_name}|normalize={int(self.normalize)}"
+
+    @property
+    def dimension(self) -> int:
+        """向量维度"""
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Sequence[str], batch_size: Optional[int] = None,
+               use_cache: bool = False) -> np.ndarray:
+        """批量编码文本，返回 float32 矩阵（每行一个向量）
+
+        Args:
+            texts: 待编码文本
+            batch_size: 编码批大小，默认使用初始化时的配置
+            use_cache: 是否使用查询向量缓存（建库时不使用，避免挤占查询缓存）
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        if not use_cache or self.cache is None:
+            return self._encode_uncached(texts, batch_size)
+
+        cached = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            fresh = self._encode_uncached([texts[i] for i in missing], batch_size)
+            self.cache.put_many([texts[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                cached[i] = vector
+        return np.vstack(cached).astype(np.float32, copy=False)
+
+    def _encode_uncached(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        vectors = self.model.encode(
+            texts,
+            batch_size=batch_size or self.batch_size,
+            normalize_embeddings=self.normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+    def cache_stats(self) -> Dict[str, float]:
+        """查询向量缓存的命中统计"""
+        return self.cache.stats() if self.cache is not None else {}
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        """ChromaDB EmbeddingFunction 协议入口（仅用于查询，走缓存）"""
+        return self.encode(input, use_cache=True).tolist()
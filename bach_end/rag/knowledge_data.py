@@ -0,0 +1,148 @@
+"""
+知识数据文件 - JSONL + 偏移量索引
+数据处理脚本把每条知识写成一行JSON，并在同名 .idx 文件中记录每行的字节偏移量。
+读取时只在需要时打开文件：建库时逐行流式解析，按序号随机访问时通过 mmap 定位，
+导入 rag 包不再需要编译和常驻整个数据集。
+
+.idx 文件头记录生成索引时数据文件的大小和修改时间；数据文件被编辑过（与文件头不符）时
+偏移量已失效，读取时重新扫描数据文件并重写索引。
+"""
+
+import json
+import mmap
+import os
+import struct
+from array import array
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# 默认的大规模知识数据文件
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+DEFAULT_KNOWLEDGE_DATA_PATH = os.path.join(DATA_DIR, 'large_medical_knowledge.jsonl')
+
+INDEX_SUFFIX = '.idx'
+# 索引文件头：魔数 + 数据文件大小 + 数据文件修改时间（纳秒），之后是每行的偏移量
+INDEX_MAGIC = b'KDIDX001'
+_INDEX_HEADER = struct.Struct('<8sQQ')
+
+
+def _data_stamp(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _write_index(index_path: str, offsets: array, stamp: Tuple[int, int]):
+    with open(index_path + '.tmp', 'wb') as f:
+        f.write(_INDEX_HEADER.pack(INDEX_MAGIC, *stamp))
+        offsets.tofile(f)
+    os.replace(index_path + '.tmp', index_path)
+
+
+def _read_index(index_path: str, stamp: Tuple[int, int]) -> Optional[array]:
+    """读取偏移量索引；索引不存在、格式不符或与数据文件不一致时返回 None"""
+    try:
+        with open(index_path, 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+    if len(raw) < _INDEX_HEADER.size:
+        return None
+    magic, size, mtime_ns = _INDEX_HEADER.unpack_from(raw)
+    if magic != INDEX_MAGIC or (size, mtime_ns) != stamp:
+        return None
+    offsets = array('Q')
+    offsets.frombytes(raw[_INDEX_HEADER.size:])
+    return offsets
+
+
+def _scan_offsets(path: str) -> array:
+    """扫描一遍数据文件，记录每个非空行的起始偏移量"""
+    offsets = array('Q')
+    with open(path, 'rb') as f:
+        position = 0
+        for line in f:
+            if line.strip():
+                offsets.append(position)
+            position += len(line)
+    return offsets
+
+
+def write_knowledge_data(records: Iterable[Dict], path: str) -> int:
+    """写出 JSONL 数据文件和偏移量索引（写临时文件后原子替换），返回记录数"""
+    offsets = array('Q')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        for record in records:
+            offsets.append(f.tell())
+            f.write(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+            f.write(b'\n')
+    # 替换不改变文件的大小和修改时间，索引头按临时文件记录
+    _write_index(path + INDEX_SUFFIX, offsets, _data_stamp(path + '.tmp'))
+
+    os.replace(path + '.tmp', path)
+    return len(offsets)
+
+
+class KnowledgeDataFile:
+    """只读的 JSONL 知识数据文件
+
+    - ``len()`` 只读取偏移量索引
+    - 迭代时逐行解析，不在内存中保留已解析的记录
+    - ``[i]`` 通过偏移量在 mmap 中定位单条记录；数据文件在读取期间被修改时重新加载偏移量
+    """
+
+    def __init__(self, path: str = DEFAULT_KNOWLEDGE_DATA_PATH):
+        self.path = path
+        self._offsets: Optional[array] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._mmap: Optional[mmap.mmap] = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _load_offsets(self) -> array:
+        stamp = _data_stamp(self.path)
+        if self._offsets is not None and stamp != self._stamp:
+            # 数据文件已被修改：丢弃旧的偏移量和映射
+            self.close()
+            self._offsets = None
+        if self._offsets is None:
+            index_path = self.path + INDEX_SUFFIX
+            offsets = _read_index(index_path, stamp)
+            if offsets is None:
+                # 没有索引文件或索引已失效时扫描一遍数据文件重建
+                offsets = _scan_offsets(self.path)
+                try:
+                    _write_index(index_path, offsets, stamp)
+                except OSError:
+                    pass
+            self._offsets = offsets
+            self._stamp = stamp
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self._load_offsets())
+
+    def __iter__(self) -> Iterator[Dict]:
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def __getitem__(self, index: int) -> Dict:
+        offsets = self._load_offsets()
+        if self._mmap is None:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = offsets[index]
+        end = self._mmap.find(b'\n', start)
+        return json.loads(self._mmap[start:end if end != -1 else len(self._mmap)])
+
+    def fingerprint(self) -> str:
+        """文件名 + 大小 + 修改时间"""
+        stat = os.stat(self.path)
+        return f"{os.path.basename(self.path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
@@ -0,0 +1,158 @@
+"""
+词法检索 - 基于jieba分词的BM25倒排索引
+加载项目自带的疾病词典(disease.txt)和症状词典(symptom.txt)，保证医学术语作为整体切分，
+并提供与向量检索结果融合的倒数排名融合(RRF)
+"""
+
+import math
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 医学词典路径（位于 bach_end 目录下）
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DISEASE_DICT_PATH = os.path.join(BACKEND_DIR, 'disease.txt')
+SYMPTOM_DICT_PATH = os.path.join(BACKEND_DIR, 'symptom.txt')
+
+# 检索时忽略的常见虚词和模板词
+STOPWORDS = {
+    '的', '了', '和', '与', '及', '或', '等', '是', '在', '有', '无', '可', '见', '为', '伴', '伴有',
+    '患者', '出现', '症状', '表现', '可能', '观察', '观察到', '影像', '类型', '区域', '程度', '异常',
+}
+
+_TOKEN_PATTERN = re.compile(r'\w')
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_medical_tokenizer():
+    """获取加载了医学词典的jieba分词器（进程内单例，不影响全局jieba词典）"""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                import jieba
+
+                tokenizer = jieba.Tokenizer()
+                for path in (DISEASE_DICT_PATH, SYMPTOM_DICT_PATH):
+                    if os.path.exists(path):
+                        tokenizer.load_userdict(path)
+                _tokenizer = tokenizer
+    return _tokenizer
+
+
+def tokenize(text: str) -> List[str]:
+    """分词并过滤标点、停用词"""
+    tokens = []
+    for token in get_medical_tokenizer().lcut_for_search(text.lower()):
+        token = token.strip()
+        if token and token not in STOPWORDS and _TOKEN_PATTERN.search(token):
+            tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """BM25倒排索引
+
+    构建时记录每个词的倒排表（文档序号 + 词频），首次查询时把倒排表转换为NumPy数组并
+    预先计算每个posting的BM25权重；查询只需对命中词的权重做累加。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self._id_to_doc: Dict[str, int] = {}
+        self._doc_lengths: List[int] = []
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._weights: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, ids: Sequence[str], texts: Iterable[str]):
+        """添加文档（同ID文档会被覆盖）"""
+        for record_id, text in zip(ids, texts):
+            if record_id in self._id_to_doc:
+                self._remove_doc(self._id_to_doc[record_id])
+                doc = self._id_to_doc[record_id]
+            else:
+                doc = len(self.ids)
+                self.ids.append(record_id)
+                self._doc_lengths.append(0)
+                self._id_to_doc[record_id] = doc
+
+            tokens = tokenize(text)
+            self._doc_lengths[doc] = len(tokens)
+            for token in tokens:
+                postings = self._postings.setdefault(token, {})
+                postings[doc] = postings.get(doc, 0) + 1
+        self._weights = None
+
+    def _remove_doc(self, doc: int):
+        for term in list(self._postings):
+            postings = self._postings[term]
+            if postings.pop(doc, None) is not None and not postings:
+                del self._postings[term]
+
+    def _finalize(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """将倒排表转换为 (文档序号数组, BM25权重数组)"""
+        doc_count = len(self.ids)
+        doc_lengths = np.asarray(self._doc_lengths, dtype=np.float32)
+        avgdl = float(doc_lengths.mean()) if doc_count else 0.0
+
+        weights = {}
+        for term, postings in self._postings.items():
+            docs = np.fromiter(postings.keys(), dtype=np.int32, count=len(postings))
+            tf = np.fromiter(postings.values(), dtype=np.float32, count=len(postings))
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[docs] / max(avgdl, 1e-6))
+            weights[term] = (docs, (idf * tf * (self.k1 + 1) / (tf + norm)).astype(np.float32))
+        return weights
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """返回 [(id, bm25分数)]，按分数降序"""
+        if self._weights is None:
+            self._weights = self._finalize()
+        if not self.ids:
+            return []
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self._weights.get(term)
+            if entry is not None:
+                docs, weights = entry
+                scores[docs] += weights
+
+        matched = np.flatnonzero(scores)
+        if len(matched) == 0:
+            return []
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(self.ids[doc], float(scores[doc])) for doc in matched]
+
+    def search_many(self, queries: Sequence[str], top_k: int) -> List[List[Tuple[str, float]]]:
+        """批量查询"""
+        return [self.search(query, top_k) for query in queries]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """倒数排名融合：score(id) = Σ 1 / (k + rank)，rank 从1开始
+
+    Args:
+        rankings: 多路检索结果，每路为按相关度降序的ID列表
+        k: 平滑常数，越大越弱化头部排名的优势
+
+    Returns:
+        按融合分数降序的 [(id, score)]
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, record_id in enumerate(ranking, 1):
+            scores[record_id] = scores.get(record_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,115 @@
+"""
+知识库清单（manifest）
+记录向量存储中每条知识的稳定ID和内容哈希，启动时与当前知识数据对比，
+只对新增/变更的记录重新编码写入，并删除已移除的记录，避免每次修改知识都全量重建索引。
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+MANIFEST_VERSION = 1
+
+
+def stable_record_id(knowledge: Dict, seen: Dict[str, int]) -> str:
+    """生成稳定的记录ID
+
+    优先使用数据自带的 id，否则由 类别|疾病名 哈希生成；同一批数据中重复的ID依次追加 #2、#3……
+    ``seen`` 用于记录本批数据中已出现的ID。
+    """
+    base_id = knowledge.get('id')
+    if not base_id:
+        key = f"{knowledge.get('category', '')}|{knowledge.get('disease', '')}"
+        base_id = 'kb_' + hashlib.md5(key.encode('utf-8')).hexdigest()[:16]
+
+    occurrence = seen.get(base_id, 0) + 1
+    seen[base_id] = occurrence
+    return base_id if occurrence == 1 else f"{base_id}#{occurrence}"
+
+
+def content_hash(document: str, metadata: Dict) -> str:
+    """记录内容哈希（文档文本 + metadata）"""
+    payload = json.dumps([document, metadata], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class KnowledgeManifest:
+    """向量存储的内容清单
+
+    文件内容：
+        version     清单格式版本
+        model_id    建库时的编码模型标识，模型变化时需要全量重建
+        records     {记录ID: 内容哈希}，来自知识数据文件的记录
+        runtime     {记录ID: 内容哈希}，运行时通过 add_knowledge 添加的记录，同步时不会被删除
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.model_id = None
+        self.records: Dict[str, str] = {}
+        self.runtime: Dict[str, str] = {}
+        self.exists = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.from_dict(json.load(f))
+
+    def from_dict(self, data: Dict):
+        """从清单内容还原（格式版本不符时忽略）"""
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        self.model_id = data.get('model_id')
+        self.records = data.get('records', {})
+        self.runtime = data.get('runtime', {})
+        self.exists = True
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': MANIFEST_VERSION,
+            'model_id': self.model_id,
+            'records': self.records,
+            'runtime': self.runtime,
+        }
+
+    def save(self):
+        """写临时文件后原子替换"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+        self.exists = True
+
+    def reset(self, model_id: str):
+        """清空清单（全量重建前调用）"""
+        self.model_id = model_id
+        self.records = {}
+        self.runtime = {}
+        self.save()
+
+    def diff(self, ids: Sequence[str], hashes: Sequence[str]) -> Tuple[List[int], List[int], List[str]]:
+        """与当前数据对比
+
+        Returns:
+            (新增记录下标, 变更记录下标, 已移除的记录ID)
+        """
+        added, changed = [], []
+        for i, (record_id, digest) in enumerate(zip(ids, hashes)):
+            previous = self.records.get(record_id)
+            if previous is None:
+                added.append(i)
+            elif previous != digest:
+                changed.append(i)
+        current = set(ids)
+        removed = [record_id for record_id in self.records if record_id not in current]
+        return added, changed, removed
+
+    def update(self, ids: Iterable[str], hashes: Iterable[str]):
+        self.records.update(zip(ids, hashes))
+
+    def remove(self, ids: Iterable[str]):
+        for record_id in ids:
+            self.records.pop(record_id, None)
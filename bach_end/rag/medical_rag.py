@@ -3,14 +3,26 @@
 """
 
 import os
-import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from typing import List, Dict, Any
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
-import jieba
-import re
+from typing import List, Dict, Any, Optional
+
+from .embedding import SentenceTransformerEmbedder, EMBEDDING_DISK_CACHE_ENABLED
+from .vector_index import ChromaVectorStore, VectorIndex, close_chroma_client
+from .sharding import ShardedVectorStore
+from .manifest import KnowledgeManifest, content_hash, stable_record_id
+from .docstore import KnowledgeDocStore
+from .artifact import (ARTIFACT_FINGERPRINT_PREFIX, DEFAULT_ARTIFACT_PATH, KnowledgeArtifact, file_sha256,
+                       write_artifact)
+from .knowledge_data import DATA_DIR, DEFAULT_KNOWLEDGE_DATA_PATH, KnowledgeDataFile
+from .result_cache import RetrievalResultCache
+from .snippets import RENDERERS, SNIPPET_DIAGNOSIS, SNIPPET_MARKDOWN, render_snippets
+from .lexical import BM25Index, reciprocal_rank_fusion
+from .term_matcher import MedicalTerms, get_term_matcher
+from .symptom_index import SymptomInvertedIndex, PREFILTER_NONE, PREFILTER_MODES
+from .reranker import CrossEncoderReranker, RERANKER_ENABLED, RERANK_CANDIDATES
 
 # 导入日志功能
 try:
@@ -21,162 +33,534 @@ except ImportError:
     def log_error(msg, exc_info=False): pass
     def log_rag_operation(operation, query, score=None, count=None): pass
 
-# 医学知识库数据导入
-try:
-    from .data.large_medical_knowledge_data import LARGE_MEDICAL_KNOWLEDGE_DATABASE
-except ImportError:
-    try:
-        from .data.medical_knowledge_data import MEDICAL_KNOWLEDGE_DATABASE
-    except ImportError:
-        LARGE_MEDICAL_KNOWLEDGE_DATABASE = None
-        MEDICAL_KNOWLEDGE_DATABASE = None
+# 医学知识数据来源（按优先级）：
+# 1. process_large_medical_data.py 生成的 JSONL 数据文件（可通过 RAG_KNOWLEDGE_DATA 指定路径）
+# 2. 旧版的 large_medical_knowledge_data.py（Python字面量）
+# 3. 原医学知识库 medical_knowledge_data.py
+# 数据只在建库/同步时才读取，导入本模块不加载任何知识数据
+KNOWLEDGE_DATA_PATH = os.environ.get('RAG_KNOWLEDGE_DATA', DEFAULT_KNOWLEDGE_DATA_PATH)
+LEGACY_LARGE_DATA_PATH = os.path.join(DATA_DIR, 'large_medical_knowledge_data.py')
+SMALL_DATA_PATH = os.path.join(DATA_DIR, 'medical_knowledge_data.py')
+
+# 知识库持久化目录（相对于 bach_end 运行目录）
+DEFAULT_DB_PATH = "./rag/data/medical_knowledge_db"
+
+# 建库时每次写入向量数据库的记录数
+INDEX_ADD_CHUNK_SIZE = int(os.environ.get('RAG_INDEX_ADD_CHUNK_SIZE', '1000'))
+
+# 向量存储后端："chroma"（默认，ChromaDB）或 "numpy"（内存映射NumPy索引）
+VECTOR_BACKEND = os.environ.get('RAG_VECTOR_BACKEND', 'chroma')
+# NumPy索引的向量存储精度："float32" 或 "float16"
+VECTOR_INDEX_DTYPE = os.environ.get('RAG_VECTOR_INDEX_DTYPE', 'float32')
+# NumPy索引的首轮检索量化："none"（默认）、"int8" 或 "binary"；量化粗排后用原始向量精确重排前 N 个候选
+VECTOR_QUANTIZATION = os.environ.get('RAG_VECTOR_QUANTIZATION', 'none')
+QUANTIZED_RERANK_CANDIDATES = int(os.environ.get('RAG_QUANTIZED_RERANK_CANDIDATES', '200'))
+
+# 按疾病类别分片：每个类别一个集合/索引目录，查询按类别质心路由到最相近的若干分片并行检索
+SHARDING_ENABLED = os.environ.get('RAG_SHARDING', '0') == '1'
+SHARD_ROUTE_TOP_N = int(os.environ.get('RAG_SHARD_ROUTE_TOP_N', '3'))
+SHARD_MAX_WORKERS = int(os.environ.get('RAG_SHARD_MAX_WORKERS', '4'))
+
+# 预构建索引制品：知识库为空时直接装载（编码模型需一致），不运行编码模型；置空则禁用
+INDEX_ARTIFACT_PATH = os.environ.get('RAG_INDEX_ARTIFACT', DEFAULT_ARTIFACT_PATH)
+# 装载前校验制品各数据段的 sha256
+INDEX_ARTIFACT_VERIFY = os.environ.get('RAG_INDEX_ARTIFACT_VERIFY', '1') == '1'
+
+# 混合检索：BM25词法检索与向量检索按倒数排名融合(RRF)
+HYBRID_SEARCH_ENABLED = os.environ.get('RAG_HYBRID_SEARCH', '1') == '1'
+# 每路检索召回的候选数 = max(top_k * 倍数, 下限)
+HYBRID_CANDIDATE_MULTIPLIER = 5
+HYBRID_MIN_CANDIDATES = 20
+RRF_K = 60
+# 查询中识别出的症状/疾病术语与记录精确命中时，每个命中词增加的排序分（约等于在一路检索中排第1）
+TERM_MATCH_BOOST = 1.0 / (RRF_K + 1)
+
+# 症状倒排索引预过滤："none"（默认关闭）、"union" 或 "intersection"
+SYMPTOM_PREFILTER = os.environ.get('RAG_SYMPTOM_PREFILTER', PREFILTER_NONE)
+# 预过滤最多保留的候选记录数
+PREFILTER_MAX_CANDIDATES = int(os.environ.get('RAG_PREFILTER_MAX_CANDIDATES', '500'))
+
+
+def _join_field(value, default: str = '') -> str:
+    """将列表字段转换为逗号分隔字符串（ChromaDB metadata 不支持列表）"""
+    if isinstance(value, (list, tuple)):
+        return ', '.join(value) if value else default
+    return value if value else default
+
+
+def manifest_path(db_path: str, vector_backend: str, sharded: bool) -> str:
+    """清单文件路径（每种向量存储布局各一份）"""
+    layout = f"{vector_backend}-sharded" if sharded else vector_backend
+    return os.path.join(db_path, f"manifest-{layout}.json")
+
+
+def create_embedder(db_path: str = DEFAULT_DB_PATH, model_name: str = None, device: str = None,
+                    batch_size: int = None) -> SentenceTransformerEmbedder:
+    """创建知识库使用的编码器（查询向量磁盘缓存放在知识库目录下）"""
+    return SentenceTransformerEmbedder(
+        model_name=model_name,
+        device=device,
+        batch_size=batch_size,
+        cache_path=os.path.join(db_path, "embedding_cache.sqlite3") if EMBEDDING_DISK_CACHE_ENABLED else None
+    )
 
 
 class MedicalKnowledgeBase:
     """医学知识库管理器"""
     
-    def __init__(self, db_path: str = "./rag/data/medical_knowledge_db"):
+    def __init__(self, db_path: str = DEFAULT_DB_PATH,
+                 embedding_model_name: str = None, device: str = None,
+                 batch_size: int = None, embedder=None, vector_backend: str = None,
+                 hybrid_search: bool = None, sharded: bool = None, reranker=None,
+                 use_artifact: bool = True, index_only: bool = False):
+        """
+        Args:
+            db_path: 知识库持久化路径
+            embedding_model_name: 句向量模型名称（默认 all-MiniLM-L6-v2）
+            device: 模型运行设备，如 "cpu"、"cuda"，默认自动选择
+            batch_size: 建库时的编码批大小
+            embedder: 自定义编码器，需提供 encode()/model_id 并实现 ChromaDB EmbeddingFunction 协议
+            vector_backend: 向量存储后端，"chroma" 或 "numpy"，默认读取 RAG_VECTOR_BACKEND
+            hybrid_search: 是否融合BM25词法检索，默认读取 RAG_HYBRID_SEARCH
+            sharded: 是否按疾病类别分片存储并按质心路由检索，默认读取 RAG_SHARDING
+            reranker: 自定义交叉编码器重排器；未提供时按 RAG_RERANKER 决定是否加载
+            use_artifact: 知识库为空时是否装载预构建的索引制品；全量重建时应关闭，按知识数据重新编码
+            index_only: 只构建/同步索引（离线建库）：不构建症状倒排索引和BM25索引，不加载交叉编码器
+        """
         self.db_path = db_path
-        self.client = chromadb.PersistentClient(path=db_path)
         self.collection_name = "medical_knowledge"
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.vector_backend = vector_backend or VECTOR_BACKEND
+        self.sharded = SHARDING_ENABLED if sharded is None else sharded
+        self.embedder = embedder or create_embedder(db_path, embedding_model_name, device, batch_size)
+        self.embedding_model = getattr(self.embedder, 'model', None)
+        
+        # 知识库版本号：每次 add_knowledge 或同步/重建索引后递增，作为检索结果缓存键的一部分
+        self.version = 0
+        self.result_cache = RetrievalResultCache()
+        # 运行时写入（add_knowledge）与复制知识库目录（热重载快照）、关闭向量存储互斥
+        self.write_lock = threading.RLock()
+        
+        # 打开向量存储（查询和建库均使用同一编码器，避免ChromaDB再加载默认模型）
+        log_info(f"开始初始化医学知识库，数据库路径: {db_path}，向量后端: {self.vector_backend}，分片: {self.sharded}，编码模型: {self.embedder.model_id}")
+        self.vector_store = self._open_vector_store()
+        
+        self.manifest = KnowledgeManifest(self._manifest_path())
+        # 最近一次启动同步的统计（新增/变更/删除/写入条数与耗时），跳过同步时为 None
+        self.sync_stats: Optional[Dict[str, Any]] = None
+        
+        # 知识库为空时优先装载预构建的索引制品；知识数据未变化且向量存储已同步时，
+        # 直接加载二进制的知识记录存储，跳过数据转换和同步
+        self.docstore = (self._install_artifact() if use_artifact else None) or self._load_docstore()
+        if self.docstore is not None:
+            print(f"✅ 已加载知识记录存储，包含 {len(self.docstore)} 条记录")
+            log_info(f"加载知识记录存储，包含 {len(self.docstore)} 条记录，知识数据未变化，跳过同步")
+        else:
+            source = self._open_knowledge_source()
+            ids, metadatas, hashes = self._prepare_records(source)
+            
+            # 按清单中的内容哈希增量同步：只编码写入新增/变更的记录，删除已移除的记录
+            self._sync_knowledge_base(source, ids, metadatas, hashes)
+            
+            # 建库时预渲染每条知识的格式化片段，请求时只做拼接
+            self.docstore = KnowledgeDocStore()
+            self.docstore.add(ids, metadatas,
+                              (render_snippets(self._metadata_to_knowledge(metadata, 0.0)) for metadata in metadatas))
+            self.docstore.fingerprint = self._source_fingerprint()
+            self.docstore.save(self._docstore_path())
+            # 字段已转存到 docstore，不再持有数据源
+            if isinstance(source, KnowledgeDataFile):
+                source.close()
+            del source, ids, metadatas, hashes
+        record_ids = self.docstore.record_ids
+        
+        # 症状 → 记录 倒排索引（用于向量检索前的候选预过滤）；离线建库不需要
+        self.symptom_index = None
+        if not index_only:
+            self.symptom_index = SymptomInvertedIndex()
+            self.symptom_index.add(record_ids, (self.docstore.record_terms(record_id) for record_id in record_ids))
+            log_info(f"症状倒排索引构建完成，{self.symptom_index.term_count} 个词，{len(self.symptom_index)} 条记录")
+        
+        # 词法检索索引（BM25，与向量检索结果融合）
+        self.hybrid_search = False if index_only else HYBRID_SEARCH_ENABLED if hybrid_search is None else hybrid_search
+        self.lexical_index = None
+        if self.hybrid_search:
+            self.lexical_index = BM25Index()
+            self.lexical_index.add(record_ids, (self._lexical_text(metadata) for metadata in self.docstore.iter_metadata()))
+            log_info(f"BM25词法索引构建完成，包含 {len(self.lexical_index)} 条记录")
+        
+        # 第二阶段交叉编码器重排（可选，默认关闭）
+        self.reranker = reranker
+        if self.reranker is None and RERANKER_ENABLED and not index_only:
+            self.reranker = CrossEncoderReranker()
+            log_info(f"交叉编码器重排已启用，模型: {self.reranker.model_name}，时间预算: {self.reranker.time_budget_ms:.0f}ms")
+    
+    def _open_vector_store(self):
+        """按配置打开向量存储后端（开启分片时每个类别一个分片）"""
+        if self.vector_backend not in ('numpy', 'chroma'):
+            raise ValueError(f"不支持的向量存储后端: {self.vector_backend}")
+        if not self.sharded:
+            return self._open_single_store("vector_index", self.collection_name)
+        
+        # ChromaDB 分片是同一目录下的不同集合：共用一个客户端，关闭时只停止一次
+        client = None
+        if self.vector_backend == 'chroma':
+            import chromadb
+            client = chromadb.PersistentClient(path=self.db_path)
+        return ShardedVectorStore(
+            os.path.join(self.db_path, "shards"),
+            lambda name: self._open_single_store(os.path.join("shards", name), f"{self.collection_name}_{name}", client),
+            route_top_n=SHARD_ROUTE_TOP_N,
+            max_workers=SHARD_MAX_WORKERS,
+            on_close=(lambda: close_chroma_client(client)) if client is not None else None
+        )
+    
+    def _manifest_path(self) -> str:
+        return manifest_path(self.db_path, self.vector_backend, self.sharded)
+    
+    def _docstore_path(self) -> str:
+        return os.path.join(self.db_path, "docstore.bin")
+    
+    @staticmethod
+    def _knowledge_source_path() -> Optional[str]:
+        """当前生效的知识数据文件路径，没有任何数据文件时为 None"""
+        for path in (KNOWLEDGE_DATA_PATH, LEGACY_LARGE_DATA_PATH, SMALL_DATA_PATH):
+            if os.path.exists(path):
+                return path
+        return None
+    
+    def _source_fingerprint(self) -> Optional[str]:
+        """知识数据文件的指纹（文件名 + 大小 + 修改时间），使用内置默认数据时为 None"""
+        path = self._knowledge_source_path()
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    
+    def _load_docstore(self):
+        """知识数据文件未变化、清单与编码模型一致且向量存储非空时，加载已保存的知识记录存储
         
-        # 初始化或获取集合
-        log_info(f"开始初始化医学知识库，数据库路径: {db_path}")
+        没有知识数据文件时，只接受由索引制品装载的知识记录存储。
+        """
+        fingerprint = self._source_fingerprint()
+        if not self.manifest.exists or self.manifest.model_id != self.embedder.model_id:
+            return None
         try:
-            self.collection = self.client.get_collection(name=self.collection_name)
-            count = self.collection.count()
-            print(f"✅ 已加载现有医学知识库，包含 {count} 条记录")
-            log_info(f"加载现有医学知识库，包含 {count} 条记录")
-            # 加载现有数据库时也需要初始化知识库数据
-            self._load_knowledge_database()
+            docstore = KnowledgeDocStore.load(self._docstore_path())
         except Exception as e:
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                metadata={"描述": "医学诊断知识库"}
-            )
-            print("🆕 创建新的医学知识库")
-            log_info("创建新的医学知识库")
-            self._initialize_knowledge_base()
-    
-    def _initialize_knowledge_base(self):
-        """初始化医学知识库"""
-        # 使用顶部导入的医学知识库数据
-        if LARGE_MEDICAL_KNOWLEDGE_DATABASE is not None:
-            self.medical_knowledge_database = LARGE_MEDICAL_KNOWLEDGE_DATABASE
-            print(f"✅ 成功加载大规模医学知识库，包含 {len(self.medical_knowledge_database)} 条记录")
-        elif MEDICAL_KNOWLEDGE_DATABASE is not None:
-            self.medical_knowledge_database = MEDICAL_KNOWLEDGE_DATABASE
-            print(f"✅ 成功加载原医学知识库，包含 {len(self.medical_knowledge_database)} 条记录")
+            log_error(f"知识记录存储加载失败，重新构建: {e}")
+            return None
+        if docstore is None or len(docstore) != len(self.manifest.records) or self.vector_store.count() == 0:
+            return None
+        if fingerprint is None:
+            from_artifact = (docstore.fingerprint or '').startswith(ARTIFACT_FINGERPRINT_PREFIX)
+            return docstore if from_artifact else None
+        return docstore if docstore.fingerprint == fingerprint else None
+    
+    def _install_artifact(self) -> Optional[KnowledgeDocStore]:
+        """清单缺失或向量存储为空时装载预构建的索引制品（不运行编码模型）
+        
+        NumPy 单索引直接内存映射制品中的向量矩阵，其他后端按块写入制品中的向量。
+        返回可直接使用的知识记录存储；知识数据文件与导出时不一致时返回 None，
+        随后按清单中的内容哈希增量同步，只编码有差异的记录。
+        """
+        path = INDEX_ARTIFACT_PATH
+        if not path or not os.path.exists(path):
+            return None
+        if self.manifest.exists and self.vector_store.count() > 0:
+            return None
+        
+        start = time.time()
+        try:
+            artifact = KnowledgeArtifact(path)
+            if artifact.model_id != self.embedder.model_id:
+                log_info(f"索引制品的编码模型（{artifact.model_id}）与当前模型（{self.embedder.model_id}）不一致，忽略制品")
+                return None
+            if INDEX_ARTIFACT_VERIFY:
+                artifact.verify()
+        except Exception as e:
+            log_error(f"索引制品不可用，按知识数据建库: {e}")
+            print(f"⚠️ 索引制品不可用，按知识数据建库: {e}")
+            return None
+        
+        ids, metadatas, vectors = artifact.ids(), artifact.metadatas(), artifact.vectors()
+        self.vector_store.reset()
+        if isinstance(self.vector_store, VectorIndex):
+            self.vector_store.attach(ids, vectors, metadatas)
         else:
-            print("⚠️  无法导入医学知识库，使用默认数据")
-            self.medical_knowledge_database = [
-                    {
-                        "id": "pneumonia_001",
-                        "category": "呼吸系统疾病",
-                        "disease": "肺炎",
-                        "symptoms": ["咳嗽", "发热", "胸痛", "呼吸困难"],
-                        "imaging_findings": ["肺部阴影", "实变", "磨玻璃影"],
-                        "diagnosis_criteria": "临床症状 + 胸部影像学检查 + 血常规",
-                        "treatment": "抗生素治疗、支持治疗",
-                        "severity": ["轻度", "中度", "重度"],
-                        "content": "肺炎是肺实质的急性感染性炎症，主要表现为发热、咳嗽、胸痛等症状。"
-                    }
-                ]
-        
-        # 添加知识到向量数据库
-        documents = []
-        metadatas = []
-        ids = []
+            for offset in range(0, len(ids), INDEX_ADD_CHUNK_SIZE):
+                end = offset + INDEX_ADD_CHUNK_SIZE
+                self.vector_store.add(ids=ids[offset:end], embeddings=np.asarray(vectors[offset:end]),
+                                      metadatas=metadatas[offset:end])
+        self.manifest.from_dict(artifact.manifest_data())
+        self.manifest.save()
+        self._bump_version()
+        print(f"📦 已装载索引制品，包含 {len(artifact)} 条记录，耗时 {time.time() - start:.1f}s")
+        log_info(f"装载索引制品 {path}：{len(artifact)} 条记录，语料哈希 {artifact.corpus_hash}")
+        
+        source_path = self._knowledge_source_path()
+        if source_path is not None and artifact.source_sha256 != file_sha256(source_path):
+            print("🔄 知识数据文件与索引制品导出时不一致，按内容哈希增量同步")
+            return None
+        docstore = artifact.docstore()
+        if docstore is None:
+            return None
+        docstore.fingerprint = self._source_fingerprint() or f"{ARTIFACT_FINGERPRINT_PREFIX}{artifact.corpus_hash}"
+        docstore.save(self._docstore_path())
+        return docstore
+    
+    def export_artifact(self, path: str = None) -> Dict[str, Any]:
+        """把当前知识库（向量、记录ID、docstore 和清单）导出为索引制品，返回制品头部"""
+        path = path or INDEX_ARTIFACT_PATH or DEFAULT_ARTIFACT_PATH
+        record_ids = list(self.manifest.records) + list(self.manifest.runtime)
+        ids, vectors, metadatas = [], [], []
+        for offset in range(0, len(record_ids), INDEX_ADD_CHUNK_SIZE):
+            found = self.vector_store.get(record_ids[offset:offset + INDEX_ADD_CHUNK_SIZE])
+            for record_id, (vector, metadata) in found.items():
+                ids.append(record_id)
+                vectors.append(vector)
+                metadatas.append(metadata)
+        if len(ids) != len(record_ids):
+            raise ValueError(f"向量存储缺少 {len(record_ids) - len(ids)} 条清单中的记录，请先重新同步知识库")
         
-        for knowledge in self.medical_knowledge_database:
-            # 构建文档内容
-            doc_content = f"""
+        source_path = self._knowledge_source_path()
+        header = write_artifact(
+            path,
+            self.embedder.model_id,
+            ids,
+            np.asarray(vectors, dtype=np.float32),
+            metadatas,
+            self.docstore,
+            self.manifest.to_dict(),
+            source_sha256=file_sha256(source_path) if source_path else None
+        )
+        log_info(f"导出索引制品 {path}：{header['count']} 条记录，语料哈希 {header['corpus_hash']}")
+        return header
+    
+    def _open_single_store(self, index_subdir: str, collection_name: str, client=None):
+        """打开单个向量存储：NumPy索引目录或ChromaDB集合（client 为分片共用的 ChromaDB 客户端）"""
+        if self.vector_backend == 'numpy':
+            return VectorIndex(os.path.join(self.db_path, index_subdir), dtype=VECTOR_INDEX_DTYPE,
+                               quantization=VECTOR_QUANTIZATION, rerank_candidates=QUANTIZED_RERANK_CANDIDATES)
+        return ChromaVectorStore(
+            self.db_path,
+            collection_name,
+            embedding_function=self.embedder,
+            collection_metadata={"描述": "医学诊断知识库"},
+            client=client
+        )
+    
+    def _open_knowledge_source(self):
+        """打开知识数据源，返回支持迭代、len() 和按序号访问的记录序列"""
+        path = self._knowledge_source_path()
+        if path == KNOWLEDGE_DATA_PATH:
+            source = KnowledgeDataFile(path)
+            print(f"✅ 使用大规模医学知识数据文件，包含 {len(source)} 条记录")
+            return source
+        if path == LEGACY_LARGE_DATA_PATH:
+            from .data.large_medical_knowledge_data import LARGE_MEDICAL_KNOWLEDGE_DATABASE
+            print(f"✅ 成功加载大规模医学知识库，包含 {len(LARGE_MEDICAL_KNOWLEDGE_DATABASE)} 条记录")
+            print("💡 建议重新运行 process_large_medical_data.py 生成 JSONL 数据文件，避免导入整个Python数据模块")
+            return LARGE_MEDICAL_KNOWLEDGE_DATABASE
+        if path == SMALL_DATA_PATH:
+            from .data.medical_knowledge_data import MEDICAL_KNOWLEDGE_DATABASE
+            print(f"✅ 成功加载原医学知识库，包含 {len(MEDICAL_KNOWLEDGE_DATABASE)} 条记录")
+            return MEDICAL_KNOWLEDGE_DATABASE
+        
+        print("⚠️  无法导入医学知识库，使用默认数据")
+        return [
+            {
+                "id": "pneumonia_001",
+                "category": "呼吸系统疾病",
+                "disease": "肺炎",
+                "symptoms": ["咳嗽", "发热", "胸痛", "呼吸困难"],
+                "imaging_findings": ["肺部阴影", "实变", "磨玻璃影"],
+                "diagnosis_criteria": "临床症状 + 胸部影像学检查 + 血常规",
+                "treatment": "抗生素治疗、支持治疗",
+                "severity": ["轻度", "中度", "重度"],
+                "content": "肺炎是肺实质的急性感染性炎症，主要表现为发热、咳嗽、胸痛等症状。"
+            }
+        ]
+    
+    @staticmethod
+    def _record_document(knowledge: Dict) -> str:
+        """构建用于编码的文档内容"""
+        return f"""
 疾病：{knowledge['disease']}
 分类：{knowledge['category']}
-描述：{knowledge['description']}
-症状：{', '.join(knowledge['symptoms']) if knowledge['symptoms'] else '无明显症状'}
-病因：{knowledge['causes']}
-预防：{knowledge['prevention']}
-治疗：{', '.join(knowledge['treatment']) if isinstance(knowledge['treatment'], list) else knowledge['treatment']}
-诊断方法：{', '.join(knowledge['diagnosis_methods']) if knowledge['diagnosis_methods'] else '临床诊断'}
-严重程度：{knowledge['severity']}
-影像表现：{', '.join(knowledge['imaging_findings']) if knowledge['imaging_findings'] else '需要进一步检查'}
+描述：{knowledge.get('description') or knowledge.get('content', '')}
+症状：{_join_field(knowledge.get('symptoms'), '无明显症状')}
+病因：{knowledge.get('causes', '')}
+预防：{knowledge.get('prevention', '')}
+治疗：{_join_field(knowledge.get('treatment'))}
+诊断方法：{_join_field(knowledge.get('diagnosis_methods'), '临床诊断')}
+严重程度：{_join_field(knowledge.get('severity'))}
+影像表现：{_join_field(knowledge.get('imaging_findings'), '需要进一步检查')}
 """
-            
-            # 转换metadata中的列表为字符串（ChromaDB不支持列表类型）
-            metadata = {
-                'id': f"{knowledge['category']}_{knowledge['disease']}",
-                'category': knowledge['category'],
-                'disease': knowledge['disease'],
-                'symptoms': ', '.join(knowledge['symptoms']) if knowledge['symptoms'] else '',
-                'causes': knowledge['causes'],
-                'prevention': knowledge['prevention'],
-                'treatment': ', '.join(knowledge['treatment']) if isinstance(knowledge['treatment'], list) else knowledge['treatment'],
-                'diagnosis_methods': ', '.join(knowledge['diagnosis_methods']) if knowledge['diagnosis_methods'] else '',
-                'severity': knowledge['severity'],
-                'imaging_findings': ', '.join(knowledge['imaging_findings']) if knowledge['imaging_findings'] else '',
-                'description': knowledge['description']
-            }
-            
-            documents.append(doc_content)
+    
+    @staticmethod
+    def _record_metadata(knowledge: Dict, record_id: str) -> Dict:
+        """转换metadata中的列表为字符串（ChromaDB不支持列表类型）"""
+        return {
+            'id': f"{knowledge['category']}_{knowledge['disease']}",
+            'category': knowledge['category'],
+            'disease': knowledge['disease'],
+            'symptoms': _join_field(knowledge.get('symptoms')),
+            'causes': knowledge.get('causes', ''),
+            'prevention': knowledge.get('prevention', ''),
+            'treatment': _join_field(knowledge.get('treatment')),
+            'diagnosis_methods': _join_field(knowledge.get('diagnosis_methods')),
+            'severity': _join_field(knowledge.get('severity')),
+            'imaging_findings': _join_field(knowledge.get('imaging_findings')),
+            'description': knowledge.get('description') or knowledge.get('content', ''),
+            'record_id': record_id  # 供向量库按候选ID过滤
+        }
+    
+    def _prepare_records(self, source):
+        """流式遍历知识数据，返回 (ids, metadatas, 内容哈希)
+        
+        文档内容只用于计算哈希，不在内存中保留；需要编码时再按序号从数据源重新生成。
+        """
+        ids = []
+        metadatas = []
+        hashes = []
+        seen_ids = {}
+        
+        for knowledge in source:
+            record_id = stable_record_id(knowledge, seen_ids)
+            metadata = self._record_metadata(knowledge, record_id)
+            ids.append(record_id)
             metadatas.append(metadata)
-            ids.append(f"{knowledge['category']}_{knowledge['disease']}_{len(documents)}")
+            hashes.append(content_hash(self._record_document(knowledge), metadata))
         
-        # 批量添加到向量数据库
-        self.collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
+        return ids, metadatas, hashes
+    
+    def _sync_knowledge_base(self, source, ids: List[str], metadatas: List[Dict], hashes: List[str]):
+        """对比清单与当前知识数据，增量更新向量存储
+        
+        没有清单（旧版本建的库）或编码模型变化时清空向量存储并全量重建。
+        """
+        manifest = self.manifest
         
-        print(f"✅ 已初始化 {len(self.medical_knowledge_database)} 条医学知识记录")
+        # 清单中有记录而向量存储为空（索引文件被删除）时同样全量重建
+        if (not manifest.exists or manifest.model_id != self.embedder.model_id
+                or (manifest.records and self.vector_store.count() == 0)):
+            if self.vector_store.count() > 0:
+                print("♻️ 知识库清单缺失或编码模型已变化，重建向量索引")
+                log_info(f"清单缺失或编码模型变化（{manifest.model_id} -> {self.embedder.model_id}），重建向量索引")
+                self.vector_store.reset()
+            else:
+                print("🆕 创建新的医学知识库")
+                log_info("创建新的医学知识库")
+            manifest.reset(self.embedder.model_id)
+        
+        added, changed, removed = manifest.diff(ids, hashes)
+        self.sync_stats = {'added': len(added), 'changed': len(changed), 'removed': len(removed),
+                           'indexed': 0, 'seconds': 0.0}
+        if not (added or changed or removed):
+            count = self.vector_store.count()
+            print(f"✅ 已加载现有医学知识库，包含 {count} 条记录")
+            log_info(f"加载现有医学知识库，包含 {count} 条记录，无需同步")
+            return
+        
+        print(f"🔄 同步医学知识库：新增 {len(added)} 条，变更 {len(changed)} 条，删除 {len(removed)} 条")
+        log_info(f"同步医学知识库：新增 {len(added)}，变更 {len(changed)}，删除 {len(removed)}")
+        
+        # 先删除移除/变更的记录（分片存储中记录的类别可能已变化），删除后立即落盘清单
+        stale = removed + [ids[i] for i in changed]
+        if stale:
+            self.vector_store.delete(stale)
+            manifest.remove(stale)
+            manifest.save()
+        
+        start = time.time()
+        self._index_records(source, sorted(added + changed), ids, metadatas, hashes)
+        self.sync_stats.update(indexed=len(added) + len(changed), seconds=time.time() - start)
+        self._bump_version()
+        print(f"✅ 医学知识库同步完成，共 {self.vector_store.count()} 条记录")
     
-    def _load_knowledge_database(self):
-        """加载知识库数据（用于已存在的数据库）"""
-        if LARGE_MEDICAL_KNOWLEDGE_DATABASE is not None:
-            self.medical_knowledge_database = LARGE_MEDICAL_KNOWLEDGE_DATABASE
-        elif MEDICAL_KNOWLEDGE_DATABASE is not None:
-            self.medical_knowledge_database = MEDICAL_KNOWLEDGE_DATABASE
-        else:
-            # 如果都无法导入，设置为空列表
-            self.medical_knowledge_database = []
+    def _index_records(self, source, rows: List[int], ids: List[str], metadatas: List[Dict], hashes: List[str]):
+        """分块批量编码并写入向量存储，每块写入后更新清单（中断后重启可从断点继续）
+        
+        写入在单独的线程中进行，与下一块的编码重叠；块按顺序写入，清单只记录已写入的块。
+        
+        Args:
+            source: 知识数据源，按序号取回记录生成文档内容
+            rows: 需要写入的记录序号
+        """
+        def write_chunk(chunk: List[int], embeddings: np.ndarray, done: int):
+            chunk_ids = [ids[i] for i in chunk]
+            # 向量库只保存记录ID和类别（用于候选过滤和分片），知识字段由 docstore 提供
+            self.vector_store.add(
+                ids=chunk_ids,
+                embeddings=embeddings,
+                metadatas=[{'record_id': ids[i], 'category': metadatas[i]['category']} for i in chunk]
+            )
+            self.manifest.update(chunk_ids, [hashes[i] for i in chunk])
+            self.manifest.save()
+            print(f"📥 已写入 {done}/{len(rows)} 条记录")
+        
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='rag-index-writer') as writer:
+            pending = None
+            for start in range(0, len(rows), INDEX_ADD_CHUNK_SIZE):
+                chunk = rows[start:start + INDEX_ADD_CHUNK_SIZE]
+                # 显式传入向量，编码批大小由编码器控制
+                embeddings = self.embedder.encode([self._record_document(source[i]) for i in chunk])
+                if pending is not None:
+                    pending.result()
+                pending = writer.submit(write_chunk, chunk, embeddings, start + len(chunk))
+            if pending is not None:
+                pending.result()
+    
+    def _bump_version(self):
+        """知识库内容变化：递增版本号，已缓存的检索结果随之失效"""
+        self.version += 1
+        self.result_cache.clear()
     
     def get_knowledge_count(self) -> int:
         """获取知识库中的条目数量"""
-        return len(self.medical_knowledge_database)
+        return len(self.docstore)
+    
+    def close(self):
+        """关闭向量存储（释放 ChromaDB 客户端及其 SQLite 连接），编码模型与重排模型可能被其他版本复用，不在此释放"""
+        with self.write_lock:
+            close = getattr(self.vector_store, 'close', None)
+            if close is not None:
+                close()
+    
+    def get_embedding_cache_stats(self) -> Dict[str, Any]:
+        """获取查询向量缓存的命中统计"""
+        cache_stats = getattr(self.embedder, 'cache_stats', None)
+        return cache_stats() if cache_stats else {}
     
-    def search_relevant_knowledge(self, symptoms: str, top_k: int = 3) -> List[Dict]:
-        """根据症状搜索相关医学知识"""
+    def get_result_cache_stats(self) -> Dict[str, Any]:
+        """获取检索结果缓存的命中统计"""
+        return dict(self.result_cache.stats(), version=self.version)
+    
+    def search_relevant_knowledge(self, symptoms: str, top_k: int = 3,
+                                  query_terms: MedicalTerms = None, prefilter: str = None) -> List[Dict]:
+        """根据症状搜索相关医学知识
+        
+        Args:
+            symptoms: 症状文本
+            top_k: 返回的知识条数
+            query_terms: 已从症状文本中识别出的医学术语，未提供时自动识别
+            prefilter: 症状倒排索引预过滤模式（none/union/intersection），默认读取 RAG_SYMPTOM_PREFILTER
+        """
         print(f"🔍 正在搜索与症状相关的医学知识: {symptoms[:100]}...")
         log_rag_operation("知识搜索", symptoms[:100], knowledge_count=top_k)
-    
-        # 使用向量搜索
-        results = self.collection.query(
-            query_texts=[symptoms],
-            n_results=top_k
-        )
         
-        relevant_knowledge = []
-        if results['metadatas'] and len(results['metadatas'][0]) > 0:
-            for i, metadata in enumerate(results['metadatas'][0]):
-                distance = results['distances'][0][i] if results['distances'] else 0
-                knowledge = {
-                    'disease': metadata['disease'],
-                    'category': metadata['category'],
-                    'symptoms': metadata['symptoms'].split(', ') if isinstance(metadata['symptoms'], str) and metadata['symptoms'] else [],
-                    'causes': metadata.get('causes', ''),
-                    'prevention': metadata.get('prevention', ''),
-                    'treatment': metadata['treatment'],
-                    'diagnosis_methods': metadata.get('diagnosis_methods', '').split(', ') if metadata.get('diagnosis_methods') else [],
-                    'severity': metadata.get('severity', ''),
-                    'imaging_findings': metadata.get('imaging_findings', '').split(', ') if metadata.get('imaging_findings') else [],
-                    'description': metadata.get('description', ''),
-                    'metadata': metadata,  # 保留原始 metadata
-                    'distance': distance,
-                    'relevance_score': 1 - distance  # 转换为相似度分数
-                }
-                relevant_knowledge.append(knowledge)
+        # 相同查询（规范化后、查询术语相同）在知识库未变化时直接命中结果缓存
+        if query_terms is None:
+            query_terms = self.extract_query_terms(symptoms)
+        cache_key = self.result_cache.make_key(self.version, symptoms, top_k, prefilter or SYMPTOM_PREFILTER,
+                                               query_terms.all_terms)
+        relevant_knowledge = self.result_cache.get(cache_key)
+        if relevant_knowledge is None:
+            relevant_knowledge = self._query_knowledge([symptoms], top_k, [query_terms], prefilter)[0]
+            if self._cacheable(relevant_knowledge):
+                self.result_cache.put(cache_key, relevant_knowledge)
+        else:
+            print("⚡ 命中检索结果缓存")
         
         print(f"📚 找到 {len(relevant_knowledge)} 条相关医学知识")
         
@@ -188,6 +572,225 @@ class MedicalKnowledgeBase:
             log_rag_operation("搜索结果", "未找到相关知识", 0, 0)
         
         return relevant_knowledge
+    
+    def search_relevant_knowledge_many(self, symptoms_list: List[str], top_k: int = 3,
+                                       prefilter: str = None) -> List[List[Dict]]:
+        """批量搜索相关医学知识
+        
+        所有查询在一次批量编码和一次多查询向量检索中完成，适用于评测脚本、批量重诊断等离线场景。
+        
+        Args:
+            symptoms_list: 症状文本列表
+            top_k: 每条查询返回的知识条数
+            prefilter: 症状倒排索引预过滤模式，同 search_relevant_knowledge
+        
+        Returns:
+            与输入顺序一致的结果列表，每项的格式与 search_relevant_knowledge 相同
+        """
+        if not symptoms_list:
+            return []
+        
+        print(f"🔍 正在批量搜索 {len(symptoms_list)} 条症状的相关医学知识...")
+        query_terms = [self.extract_query_terms(symptoms) for symptoms in symptoms_list]
+        cache_keys = [self.result_cache.make_key(self.version, symptoms, top_k, prefilter or SYMPTOM_PREFILTER,
+                                                 terms.all_terms)
+                      for symptoms, terms in zip(symptoms_list, query_terms)]
+        results = [self.result_cache.get(key) for key in cache_keys]
+        # 只对未命中缓存的查询做批量检索
+        missing = [i for i, knowledge in enumerate(results) if knowledge is None]
+        if missing:
+            fresh = self._query_knowledge([symptoms_list[i] for i in missing], top_k,
+                                          [query_terms[i] for i in missing], prefilter)
+            for i, knowledge in zip(missing, fresh):
+                results[i] = knowledge
+                if self._cacheable(knowledge):
+                    self.result_cache.put(cache_keys[i], knowledge)
+        
+        hit_count = sum(len(knowledge) for knowledge in results)
+        log_rag_operation("批量知识搜索", f"{len(symptoms_list)}条查询", knowledge_count=hit_count)
+        return results
+    
+    def _cacheable(self, knowledge_list: List[Dict]) -> bool:
+        """重排因超出时间预算退回第一阶段排序的结果不缓存，下次仍尝试重排"""
+        return self.reranker is None or all('rerank_score' in knowledge for knowledge in knowledge_list)
+    
+    def get_reranker_stats(self) -> Dict[str, Any]:
+        """获取交叉编码器重排统计（未启用时为空）"""
+        return self.reranker.stats() if self.reranker is not None else {}
+    
+    def extract_query_terms(self, text: str) -> MedicalTerms:
+        """识别症状文本中的症状/疾病术语（Aho-Corasick 一次线性扫描）"""
+        return get_term_matcher().extract(text)
+    
+    def _prefilter_candidates(self, terms: MedicalTerms, prefilter: str):
+        """按症状倒排索引求候选记录ID，不做预过滤时返回 None"""
+        if prefilter == PREFILTER_NONE or not terms or self.symptom_index is None:
+            return None
+        candidates = self.symptom_index.candidates(terms.all_terms, mode=prefilter, limit=PREFILTER_MAX_CANDIDATES)
+        return candidates or None
+    
+    def _dense_query(self, query_embeddings, top_k: int, candidate_ids=None):
+        """向量检索；带候选集时只在候选中检索，候选检索失败或为空则退回全库检索"""
+        if candidate_ids is None:
+            return self.vector_store.query(query_embeddings, top_k)
+        try:
+            results = self.vector_store.query(query_embeddings, top_k, candidate_ids=candidate_ids)
+            if all(results):
+                return results
+        except Exception as e:
+            log_error(f"候选集向量检索失败，退回全库检索: {e}")
+        return self.vector_store.query(query_embeddings, top_k)
+    
+    def _query_knowledge(self, queries: List[str], top_k: int,
+                         query_terms: List[MedicalTerms] = None, prefilter: str = None) -> List[List[Dict]]:
+        """一次批量编码 + 一次多查询检索，按查询顺序返回知识列表
+        
+        开启预过滤时，先用症状倒排索引把检索范围缩小到相关记录；
+        向量检索（以及开启时的BM25词法检索）各召回一批候选，按RRF融合；
+        候选记录的症状或疾病名与查询术语精确命中时再额外加分；开启交叉编码器重排时，
+        对前 RERANK_CANDIDATES 条做第二阶段重排，最后取前 top_k 条。
+        """
+        prefilter = prefilter or SYMPTOM_PREFILTER
+        if prefilter not in PREFILTER_MODES:
+            raise ValueError(f"不支持的预过滤模式: {prefilter}")
+        if query_terms is None:
+            query_terms = [None] * len(queries)
+        query_terms = [terms if terms is not None else self.extract_query_terms(query)
+                       for query, terms in zip(queries, query_terms)]
+        query_embeddings = self.embedder.encode(queries, use_cache=True)
+        
+        rerank = self.lexical_index is not None or any(query_terms)
+        candidate_count = max(top_k * HYBRID_CANDIDATE_MULTIPLIER, HYBRID_MIN_CANDIDATES) if rerank else top_k
+        # 开启交叉编码器重排时，第一阶段保留更多候选交给第二阶段
+        stage_one_count = max(top_k, RERANK_CANDIDATES) if self.reranker is not None else top_k
+        candidate_count = max(candidate_count, stage_one_count)
+        candidate_sets = [self._prefilter_candidates(terms, prefilter) for terms in query_terms]
+        if any(candidates is not None for candidates in candidate_sets):
+            # 每条查询的候选集不同，逐条检索
+            dense_results = [
+                self._dense_query(query_embeddings[i:i + 1], candidate_count, candidate_sets[i])[0]
+                for i in range(len(queries))
+            ]
+        else:
+            dense_results = self.vector_store.query(query_embeddings, candidate_count)
+        if self.lexical_index is not None:
+            lexical_results = self.lexical_index.search_many(queries, candidate_count)
+            for i, candidates in enumerate(candidate_sets):
+                if candidates is not None:
+                    allowed = set(candidates)
+                    lexical_results[i] = [hit for hit in lexical_results[i] if hit[0] in allowed]
+        else:
+            lexical_results = [[] for _ in queries]
+        
+        all_knowledge = []
+        for query, query_embedding, terms, dense_hits, lexical_hits in zip(
+                queries, query_embeddings, query_terms, dense_results, lexical_results):
+            dense = {record_id: (distance, metadata) for record_id, distance, metadata in dense_hits}
+            bm25_scores = dict(lexical_hits)
+            rankings = [[hit[0] for hit in dense_hits]]
+            if lexical_hits:
+                rankings.append([hit[0] for hit in lexical_hits])
+            fused = reciprocal_rank_fusion(rankings, k=RRF_K)
+            
+            # 仅被词法检索召回的记录，补算与查询的精确向量距离，保证相关度口径一致
+            missing = [record_id for record_id, _ in fused if record_id not in dense]
+            if missing:
+                for record_id, (vector, metadata) in self.vector_store.get(missing).items():
+                    similarity = float(np.dot(query_embedding, vector))
+                    dense[record_id] = (2.0 - 2.0 * similarity, metadata)
+            
+            # 术语精确命中加分
+            term_set = set(terms.all_terms) if terms else set()
+            scored = []
+            for record_id, fusion_score in fused:
+                if record_id not in dense:
+                    continue
+                matched_terms = self._match_record_terms(record_id, dense[record_id][1], term_set) if term_set else []
+                scored.append((fusion_score + TERM_MATCH_BOOST * len(matched_terms), record_id, matched_terms))
+            scored.sort(key=lambda item: item[0], reverse=True)
+            
+            knowledge_list = []
+            for score, record_id, matched_terms in scored[:stage_one_count]:
+                distance, metadata = dense[record_id]
+                # 命中后才从 docstore 还原完整字段；不在 docstore 中的记录使用向量库中的 metadata
+                knowledge = self._metadata_to_knowledge(self.docstore.get_metadata(record_id) or metadata, distance)
+                knowledge['bm25_score'] = bm25_scores.get(record_id, 0.0)
+                knowledge['fusion_score'] = score
+                knowledge['matched_terms'] = matched_terms
+                knowledge_list.append(knowledge)
+            if self.reranker is not None:
+                knowledge_list = self._rerank(query, knowledge_list)
+            all_knowledge.append(knowledge_list[:top_k])
+        return all_knowledge
+    
+    def _rerank(self, query: str, knowledge_list: List[Dict]) -> List[Dict]:
+        """交叉编码器重排；超出时间预算或失败时保持第一阶段顺序
+        
+        重排成功时 relevance_score 改为交叉编码器给出的相关度（0~1），原向量相似度保存在 dense_score。
+        """
+        scores = self.reranker.score(query, [self._rerank_text(knowledge) for knowledge in knowledge_list])
+        if scores is None:
+            return knowledge_list
+        for knowledge, score in zip(knowledge_list, scores):
+            knowledge['dense_score'] = knowledge['relevance_score']
+            knowledge['rerank_score'] = score
+            knowledge['relevance_score'] = score
+        return sorted(knowledge_list, key=lambda knowledge: knowledge['rerank_score'], reverse=True)
+    
+    @staticmethod
+    def _rerank_text(knowledge: Dict) -> str:
+        """交叉编码器输入的知识文本：疾病名、症状、影像表现和描述"""
+        parts = [f"{knowledge['disease']}（{knowledge['category']}）"]
+        if knowledge.get('symptoms'):
+            parts.append(f"症状：{'、'.join(knowledge['symptoms'])}")
+        if knowledge.get('imaging_findings'):
+            parts.append(f"影像表现：{'、'.join(knowledge['imaging_findings'])}")
+        description = knowledge.get('description') or knowledge.get('metadata', {}).get('content', '')
+        if description:
+            parts.append(description)
+        return '。'.join(parts)
+    
+    @staticmethod
+    def _record_terms(metadata: Dict) -> List[str]:
+        """记录的疾病名与症状列表"""
+        record_terms = [metadata.get('disease', '')]
+        if metadata.get('symptoms'):
+            record_terms.extend(metadata['symptoms'].split(', '))
+        return record_terms
+    
+    def _match_record_terms(self, record_id: str, metadata: Dict, term_set: set) -> List[str]:
+        """返回记录的疾病名/症状中与查询术语精确相同的词"""
+        record_terms = self.docstore.record_terms(record_id) if record_id in self.docstore else self._record_terms(metadata)
+        return [term for term in record_terms if term in term_set]
+    
+    @staticmethod
+    def _lexical_text(metadata: Dict) -> str:
+        """BM25索引使用的文本：疾病名和症状重复一次以提高权重"""
+        return ' '.join([
+            metadata.get('disease', ''), metadata.get('disease', ''),
+            metadata.get('symptoms', ''), metadata.get('symptoms', ''),
+            metadata.get('imaging_findings', ''),
+            metadata.get('description', '') or metadata.get('content', '')
+        ])
+    
+    @staticmethod
+    def _metadata_to_knowledge(metadata: Dict, distance: float) -> Dict:
+        """将向量库中的metadata还原为知识条目"""
+        return {
+            'disease': metadata['disease'],
+            'category': metadata['category'],
+            'symptoms': metadata['symptoms'].split(', ') if isinstance(metadata['symptoms'], str) and metadata['symptoms'] else [],
+            'causes': metadata.get('causes', ''),
+            'prevention': metadata.get('prevention', ''),
+            'treatment': metadata['treatment'],
+            'diagnosis_methods': metadata.get('diagnosis_methods', '').split(', ') if metadata.get('diagnosis_methods') else [],
+            'severity': metadata.get('severity', ''),
+            'imaging_findings': metadata.get('imaging_findings', '').split(', ') if metadata.get('imaging_findings') else [],
+            'description': metadata.get('description', ''),
+            'metadata': metadata,  # 保留原始 metadata
+            'distance': distance,
+            'relevance_score': 1 - distance  # 转换为相似度分数
+        }
 
     def add_knowledge(self, knowledge_data: Dict):
         """添加新的医学知识"""
@@ -204,6 +807,7 @@ class MedicalKnowledgeBase:
         # 转换metadata中的列表为字符串
         metadata = {
             'id': knowledge_data['id'],
+            'record_id': knowledge_data['id'],
             'category': knowledge_data['category'],
             'disease': knowledge_data['disease'],
             'symptoms': ', '.join(knowledge_data['symptoms']) if isinstance(knowledge_data['symptoms'], list) else knowledge_data['symptoms'],
@@ -214,71 +818,112 @@ class MedicalKnowledgeBase:
             'content': knowledge_data['content']
         }
         
-        self.collection.add(
-            documents=[doc_content],
-            metadatas=[metadata],
-            ids=[knowledge_data['id']]
-        )
+        with self.write_lock:
+            self.vector_store.add(
+                ids=[knowledge_data['id']],
+                embeddings=self.embedder.encode([doc_content]),
+                documents=[doc_content],
+                metadatas=[metadata]
+            )
+            # 运行时添加的记录单独登记，启动同步时不会被当作已移除的记录删除；
+            # 其完整字段保存在向量库 metadata 中，不写入 docstore
+            self.manifest.runtime[knowledge_data['id']] = content_hash(doc_content, metadata)
+            self.manifest.save()
+            if self.symptom_index is not None:
+                self.symptom_index.add([knowledge_data['id']], [self._record_terms(metadata)])
+            if self.lexical_index is not None:
+                self.lexical_index.add([knowledge_data['id']], [self._lexical_text(metadata)])
+            self._bump_version()
         print(f"✅ 已添加新的医学知识: {knowledge_data['disease']}")
 
 
+class RetrievalResult:
+    """单次检索结果：保存命中知识、相关度分数以及格式化后的知识上下文
+
+    阈值判断和提示词构建都复用同一个结果对象，避免对同一症状重复做向量检索。
+    """
+    
+    def __init__(self, query: str, hits: List[Dict], formatter=None, terms: MedicalTerms = None):
+        self.query = query
+        self.terms = terms  # 查询中识别出的症状/疾病术语
+        self.hits = hits
+        self.scores = [k['relevance_score'] for k in hits]
+        self._formatter = formatter
+        self._formatted_context = None
+    
+    @property
+    def max_score(self) -> float:
+        """最高相关度，未命中时为0"""
+        return max(self.scores) if self.scores else 0.0
+    
+    @property
+    def formatted_context(self) -> str:
+        """格式化后的医学知识上下文（首次访问时生成并缓存）"""
+        if self._formatted_context is None:
+            if self._formatter is None:
+                raise ValueError("未提供格式化函数，无法生成知识上下文")
+            self._formatted_context = self._formatter(self.hits)
+        return self._formatted_context
+    
+    def __len__(self) -> int:
+        return len(self.hits)
+    
+    def __bool__(self) -> bool:
+        return bool(self.hits)
+
+
 class MedicalRAGRetriever:
     """医学RAG检索器"""
     
     def __init__(self, knowledge_base: MedicalKnowledgeBase):
         self.knowledge_base = knowledge_base
     
+    def retrieve(self, symptoms: str, top_k: int = 3, query_terms: MedicalTerms = None) -> RetrievalResult:
+        """执行一次检索，返回可复用的检索结果"""
+        if query_terms is None:
+            query_terms = self.knowledge_base.extract_query_terms(symptoms)
+        relevant_knowledge = self.knowledge_base.search_relevant_knowledge(symptoms, top_k, query_terms=query_terms)
+        return RetrievalResult(symptoms, relevant_knowledge, formatter=self.format_knowledge, terms=query_terms)
+    
+    def retrieve_many(self, symptoms_list: List[str], top_k: int = 3) -> List[RetrievalResult]:
+        """批量检索，每条查询对应一个检索结果"""
+        all_knowledge = self.knowledge_base.search_relevant_knowledge_many(symptoms_list, top_k)
+        return [
+            RetrievalResult(symptoms, knowledge, formatter=self.format_knowledge)
+            for symptoms, knowledge in zip(symptoms_list, all_knowledge)
+        ]
+    
     def retrieve_and_format(self, symptoms: str, top_k: int = 3) -> str:
         """检索并格式化医学知识"""
-        relevant_knowledge = self.knowledge_base.search_relevant_knowledge(symptoms, top_k)
-        
+        return self.retrieve(symptoms, top_k).formatted_context
+    
+    def _snippet(self, knowledge: Dict, style: str) -> str:
+        """取命中记录的预渲染片段；不在 docstore 中的记录（如运行时添加的知识）当场渲染"""
+        record_id = knowledge.get('metadata', {}).get('record_id')
+        snippet = self.knowledge_base.docstore.snippet(record_id, style) if record_id is not None else None
+        return snippet if snippet is not None else RENDERERS[style](knowledge)
+    
+    def format_knowledge(self, relevant_knowledge: List[Dict]) -> str:
+        """将已有的检索命中格式化为Markdown知识参考（不再触发检索）"""
         if not relevant_knowledge:
             return "未找到相关医学知识。"
         
-        formatted_knowledge = "**相关医学知识参考：**\n\n"
-        
+        blocks = ["**相关医学知识参考：**\n\n"]
         for i, knowledge in enumerate(relevant_knowledge, 1):
-            formatted_knowledge += f"### {i}. {knowledge['disease']} ({knowledge['category']})\n"
-            if knowledge.get('symptoms'):
-                formatted_knowledge += f"**常见症状：** {', '.join(knowledge['symptoms'])}\n"
-            if knowledge.get('imaging_findings'):
-                formatted_knowledge += f"**影像表现：** {', '.join(knowledge['imaging_findings'])}\n"
-            if knowledge.get('diagnosis_criteria'):
-                formatted_knowledge += f"**诊断标准：** {knowledge['diagnosis_criteria']}\n"
-            if knowledge.get('diagnosis_methods'):
-                formatted_knowledge += f"**诊断方法：** {', '.join(knowledge['diagnosis_methods'])}\n"
-            if knowledge.get('treatment'):
-                formatted_knowledge += f"**治疗方案：** {knowledge['treatment']}\n"
-            if knowledge.get('causes'):
-                formatted_knowledge += f"**病因：** {knowledge['causes'][:200]}\n"  # 限制长度
-            if knowledge.get('content'):
-                formatted_knowledge += f"**详细说明：** {knowledge['content']}\n"
-            formatted_knowledge += f"**相关度：** {knowledge['relevance_score']:.2f}\n\n"
-            formatted_knowledge += "---\n\n"
-        
-        return formatted_knowledge
+            blocks.append(f"### {i}. {self._snippet(knowledge, SNIPPET_MARKDOWN)}"
+                          f"**相关度：** {knowledge['relevance_score']:.2f}\n\n---\n\n")
+        return ''.join(blocks)
     
     def format_knowledge_for_diagnosis(self, relevant_knowledge: List[Dict]) -> str:
         """为诊断建议生成格式化医学知识"""
         if not relevant_knowledge:
             return "未找到相关医学知识。"
         
-        formatted_knowledge = "相关医学知识参考：\n\n"
-        
+        blocks = ["相关医学知识参考：\n\n"]
         for i, knowledge in enumerate(relevant_knowledge, 1):
-            formatted_knowledge += f"{i}. 疾病：{knowledge['disease']} (分类：{knowledge['category']})\n"
-            if knowledge.get('symptoms'):
-                formatted_knowledge += f"   常见症状：{', '.join(knowledge['symptoms'][:5])}\n"  # 只显示前5个症状
-            if knowledge.get('causes'):
-                formatted_knowledge += f"   病因：{knowledge['causes'][:100]}\n"  # 限制长度
-            if knowledge.get('treatment'):
-                formatted_knowledge += f"   治疗：{knowledge['treatment'][:100]}\n"
-            if knowledge.get('diagnosis_methods'):
-                formatted_knowledge += f"   诊断方法：{', '.join(knowledge['diagnosis_methods'][:3])}\n"
-            formatted_knowledge += f"   相关度：{knowledge['relevance_score']:.3f}\n\n"
-        
-        return formatted_knowledge
-
+            blocks.append(f"{i}. {self._snippet(knowledge, SNIPPET_DIAGNOSIS)}"
+                          f"   相关度：{knowledge['relevance_score']:.3f}\n\n")
+        return ''.join(blocks)
 
 def initialize_medical_rag():
     """初始化医学RAG系统"""
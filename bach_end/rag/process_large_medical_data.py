@@ -9,6 +9,12 @@ import json
 import re
 from typing import List, Dict, Any
 
+try:
+    from .knowledge_data import write_knowledge_data
+except ImportError:
+    # 作为脚本直接运行（python process_large_medical_data.py）
+    from knowledge_data import write_knowledge_data
+
 def clean_text(text: str) -> str:
     """清理文本，去除多余的空白字符和特殊符号"""
     if not isinstance(text, str):
@@ -169,26 +175,8 @@ def process_medical_data(input_file: str, output_file: str, max_records: int = N
     for cat, count in sorted(category_stats.items(), key=lambda x: x[1], reverse=True):
         print(f"  {cat}: {count} 条")
     
-    # 保存处理后的数据
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write("#!/usr/bin/env python3\n")
-        f.write("# -*- coding: utf-8 -*-\n")
-        f.write('"""\n')
-        f.write("大规模医学知识库数据\n")
-        f.write(f"包含 {len(processed_data)} 条医学知识条目\n")
-        f.write('"""\n\n')
-        f.write("LARGE_MEDICAL_KNOWLEDGE_DATABASE = ")
-        f.write(json.dumps(processed_data, ensure_ascii=False, indent=2))
-        f.write("\n\n")
-        f.write("def get_large_medical_knowledge_count():\n")
-        f.write(f'    """获取大规模医学知识条目数量"""\n')
-        f.write(f"    return {len(processed_data)}\n\n")
-        f.write("def get_large_medical_knowledge_by_category(category):\n")
-        f.write('    """根据分类获取大规模医学知识"""\n')
-        f.write("    return [item for item in LARGE_MEDICAL_KNOWLEDGE_DATABASE if item['category'] == category]\n\n")
-        f.write("def get_all_large_categories():\n")
-        f.write('    """获取所有大规模疾病分类"""\n')
-        f.write("    return list(set(item['category'] for item in LARGE_MEDICAL_KNOWLEDGE_DATABASE))\n")
+    # 保存处理后的数据：每行一条JSON记录，并生成 .idx 偏移量索引
+    write_knowledge_data(processed_data, output_file)
     
     print(f"💾 数据已保存到: {output_file}")
     return len(processed_data)
@@ -197,7 +185,7 @@ if __name__ == "__main__":
     # 处理数据，限制为前2000条以避免文件过大
     count = process_medical_data(
         input_file="data/medical.json",
-        output_file="data/large_medical_knowledge_data.py",
+        output_file="data/large_medical_knowledge.jsonl",
         max_records=2000
     )
     print(f"🚀 大规模医疗知识库准备完成！包含 {count} 条记录")
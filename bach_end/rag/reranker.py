@@ -0,0 +1,138 @@
+"""
+交叉编码器重排
+对第一阶段（向量 + BM25 融合）的前若干候选，用小型 CPU 交叉编码器一次批量前向计算 (查询, 知识) 相关度。
+每次重排有硬性时间预算：按指数滑动平均(EWMA)预估耗时超出预算时直接跳过，
+实际计算超时也不再等待，两种情况都退回第一阶段的排序。
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    from logger_config import log_info, log_error
+except ImportError:
+    def log_info(msg): pass
+    def log_error(msg, exc_info=False): pass
+
+# 重排配置（默认关闭）
+RERANKER_ENABLED = os.environ.get('RAG_RERANKER', '0') == '1'
+RERANKER_MODEL = os.environ.get('RAG_RERANKER_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+RERANKER_DEVICE = os.environ.get('RAG_RERANKER_DEVICE', 'cpu')
+# 参与重排的第一阶段候选数
+RERANK_CANDIDATES = int(os.environ.get('RAG_RERANK_CANDIDATES', '20'))
+# 单次重排的时间预算（毫秒）
+RERANK_TIME_BUDGET_MS = float(os.environ.get('RAG_RERANK_TIME_BUDGET_MS', '150'))
+RERANK_MAX_LENGTH = 256
+
+# 耗时 EWMA 的平滑系数
+EWMA_ALPHA = 0.2
+# 预估超出预算而连续跳过这么多次后，放行一次重新测量（负载下降后能恢复重排）
+PROBE_INTERVAL = 20
+
+
+class CrossEncoderReranker:
+    """带时间预算的交叉编码器重排器
+
+    模型在单独的线程中执行，同一时间只有一个批次在计算；上一批次超时仍未结束时，新请求直接退回第一阶段排序。
+    """
+
+    def __init__(self, model_name: Optional[str] = None, device: Optional[str] = None,
+                 time_budget_ms: Optional[float] = None, max_length: int = RERANK_MAX_LENGTH, model=None):
+        """
+        Args:
+            model_name: 交叉编码器模型名称
+            device: 运行设备，默认 CPU
+            time_budget_ms: 单次重排的时间预算（毫秒）
+            max_length: (查询, 知识) 拼接后的最大token数
+            model: 自定义模型，需提供 predict(pairs) -> 分数数组
+        """
+        self.model_name = model_name or RERANKER_MODEL
+        self.time_budget_ms = RERANK_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms
+        if model is None:
+            from sentence_transformers import CrossEncoder
+            model = CrossEncoder(self.model_name, max_length=max_length, device=device or RERANKER_DEVICE)
+        self.model = model
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rag-rerank')
+        self._running: Optional[Future] = None
+        self._lock = threading.Lock()
+        self.ewma_ms_per_pair: Optional[float] = None
+        self._skipped_in_row = 0
+        self.reranked = 0
+        self.skipped = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def _predict(self, pairs: List[List[str]]) -> np.ndarray:
+        start = time.perf_counter()
+        scores = np.asarray(self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False), dtype=np.float32)
+        elapsed_ms_per_pair = (time.perf_counter() - start) * 1000 / len(pairs)
+        with self._lock:
+            if self.ewma_ms_per_pair is None:
+                self.ewma_ms_per_pair = elapsed_ms_per_pair
+            else:
+                self.ewma_ms_per_pair += EWMA_ALPHA * (elapsed_ms_per_pair - self.ewma_ms_per_pair)
+        return scores
+
+    def _should_skip(self, pair_count: int) -> bool:
+        """上一批次仍在计算，或预估耗时超出预算时跳过（每 PROBE_INTERVAL 次放行一次）"""
+        if self._running is not None and not self._running.done():
+            return True
+        if self.ewma_ms_per_pair is None or self.ewma_ms_per_pair * pair_count <= self.time_budget_ms:
+            self._skipped_in_row = 0
+            return False
+        self._skipped_in_row += 1
+        if self._skipped_in_row >= PROBE_INTERVAL:
+            self._skipped_in_row = 0
+            return False
+        return True
+
+    def score(self, query: str, passages: Sequence[str]) -> Optional[List[float]]:
+        """一次批量前向计算查询与各知识的相关度（0~1），超出时间预算或出错时返回 None"""
+        if not passages:
+            return []
+        with self._lock:
+            if self._should_skip(len(passages)):
+                self.skipped += 1
+                return None
+            future = self._executor.submit(self._predict, [[query, passage] for passage in passages])
+            self._running = future
+
+        try:
+            scores = future.result(timeout=self.time_budget_ms / 1000)
+        except FutureTimeoutError:
+            # 计算继续在后台完成并更新耗时估计，本次请求不再等待
+            with self._lock:
+                self.timeouts += 1
+            log_info(f"交叉编码器重排超出时间预算 {self.time_budget_ms:.0f}ms，使用第一阶段排序")
+            return None
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            log_error(f"交叉编码器重排失败，使用第一阶段排序: {e}")
+            return None
+
+        with self._lock:
+            self.reranked += 1
+        return np.clip(scores, 0.0, 1.0).tolist()
+
+    def stats(self) -> Dict[str, float]:
+        """重排统计"""
+        with self._lock:
+            return {
+                'model': self.model_name,
+                'time_budget_ms': self.time_budget_ms,
+                'ewma_ms_per_pair': self.ewma_ms_per_pair,
+                'reranked': self.reranked,
+                'skipped': self.skipped,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,94 @@
+"""
+检索结果缓存
+缓存 search_relevant_knowledge 的完整结果，键为 (知识库版本, 规范化查询文本, top_k, 预过滤模式, 查询术语)。
+查询术语决定预过滤候选集和术语精确命中加分，调用方传入的术语与从文本中识别出的不同时结果也不同，因此一并计入键。
+知识库在 add_knowledge 或同步/重建索引后递增版本号，旧版本的条目不会再被命中，随LRU/TTL淘汰。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from .embedding import normalize_query_text
+
+# 检索结果缓存配置（条目数为 0 时关闭缓存）
+RESULT_CACHE_SIZE = int(os.environ.get('RAG_RESULT_CACHE_SIZE', '1024'))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get('RAG_RESULT_CACHE_TTL_SECONDS', '600'))
+
+
+class RetrievalResultCache:
+    """进程内 LRU + TTL 的检索结果缓存
+
+    取出时返回知识条目的浅拷贝，调用方修改返回的字典不会影响缓存内容。
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl_seconds: Optional[float] = RESULT_CACHE_TTL_SECONDS):
+        """
+        Args:
+            max_entries: 最大条目数，超出时淘汰最久未使用的条目
+            ttl_seconds: 条目有效期（秒），None 或 0 表示不过期
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds or None
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(version: int, query: str, top_k: int, prefilter: str,
+                 terms: Iterable[str] = ()) -> Tuple[Hashable, ...]:
+        """生成缓存键；查询术语按去重排序后的规范形式计入（检索只按集合使用术语，顺序不影响结果）"""
+        return (version, normalize_query_text(query), top_k, prefilter, tuple(sorted(set(terms))))
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[List[Dict]]:
+        """查询缓存，未命中或已过期时返回 None"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds is not None and now - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return [dict(knowledge) for knowledge in entry[1]]
+
+    def put(self, key: Tuple[Hashable, ...], knowledge_list: List[Dict]):
+        """写入缓存"""
+        if not self.enabled:
+            return
+        snapshot = [dict(knowledge) for knowledge in knowledge_list]
+        with self._lock:
+            self._entries[key] = (time.monotonic(), snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+            }
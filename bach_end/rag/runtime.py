@@ -0,0 +1,411 @@
+"""
+RAG运行时服务
+进程内共享一份知识库/检索器：进程启动时在后台线程中预热（加载编码模型、打开向量库并同步、
+编译术语匹配器），请求到来时按需等待有限时间，未就绪则降级为不使用RAG的诊断方式。
+各组件的状态供 /healthz、/readyz 接口查询。
+
+热重载（蓝绿切换）：在 {db_path}-versions/<版本号> 目录中后台构建新的知识库版本，
+构建完成后原子地替换当前版本的引用；请求通过 lease() 持有所用的版本，
+旧版本在在途请求全部结束后才释放，请求不会看到构建到一半的索引。
+"""
+
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from .medical_rag import DEFAULT_DB_PATH, MedicalKnowledgeBase, MedicalRAGRetriever, create_embedder
+from .term_matcher import get_term_matcher
+
+try:
+    from logger_config import log_info, log_error
+except ImportError:
+    def log_info(msg): pass
+    def log_error(msg, exc_info=False): pass
+
+# 请求等待RAG预热完成的最长时间（秒），超时则本次请求不使用RAG
+RAG_REQUEST_WAIT_SECONDS = float(os.environ.get('RAG_REQUEST_WAIT_SECONDS', '5'))
+
+# 热重载版本目录：{db_path}-versions/<版本号>，CURRENT 文件记录当前生效的版本号
+VERSIONS_DIR_SUFFIX = '-versions'
+CURRENT_VERSION_FILE = 'CURRENT'
+# 未经热重载时使用的知识库目录（db_path 本身）
+BASE_VERSION = 'base'
+# 复制知识库目录时跳过的文件：编码缓存（各版本共享同一编码器，缓存随编码器所在目录），
+# 以及 SQLite 的 WAL/共享内存/回滚日志（数据库通过在线备份接口复制，已包含其中的事务）
+SNAPSHOT_SKIP_PREFIXES = ('embedding_cache.sqlite3',)
+SNAPSHOT_SKIP_SUFFIXES = ('-wal', '-shm', '-journal')
+_SQLITE_HEADER = b'SQLite format 3\x00'
+
+# 组件状态
+STATE_PENDING = 'pending'
+STATE_LOADING = 'loading'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+
+class ComponentStatus:
+    """单个组件的加载状态"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = STATE_PENDING
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {'state': self.state, 'error': self.error, 'elapsed_seconds': elapsed}
+
+
+def _is_sqlite_file(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(_SQLITE_HEADER)) == _SQLITE_HEADER
+
+
+def _backup_sqlite(source_path: str, target_path: str):
+    """通过 SQLite 在线备份接口复制数据库：得到某一时刻一致的快照，包含尚未检查点的 WAL 内容"""
+    source = sqlite3.connect(source_path, timeout=30)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def snapshot_db_dir(source_dir: str, target_dir: str):
+    """复制知识库目录作为新版本的起点
+
+    正在服务的目录中 ChromaDB 的 chroma.sqlite3 处于 WAL 模式，直接按文件复制可能拷到写了一半的页，
+    或丢失尚在 -wal 文件中的事务，因此 SQLite 数据库一律走在线备份接口；
+    其余文件（HNSW 段、NumPy 索引、清单、docstore）按文件复制，调用方需持有知识库的 write_lock，
+    避免复制期间被运行时写入修改。
+    """
+    for root, _dirs, files in os.walk(source_dir):
+        target_root = os.path.join(target_dir, os.path.relpath(root, source_dir))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            if name.startswith(SNAPSHOT_SKIP_PREFIXES) or name.endswith(SNAPSHOT_SKIP_SUFFIXES) or name.endswith('.tmp'):
+                continue
+            source_path, target_path = os.path.join(root, name), os.path.join(target_root, name)
+            if _is_sqlite_file(source_path):
+                _backup_sqlite(source_path, target_path)
+            else:
+                shutil.copy2(source_path, target_path)
+
+
+class KnowledgeVersion:
+    """一个已就绪的知识库版本（知识库 + 检索器）及其在途请求数"""
+
+    def __init__(self, version_id: str, db_path: str, knowledge_base: MedicalKnowledgeBase):
+        self.version_id = version_id
+        self.db_path = db_path
+        self.knowledge_base: Optional[MedicalKnowledgeBase] = knowledge_base
+        self.retriever: Optional[MedicalRAGRetriever] = MedicalRAGRetriever(knowledge_base)
+        self.created_at = time.time()
+        self.active_requests = 0
+        # 已被新版本替换，在途请求结束后释放
+        self.retired = False
+
+    @property
+    def knowledge_count(self) -> int:
+        knowledge_base = self.knowledge_base
+        return knowledge_base.get_knowledge_count() if knowledge_base is not None else 0
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': self.version_id,
+            'knowledge_count': self.knowledge_count,
+            'active_requests': self.active_requests,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.created_at)),
+        }
+
+
+class RAGService:
+    """RAG 组件的后台预热与共享访问
+
+    start() 可重复调用，只会启动一次预热线程；预热完成前 get_retriever() 最多等待给定时间。
+    reload() 在后台构建新的知识库版本并原子切换，请求应通过 lease() 使用检索器。
+    """
+
+    COMPONENTS = ('embedder', 'knowledge_base', 'term_matcher')
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        self.versions_dir = db_path.rstrip('/\\') + VERSIONS_DIR_SUFFIX
+        self.embedder = None
+        self.components = {name: ComponentStatus(name) for name in self.COMPONENTS}
+        self.reload_status = ComponentStatus('reload')
+        self._active: Optional[KnowledgeVersion] = None
+        # 已退役、仍有在途请求的版本
+        self._draining: List[KnowledgeVersion] = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._reload_thread: Optional[threading.Thread] = None
+
+    @property
+    def knowledge_base(self) -> Optional[MedicalKnowledgeBase]:
+        active = self._active
+        return active.knowledge_base if active is not None else None
+
+    @property
+    def retriever(self) -> Optional[MedicalRAGRetriever]:
+        active = self._active
+        return active.retriever if active is not None else None
+
+    def start(self) -> 'RAGService':
+        """启动后台预热线程（只启动一次）"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._warm_up, name='rag-warmup', daemon=True)
+                self._thread.start()
+        return self
+
+    def _run_component(self, name: str, loader):
+        return self._run_status(self.components[name], loader)
+
+    @staticmethod
+    def _run_status(component: ComponentStatus, loader):
+        component.state = STATE_LOADING
+        component.started_at = time.time()
+        try:
+            result = loader()
+            component.state = STATE_READY
+            return result
+        except Exception as e:
+            component.state = STATE_FAILED
+            component.error = str(e)
+            raise
+        finally:
+            component.finished_at = time.time()
+
+    def _warm_up(self):
+        print("🔥 后台预热医学RAG系统...")
+        log_info("开始后台预热医学RAG系统")
+        start = time.time()
+        try:
+            embedder = self._run_component('embedder', lambda: create_embedder(self.db_path))
+            version_id, version_path = self._current_version()
+            knowledge_base = self._run_component(
+                'knowledge_base', lambda: MedicalKnowledgeBase(db_path=version_path, embedder=embedder))
+            self._run_component('term_matcher', get_term_matcher)
+            self.embedder = embedder
+            self._active = KnowledgeVersion(version_id, version_path, knowledge_base)
+            print(f"✅ 医学RAG系统预热完成，用时 {time.time() - start:.1f}s")
+            log_info(f"医学RAG系统预热完成，用时 {time.time() - start:.1f}s")
+        except Exception as e:
+            print(f"⚠️ 医学RAG系统预热失败，诊断将不使用RAG: {e}")
+            log_error(f"医学RAG系统预热失败: {e}", exc_info=True)
+        finally:
+            self._done.set()
+
+    @property
+    def state(self) -> str:
+        """整体状态：pending / loading / ready / failed"""
+        if self._thread is None:
+            return STATE_PENDING
+        if not self._done.is_set():
+            return STATE_LOADING
+        return STATE_READY if self.retriever is not None else STATE_FAILED
+
+    def is_ready(self) -> bool:
+        return self.state == STATE_READY
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待预热结束（成功或失败），返回是否已就绪"""
+        self.start()
+        self._done.wait(timeout)
+        return self.is_ready()
+
+    def get_retriever(self, timeout: Optional[float] = None) -> Optional[MedicalRAGRetriever]:
+        """获取当前版本的检索器；预热未在 timeout 秒内完成或预热失败时返回 None
+
+        返回值不受热重载保护，跨越多次检索使用时请改用 lease()。
+        """
+        return self.retriever if self.wait(timeout) else None
+
+    def get_knowledge_base(self, timeout: Optional[float] = None) -> Optional[MedicalKnowledgeBase]:
+        return self.knowledge_base if self.wait(timeout) else None
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        """在一次请求内持有当前知识库版本的检索器（未就绪时为 None）
+
+        持有期间发生的热重载不会释放该版本：
+
+            with rag_service.lease(timeout) as retriever:
+                if retriever is not None:
+                    retrieval = retriever.retrieve(symptoms)
+        """
+        version = None
+        if self.wait(timeout):
+            with self._lock:
+                version = self._active
+                if version is not None:
+                    version.active_requests += 1
+        try:
+            yield version.retriever if version is not None else None
+        finally:
+            if version is not None:
+                with self._lock:
+                    version.active_requests -= 1
+                    drained = version.retired and version.active_requests == 0
+                if drained:
+                    self._free(version)
+
+    def _current_version(self) -> Tuple[str, str]:
+        """CURRENT 文件指向的版本号和目录；没有热重载过（或版本目录不存在）时使用 db_path"""
+        current_path = os.path.join(self.versions_dir, CURRENT_VERSION_FILE)
+        if os.path.exists(current_path):
+            with open(current_path, 'r', encoding='utf-8') as f:
+                version_id = f.read().strip()
+            version_path = os.path.join(self.versions_dir, version_id)
+            if version_id and os.path.isdir(version_path):
+                return version_id, version_path
+        return BASE_VERSION, self.db_path
+
+    def _write_current_version(self, version_id: str):
+        current_path = os.path.join(self.versions_dir, CURRENT_VERSION_FILE)
+        with open(current_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(version_id)
+        os.replace(current_path + '.tmp', current_path)
+
+    def reload(self, full_rebuild: bool = False) -> bool:
+        """在后台构建新的知识库版本，就绪后原子切换
+
+        Args:
+            full_rebuild: 从空目录按知识数据全量建库（不装载索引制品）；默认复制当前版本的索引，按内容哈希只编码有变化的记录
+        Returns:
+            是否开始重载（预热未就绪或已有重载在进行时返回 False）
+        """
+        if not self.is_ready():
+            return False
+        with self._lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self.reload_status = ComponentStatus('reload')
+            self._reload_thread = threading.Thread(target=self._reload, args=(full_rebuild,),
+                                                   name='rag-reload', daemon=True)
+            self._reload_thread.start()
+        return True
+
+    def wait_reload(self, timeout: Optional[float] = None) -> bool:
+        """等待正在进行的重载结束，返回最近一次重载是否成功"""
+        thread = self._reload_thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.reload_status.state == STATE_READY
+
+    def _reload(self, full_rebuild: bool):
+        current = self._active
+        version_id = time.strftime('%Y%m%d-%H%M%S')
+        version_path = os.path.join(self.versions_dir, version_id)
+        suffix = 1
+        while os.path.exists(version_path) or version_id == current.version_id:
+            version_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+            version_path = os.path.join(self.versions_dir, version_id)
+            suffix += 1
+
+        print(f"🔄 后台构建知识库新版本 {version_id}（{'全量重建' if full_rebuild else '增量同步'}）...")
+        log_info(f"开始构建知识库新版本 {version_id}，当前版本 {current.version_id}，全量重建: {full_rebuild}")
+        try:
+            self._remove_stale_versions()
+
+            def build() -> KnowledgeVersion:
+                if full_rebuild:
+                    os.makedirs(version_path)
+                else:
+                    # 以当前版本的索引和清单的一致快照为起点，同步时只编码新增/变更的记录
+                    with current.knowledge_base.write_lock:
+                        snapshot_db_dir(current.db_path, version_path)
+                # 全量重建按知识数据重新编码，不装载磁盘上的预构建索引制品
+                knowledge_base = MedicalKnowledgeBase(db_path=version_path, embedder=self.embedder,
+                                                      reranker=current.knowledge_base.reranker,
+                                                      use_artifact=not full_rebuild)
+                return KnowledgeVersion(version_id, version_path, knowledge_base)
+
+            version = self._run_status(self.reload_status, build)
+            self._write_current_version(version_id)
+        except Exception as e:
+            shutil.rmtree(version_path, ignore_errors=True)
+            print(f"⚠️ 知识库新版本构建失败，继续使用版本 {current.version_id}: {e}")
+            log_error(f"知识库新版本 {version_id} 构建失败: {e}", exc_info=True)
+            return
+
+        # 原子切换：新请求使用新版本，旧版本在在途请求结束后释放
+        with self._lock:
+            previous, self._active = self._active, version
+            previous.retired = True
+            drained = previous.active_requests == 0
+            if not drained:
+                self._draining.append(previous)
+        if drained:
+            self._free(previous)
+        print(f"✅ 已切换到知识库版本 {version_id}，包含 {version.knowledge_count} 条记录")
+        log_info(f"切换到知识库版本 {version_id}（{version.knowledge_count} 条记录），旧版本 {previous.version_id} 等待 {previous.active_requests} 个在途请求")
+
+    def _free(self, version: KnowledgeVersion):
+        """释放已退役且没有在途请求的版本：关闭其向量存储（ChromaDB 客户端），热重载生成的版本目录一并删除"""
+        with self._lock:
+            if version in self._draining:
+                self._draining.remove(version)
+        knowledge_base, version.knowledge_base, version.retriever = version.knowledge_base, None, None
+        if knowledge_base is not None:
+            try:
+                knowledge_base.close()
+            except Exception as e:
+                log_error(f"关闭知识库版本 {version.version_id} 的向量存储失败: {e}")
+        if version.db_path != self.db_path:
+            shutil.rmtree(version.db_path, ignore_errors=True)
+        log_info(f"已释放知识库版本 {version.version_id}")
+
+    def _remove_stale_versions(self):
+        """删除既非当前版本也不在等待释放的版本目录（如中断的构建）"""
+        if not os.path.isdir(self.versions_dir):
+            os.makedirs(self.versions_dir)
+            return
+        with self._lock:
+            in_use = {self._active.db_path} | {version.db_path for version in self._draining}
+        for name in os.listdir(self.versions_dir):
+            path = os.path.join(self.versions_dir, name)
+            if os.path.isdir(path) and path not in in_use:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def status(self) -> Dict:
+        """整体与各组件状态、当前知识库版本与热重载状态"""
+        status = {
+            'state': self.state,
+            'components': {name: component.to_dict() for name, component in self.components.items()},
+            'reload': self.reload_status.to_dict(),
+        }
+        active = self._active
+        if active is not None:
+            status['knowledge_count'] = active.knowledge_count
+            status['version'] = active.to_dict()
+        with self._lock:
+            status['draining'] = [version.to_dict() for version in self._draining]
+        return status
+
+
+_service: Optional[RAGService] = None
+_service_lock = threading.Lock()
+
+
+def get_rag_service() -> RAGService:
+    """获取进程内共享的RAG服务（不会自动开始预热）"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = RAGService()
+    return _service
@@ -0,0 +1,229 @@
+"""
+按疾病类别分片的向量存储
+每个类别（呼吸系统疾病、心血管疾病……）一个分片（ChromaDB集合或NumPy索引目录），
+并维护各类别的质心向量。查询先按质心相似度路由到最相近的若干类别，只并行检索这些分片，
+再按距离合并结果，检索延迟不随类别总数和语料规模线性增长。
+
+对外接口与单一向量存储一致（count / add / delete / reset / get / query），由 MedicalKnowledgeBase 按配置选择。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .vector_index import QueryHits
+
+# 记录缺少类别时归入的分片
+DEFAULT_CATEGORY = '其他疾病'
+
+
+def shard_name(category: str) -> str:
+    """类别对应的分片名（ASCII，可直接作为ChromaDB集合名或目录名）"""
+    return 'c' + hashlib.md5(category.encode('utf-8')).hexdigest()[:12]
+
+
+class ShardedVectorStore:
+    """按类别分片 + 质心路由的向量存储
+
+    shards.json 记录每个类别的分片名、向量累加和与记录数，质心 = 累加和归一化。
+    同ID覆盖写入时累加和不扣除旧向量，质心为近似值，只影响路由不影响距离计算。
+    """
+
+    REGISTRY_FILE = 'shards.json'
+
+    def __init__(self, root_dir: str, shard_factory: Callable[[str], object],
+                 route_top_n: int = 3, max_workers: int = 4, on_close: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            root_dir: 分片注册表所在目录
+            shard_factory: 根据分片名打开单个分片存储的函数
+            route_top_n: 每条查询检索的类别数
+            max_workers: 并行检索分片的线程数
+            on_close: 全部分片关闭后调用一次，用于释放各分片共用的资源（如同一目录的 ChromaDB 客户端）
+        """
+        self.root_dir = root_dir
+        self.shard_factory = shard_factory
+        self.on_close = on_close
+        self.route_top_n = route_top_n
+        self.max_workers = max(1, max_workers)
+        self._shards: Dict[str, object] = {}
+        self._registry: Dict[str, Dict] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._categories: List[str] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        os.makedirs(root_dir, exist_ok=True)
+        self._load_registry()
+
+    @property
+    def categories(self) -> List[str]:
+        return list(self._registry)
+
+    def _load_registry(self):
+        path = os.path.join(self.root_dir, self.REGISTRY_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._registry = json.load(f)
+        for category in self._registry:
+            self._shard(category)
+        self._refresh_centroids()
+
+    def _save_registry(self):
+        path = os.path.join(self.root_dir, self.REGISTRY_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._registry, f, ensure_ascii=False)
+        os.replace(path + '.tmp', path)
+
+    def _refresh_centroids(self):
+        """由累加和计算归一化质心矩阵"""
+        self._categories = [category for category, entry in self._registry.items() if entry['count'] > 0]
+        if not self._categories:
+            self._centroids = None
+            return
+        sums = np.asarray([self._registry[category]['sum'] for category in self._categories], dtype=np.float32)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        self._centroids = sums / np.maximum(norms, 1e-12)
+
+    def _shard(self, category: str):
+        shard = self._shards.get(category)
+        if shard is None:
+            name = self._registry.get(category, {}).get('name') or shard_name(category)
+            shard = self.shard_factory(name)
+            self._shards[category] = shard
+        return shard
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='rag-shard')
+        return self._executor
+
+    def count(self) -> int:
+        return sum(shard.count() for shard in self._shards.values())
+
+    def add(self, ids: Sequence[str], embeddings: np.ndarray,
+            documents: Optional[Sequence[str]] = None, metadatas: Optional[Sequence[Dict]] = None):
+        """按 metadata 中的 category 分组写入各分片，并更新类别质心"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in ids]
+        documents = list(documents) if documents is not None else None
+
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            category = (metadata or {}).get('category') or DEFAULT_CATEGORY
+            groups.setdefault(category, []).append(i)
+
+        with self._lock:
+            for category, rows in groups.items():
+                self._shard(category).add(
+                    ids=[ids[i] for i in rows],
+                    embeddings=embeddings[rows],
+                    documents=[documents[i] for i in rows] if documents is not None else None,
+                    metadatas=[metadatas[i] for i in rows]
+                )
+                entry = self._registry.setdefault(
+                    category, {'name': shard_name(category), 'count': 0, 'sum': [0.0] * embeddings.shape[1]})
+                entry['sum'] = (np.asarray(entry['sum'], dtype=np.float64) + embeddings[rows].sum(axis=0)).tolist()
+                entry['count'] += len(rows)
+            self._save_registry()
+            self._refresh_centroids()
+
+    def delete(self, ids: Sequence[str]):
+        """从各分片删除记录，并从类别质心中扣除对应向量
+
+        每个分片只查找尚未找到的ID，全部找到后不再查询其余分片。
+        """
+        with self._lock:
+            missing = list(dict.fromkeys(ids))
+            for category, shard in self._shards.items():
+                if not missing:
+                    break
+                found = shard.get(missing)
+                if not found:
+                    continue
+                missing = [record_id for record_id in missing if record_id not in found]
+                shard.delete(list(found))
+                entry = self._registry[category]
+                vectors = np.asarray([vector for vector, _ in found.values()], dtype=np.float64)
+                entry['sum'] = (np.asarray(entry['sum'], dtype=np.float64) - vectors.sum(axis=0)).tolist()
+                entry['count'] = max(0, entry['count'] - len(found))
+            self._save_registry()
+            self._refresh_centroids()
+
+    def reset(self):
+        """清空全部分片和质心"""
+        with self._lock:
+            for shard in self._shards.values():
+                shard.reset()
+            self._registry = {}
+            self._save_registry()
+            self._refresh_centroids()
+
+    def get(self, ids: Sequence[str]) -> Dict[str, Tuple[np.ndarray, Dict]]:
+        """按ID取回向量和metadata（在各分片中查找）"""
+        found = {}
+        for shard in self._shards.values():
+            missing = [record_id for record_id in ids if record_id not in found]
+            if not missing:
+                break
+            found.update(shard.get(missing))
+        return found
+
+    def route(self, query_embeddings: np.ndarray, top_n: Optional[int] = None) -> List[List[str]]:
+        """按质心相似度为每条查询选出最相近的类别"""
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if self._centroids is None:
+            return [[] for _ in range(len(queries))]
+        top_n = min(top_n or self.route_top_n, len(self._categories))
+        similarities = queries @ self._centroids.T
+        order = np.argsort(-similarities, axis=1, kind='stable')[:, :top_n]
+        return [[self._categories[i] for i in row] for row in order]
+
+    def query(self, query_embeddings: np.ndarray, top_k: int,
+              candidate_ids: Optional[Sequence[str]] = None) -> QueryHits:
+        """批量 top-k 查询
+
+        无候选集时每条查询只检索路由到的类别分片；有候选集时候选已限定范围，检索全部分片。
+        同一分片上的多条查询合并为一次批量查询，各分片并行执行。
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if candidate_ids is not None:
+            routes = [list(self._categories) for _ in range(len(queries))]
+        else:
+            routes = self.route(queries)
+
+        shard_queries: Dict[str, List[int]] = {}
+        for query_index, categories in enumerate(routes):
+            for category in categories:
+                shard_queries.setdefault(category, []).append(query_index)
+
+        def run(category: str):
+            rows = shard_queries[category]
+            return rows, self._shards[category].query(queries[rows], top_k, candidate_ids=candidate_ids)
+
+        if len(shard_queries) > 1:
+            results = list(self._pool().map(run, list(shard_queries)))
+        else:
+            results = [run(category) for category in shard_queries]
+
+        merged: List[List[Tuple[str, float, Dict]]] = [[] for _ in range(len(queries))]
+        for rows, shard_hits in results:
+            for query_index, hits in zip(rows, shard_hits):
+                merged[query_index].extend(hits)
+        return [sorted(hits, key=lambda hit: hit[1])[:top_k] for hits in merged]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        for shard in self._shards.values():
+            close = getattr(shard, 'close', None)
+            if close is not None:
+                close()
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
@@ -0,0 +1,57 @@
+"""
+知识片段预渲染
+MedicalRAGRetriever 的两种知识格式（Markdown 知识参考、诊断提示词）中，每条知识除序号和相关度外的
+正文在建库时渲染好并保存在 docstore 中；请求时只需拼接命中记录的片段并补上序号和相关度行。
+"""
+
+from typing import Dict
+
+# 片段样式
+SNIPPET_MARKDOWN = 'markdown'    # format_knowledge / retrieve_and_format
+SNIPPET_DIAGNOSIS = 'diagnosis'  # format_knowledge_for_diagnosis
+SNIPPET_STYLES = (SNIPPET_MARKDOWN, SNIPPET_DIAGNOSIS)
+
+
+def render_markdown_snippet(knowledge: Dict) -> str:
+    """Markdown 知识参考中单条知识的正文（标题中序号之后的部分，不含相关度）"""
+    lines = [f"{knowledge['disease']} ({knowledge['category']})\n"]
+    if knowledge.get('symptoms'):
+        lines.append(f"**常见症状：** {', '.join(knowledge['symptoms'])}\n")
+    if knowledge.get('imaging_findings'):
+        lines.append(f"**影像表现：** {', '.join(knowledge['imaging_findings'])}\n")
+    if knowledge.get('diagnosis_criteria'):
+        lines.append(f"**诊断标准：** {knowledge['diagnosis_criteria']}\n")
+    if knowledge.get('diagnosis_methods'):
+        lines.append(f"**诊断方法：** {', '.join(knowledge['diagnosis_methods'])}\n")
+    if knowledge.get('treatment'):
+        lines.append(f"**治疗方案：** {knowledge['treatment']}\n")
+    if knowledge.get('causes'):
+        lines.append(f"**病因：** {knowledge['causes'][:200]}\n")  # 限制长度
+    if knowledge.get('content'):
+        lines.append(f"**详细说明：** {knowledge['content']}\n")
+    return ''.join(lines)
+
+
+def render_diagnosis_snippet(knowledge: Dict) -> str:
+    """诊断提示词中单条知识的正文（序号之后的部分，不含相关度）"""
+    lines = [f"疾病：{knowledge['disease']} (分类：{knowledge['category']})\n"]
+    if knowledge.get('symptoms'):
+        lines.append(f"   常见症状：{', '.join(knowledge['symptoms'][:5])}\n")  # 只显示前5个症状
+    if knowledge.get('causes'):
+        lines.append(f"   病因：{knowledge['causes'][:100]}\n")  # 限制长度
+    if knowledge.get('treatment'):
+        lines.append(f"   治疗：{knowledge['treatment'][:100]}\n")
+    if knowledge.get('diagnosis_methods'):
+        lines.append(f"   诊断方法：{', '.join(knowledge['diagnosis_methods'][:3])}\n")
+    return ''.join(lines)
+
+
+RENDERERS = {
+    SNIPPET_MARKDOWN: render_markdown_snippet,
+    SNIPPET_DIAGNOSIS: render_diagnosis_snippet,
+}
+
+
+def render_snippets(knowledge: Dict) -> Dict[str, str]:
+    """渲染一条知识的全部样式片段"""
+    return {style: renderer(knowledge) for style, renderer in RENDERERS.items()}
@@ -0,0 +1,89 @@
+"""
+症状 → 知识记录 倒排索引
+启动时由知识库记录的 symptoms 列表（及疾病名）构建，用于在向量检索前把候选范围缩小到
+与查询症状相关的少量疾病
+"""
+
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 预过滤模式
+PREFILTER_NONE = 'none'
+PREFILTER_UNION = 'union'                # 命中任一症状的记录
+PREFILTER_INTERSECTION = 'intersection'  # 命中全部症状的记录；没有时退化为命中数最多的记录
+PREFILTER_MODES = (PREFILTER_NONE, PREFILTER_UNION, PREFILTER_INTERSECTION)
+
+
+class SymptomInvertedIndex:
+    """症状倒排索引，倒排表为紧凑的 array('I') 记录序号"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self._id_to_doc: Dict[str, int] = {}
+        self._postings: Dict[str, array] = {}
+        # 每条记录当前的词（与 ids 对齐），重复添加同一ID时据此删除旧的倒排项
+        self._doc_terms: List[Tuple[str, ...]] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def term_count(self) -> int:
+        return len(self._postings)
+
+    def add(self, ids: Sequence[str], term_lists: Iterable[Iterable[str]]):
+        """添加记录及其症状/疾病名（同ID重复添加时以新的词替换旧的词）"""
+        for record_id, terms in zip(ids, term_lists):
+            terms = tuple(set(term.strip() for term in terms if term and term.strip()))
+            doc = self._id_to_doc.get(record_id)
+            if doc is None:
+                doc = len(self.ids)
+                self.ids.append(record_id)
+                self._id_to_doc[record_id] = doc
+                self._doc_terms.append(terms)
+            else:
+                self._remove_postings(doc)
+                self._doc_terms[doc] = terms
+            for term in terms:
+                self._postings.setdefault(term, array('I')).append(doc)
+
+    def _remove_postings(self, doc: int):
+        """从该记录旧的词的倒排表中删除记录序号，倒排表为空时删除该词"""
+        for term in self._doc_terms[doc]:
+            postings = self._postings[term]
+            postings.remove(doc)
+            if not postings:
+                del self._postings[term]
+
+    def postings(self, term: str) -> List[str]:
+        """返回包含该词的记录ID"""
+        return [self.ids[doc] for doc in self._postings.get(term, ())]
+
+    def candidates(self, terms: Iterable[str], mode: str = PREFILTER_UNION,
+                   limit: Optional[int] = None) -> List[str]:
+        """根据查询词求候选记录，按命中词数降序
+
+        Args:
+            terms: 查询中识别出的症状/疾病名
+            mode: union 取并集；intersection 取命中全部已知词的记录，没有则取命中数最多的记录
+            limit: 最多返回的候选数
+
+        Returns:
+            候选记录ID列表；查询词都不在索引中时返回空列表
+        """
+        known_terms = [term for term in set(terms) if term in self._postings]
+        if not known_terms:
+            return []
+
+        overlap = Counter()
+        for term in known_terms:
+            overlap.update(self._postings[term])
+
+        ranked = overlap.most_common()
+        if mode == PREFILTER_INTERSECTION:
+            best = ranked[0][1]
+            ranked = [(doc, count) for doc, count in ranked if count == best]
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [self.ids[doc] for doc, _ in ranked]
@@ -0,0 +1,182 @@
+"""
+医学术语匹配 - 基于Aho-Corasick自动机
+一次线性扫描即可从大模型输出的症状文本中找出 symptom.txt / disease.txt 中出现的全部术语
+"""
+
+import os
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .lexical import DISEASE_DICT_PATH, SYMPTOM_DICT_PATH
+
+# 单字术语误匹配太多，默认忽略
+MIN_TERM_LENGTH = 2
+
+
+class AhoCorasickMatcher:
+    """Aho-Corasick 多模式匹配自动机
+
+    每个状态保存：转移表、失败指针、该状态结束的模式序号，以及沿失败链最近的输出状态（dict link），
+    匹配时只需沿 dict link 输出，不必遍历整条失败链。
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._terminal: List[int] = [-1]
+        self._dict_link: List[int] = [0]
+        self.patterns: List[str] = []
+        self.payloads: List[object] = []
+        self._built = False
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def add(self, pattern: str, payload: object = None):
+        """添加模式串（重复添加同一模式串时保留第一次的payload）"""
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][ch] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(-1)
+                self._dict_link.append(0)
+            state = next_state
+        if self._terminal[state] == -1:
+            self._terminal[state] = len(self.patterns)
+            self.patterns.append(pattern)
+            self.payloads.append(payload)
+        self._built = False
+
+    def build(self):
+        """按BFS计算失败指针和输出链接"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            self._dict_link[state] = 0
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                if fail == next_state:
+                    fail = 0
+                self._fail[next_state] = fail
+                self._dict_link[next_state] = fail if self._terminal[fail] != -1 else self._dict_link[fail]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """遍历所有匹配，产出 (起始位置, 结束位置(不含), 模式序号)"""
+        if not self._built:
+            self.build()
+
+        goto = self._goto
+        fail = self._fail
+        terminal = self._terminal
+        dict_link = self._dict_link
+        state = 0
+        for end, ch in enumerate(text, 1):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+
+            output = state if terminal[state] != -1 else dict_link[state]
+            while output:
+                index = terminal[output]
+                yield end - len(self.patterns[index]), end, index
+                output = dict_link[output]
+
+    def find_longest(self, text: str) -> List[Tuple[int, int, int]]:
+        """最左最长、互不重叠的匹配"""
+        matches = sorted(self.iter_matches(text), key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        last_end = 0
+        for start, end, index in matches:
+            if start >= last_end:
+                selected.append((start, end, index))
+                last_end = end
+        return selected
+
+
+class MedicalTerms:
+    """从一段文本中识别出的医学术语（规范名，按出现顺序去重）"""
+
+    def __init__(self, raw_text: str, symptoms: List[str], diseases: List[str]):
+        self.raw_text = raw_text
+        self.symptoms = symptoms
+        self.diseases = diseases
+
+    @property
+    def all_terms(self) -> List[str]:
+        return self.symptoms + self.diseases
+
+    def to_dict(self) -> Dict:
+        return {'raw_text': self.raw_text, 'symptoms': self.symptoms, 'diseases': self.diseases}
+
+    def __bool__(self) -> bool:
+        return bool(self.symptoms or self.diseases)
+
+
+class MedicalTermMatcher:
+    """加载症状词典和疾病词典的术语匹配器"""
+
+    SYMPTOM = 'symptom'
+    DISEASE = 'disease'
+
+    def __init__(self, symptom_path: str = SYMPTOM_DICT_PATH, disease_path: str = DISEASE_DICT_PATH,
+                 min_length: int = MIN_TERM_LENGTH):
+        self.automaton = AhoCorasickMatcher()
+        for path, term_type in ((symptom_path, self.SYMPTOM), (disease_path, self.DISEASE)):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    term = line.strip()
+                    if len(term) >= min_length:
+                        self.automaton.add(term, term_type)
+        self.automaton.build()
+
+    def __len__(self) -> int:
+        return len(self.automaton)
+
+    def extract(self, text: str) -> MedicalTerms:
+        """提取文本中的症状与疾病术语"""
+        symptoms: Dict[str, None] = {}
+        diseases: Dict[str, None] = {}
+        for _, _, index in self.automaton.find_longest(text or ''):
+            term = self.automaton.patterns[index]
+            if self.automaton.payloads[index] == self.DISEASE:
+                diseases[term] = None
+            else:
+                symptoms[term] = None
+        return MedicalTerms(text, list(symptoms), list(diseases))
+
+
+_matcher: Optional[MedicalTermMatcher] = None
+_matcher_lock = threading.Lock()
+
+
+def get_term_matcher() -> MedicalTermMatcher:
+    """获取进程内共享的术语匹配器（首次调用时编译自动机）"""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = MedicalTermMatcher()
+    return _matcher
+
+
+def extract_medical_terms(text: str) -> MedicalTerms:
+    """从文本中提取医学术语"""
+    return get_term_matcher().extract(text)
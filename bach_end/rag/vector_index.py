@@ -0,0 +1,676 @@
+"""
+向量存储后端
+- ChromaVectorStore: 基于ChromaDB（SQLite + HNSW）的持久化向量库
+- VectorIndex: 进程内内存映射NumPy矩阵，向量化点积 + argpartition 求 top-k
+
+两者提供相同的接口（count / add / delete / reset / get / query），由 MedicalKnowledgeBase 按配置选择。
+VectorIndex 可选 int8 / 二值量化：首轮在常驻内存的量化编码上扫描，再对前若干候选用原始向量精确重排。
+查询返回的距离统一为归一化向量间的平方L2距离（与ChromaDB默认的 l2 空间一致），
+因此上层 relevance_score = 1 - distance 的含义不随后端变化。
+"""
+
+import json
+import os
+import struct
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 查询结果：每条查询对应一个 (id, distance, metadata) 列表
+QueryHits = List[List[Tuple[str, float, Dict]]]
+
+# 量化方式
+QUANTIZATION_NONE = 'none'
+QUANTIZATION_INT8 = 'int8'      # 每行按最大绝对值缩放到 [-127, 127]，内存为 float32 的 1/4
+QUANTIZATION_BINARY = 'binary'  # 每维只保留符号位，按汉明距离粗排，内存为 float32 的 1/32
+QUANTIZATION_MODES = (QUANTIZATION_NONE, QUANTIZATION_INT8, QUANTIZATION_BINARY)
+
+# 每个字节中置位的个数（二值编码的汉明距离）
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# 追加写入的 .npy 文件使用固定长度的头部，行数增长后原位改写头部中的形状
+NPY_HEADER_SIZE = 128
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """按行对称量化为 int8，返回 (编码, 每行缩放系数)，向量 ≈ 编码 * 缩放系数"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.maximum(np.abs(vectors).max(axis=1, initial=0.0) / 127.0, 1e-12).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """按符号位量化并按位打包，返回 (行数, ceil(维度/8)) 的 uint8 编码"""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+class ChromaVectorStore:
+    """ChromaDB 向量存储"""
+
+    def __init__(self, db_path: str, collection_name: str, embedding_function=None,
+                 collection_metadata: Optional[Dict] = None, client=None):
+        """
+        Args:
+            client: 共用的 PersistentClient（如同一目录下的各分片集合）；传入时由调用方负责关闭
+        """
+        import chromadb
+
+        self.db_path = db_path
+        self.collection_name = collection_name
+        self.collection_metadata = collection_metadata
+        self.embedding_function = embedding_function
+        self._owns_client = client is None
+        self.client = client if client is not None else chromadb.PersistentClient(path=db_path)
+        self.collection = self._open_collection()
+
+    def _open_collection(self):
+        return self.client.get_or_create_collection(
+            name=self.collection_name,
+            metadata=self.collection_metadata,
+            embedding_function=self.embedding_function
+        )
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def add(self, ids: Sequence[str], embeddings: np.ndarray,
+            documents: Optional[Sequence[str]] = None, metadatas: Optional[Sequence[Dict]] = None):
+        """添加或覆盖向量（同ID覆盖）"""
+        self.collection.upsert(
+            ids=list(ids),
+            embeddings=np.asarray(embeddings, dtype=np.float32).tolist(),
+            documents=list(documents) if documents is not None else None,
+            metadatas=list(metadatas) if metadatas is not None else None
+        )
+
+    def delete(self, ids: Sequence[str]):
+        """按ID删除记录"""
+        if ids:
+            self.collection.delete(ids=list(ids))
+
+    def reset(self):
+        """删除并重建集合"""
+        self.client.delete_collection(self.collection_name)
+        self.collection = self._open_collection()
+
+    def get(self, ids: Sequence[str]) -> Dict[str, Tuple[np.ndarray, Dict]]:
+        """按ID取回向量和metadata"""
+        results = self.collection.get(ids=list(ids), include=['embeddings', 'metadatas'])
+        return {
+            record_id: (np.asarray(embedding, dtype=np.float32), metadata or {})
+            for record_id, embedding, metadata in zip(results['ids'], results['embeddings'], results['metadatas'])
+        }
+
+    def query(self, query_embeddings: np.ndarray, top_k: int,
+              candidate_ids: Optional[Sequence[str]] = None) -> QueryHits:
+        """批量 top-k 查询；candidate_ids 非空时只在这些记录中检索（基于 metadata 中的 record_id）"""
+        where = None
+        if candidate_ids is not None:
+            where = {'record_id': {'$in': list(candidate_ids)}}
+            top_k = min(top_k, len(candidate_ids))
+        results = self.collection.query(
+            query_embeddings=np.asarray(query_embeddings, dtype=np.float32).tolist(),
+            n_results=top_k,
+            where=where,
+            include=['metadatas', 'distances']
+        )
+
+        hits = []
+        for query_index in range(len(query_embeddings)):
+            ids = results['ids'][query_index]
+            metadatas = results['metadatas'][query_index] if results['metadatas'] else [{}] * len(ids)
+            distances = results['distances'][query_index] if results['distances'] else [0.0] * len(ids)
+            hits.append(list(zip(ids, distances, metadatas)))
+        return hits
+
+    def close(self):
+        """释放集合；客户端由本对象创建时一并关闭（见 close_chroma_client），共用的客户端由调用方关闭"""
+        client, self.client, self.collection = self.client, None, None
+        if client is not None and self._owns_client:
+            close_chroma_client(client)
+
+
+def close_chroma_client(client):
+    """停止客户端背后的 ChromaDB 系统（SQLite 连接、HNSW 段）并移出 chromadb 的进程级共享缓存
+
+    PersistentClient 按路径缓存共享的系统实例，只删除引用不会释放；同一路径的其他客户端随之失效，
+    应在整个目录不再使用时调用。只移除本路径的缓存项，不影响其他版本目录的客户端。
+    """
+    try:
+        from chromadb.api.client import SharedSystemClient
+    except ImportError:
+        SharedSystemClient = None
+    identifier = getattr(client, '_identifier', None)
+    systems = getattr(SharedSystemClient, '_identifier_to_system', None)
+    system = systems.pop(identifier, None) if isinstance(systems, dict) else getattr(client, '_system', None)
+    if system is not None:
+        system.stop()
+
+
+def _npy_header(dtype: np.dtype, shape: Tuple[int, ...], size: int = NPY_HEADER_SIZE) -> bytes:
+    """生成长度恰好为 size 字节的 .npy（1.0版）头部，放不下时抛出 ValueError"""
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False,
+                   'shape': tuple(int(dim) for dim in shape)})
+    padding = size - len(_NPY_MAGIC) - 2 - len(header) - 1
+    if padding < 0:
+        raise ValueError(f".npy 头部超过 {size} 字节: {header}")
+    return _NPY_MAGIC + struct.pack('<H', size - len(_NPY_MAGIC) - 2) + (header + ' ' * padding + '\n').encode('latin1')
+
+
+def _npy_layout(path: str) -> Optional[Tuple[int, Tuple[int, ...], np.dtype]]:
+    """读取 .npy 文件的 (数据起始位置, 形状, 类型)；文件不存在或无法原位追加（非1.0版头部、Fortran顺序）时返回 None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        if np.lib.format.read_magic(f) != (1, 0):
+            return None
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        return None if fortran_order else (f.tell(), shape, dtype)
+
+
+def _save_npy(path: str, rows: np.ndarray, dtype: np.dtype):
+    """按块转换类型写出 .npy 文件（固定长度头部，之后可原位追加），写临时文件后原子替换"""
+    with open(path + '.tmp', 'wb') as f:
+        f.write(_npy_header(dtype, rows.shape))
+        for start in range(0, len(rows), VectorIndex.SCAN_CHUNK_ROWS):
+            f.write(np.ascontiguousarray(rows[start:start + VectorIndex.SCAN_CHUNK_ROWS], dtype=dtype).tobytes())
+    os.replace(path + '.tmp', path)
+
+
+def _can_append_npy(path: str, count: int, dtype: np.dtype, row_shape: Tuple[int, ...], new_count: int) -> bool:
+    """文件的行数、行形状和类型与预期一致，且头部容得下新的行数"""
+    layout = _npy_layout(path)
+    if layout is None:
+        return False
+    offset, shape, file_dtype = layout
+    if shape[:1] != (count,) or tuple(shape[1:]) != tuple(row_shape) or file_dtype != dtype:
+        return False
+    try:
+        _npy_header(dtype, (new_count,) + tuple(row_shape), offset)
+    except ValueError:
+        return False
+    return True
+
+
+def _append_npy(path: str, count: int, rows: np.ndarray):
+    """在 .npy 文件的前 count 行之后追加 rows，最后改写头部中的行数
+
+    已有的行不会被修改（旧状态的查询可能仍在读取同一个内存映射）。
+    头部是提交点：写到一半中断时头部仍是旧行数，多出的字节不会被读到。调用前需先用 _can_append_npy 检查。
+    """
+    offset, shape, dtype = _npy_layout(path)
+    row_bytes = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+    with open(path, 'r+b') as f:
+        f.seek(offset + count * row_bytes)
+        f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+        f.truncate()
+        f.seek(0)
+        f.write(_npy_header(dtype, (count + len(rows),) + tuple(shape[1:]), offset))
+
+
+def _grow(buffer: Optional[np.ndarray], count: int, rows: np.ndarray) -> np.ndarray:
+    """在内存缓冲区的前 count 行之后追加 rows，容量不足时按两倍扩容（均摊 O(1)），返回缓冲区"""
+    needed = count + len(rows)
+    if buffer is None or needed > len(buffer):
+        capacity = max(needed, 2 * (len(buffer) if buffer is not None else 0))
+        grown = np.empty((capacity,) + rows.shape[1:], dtype=rows.dtype)
+        if buffer is not None:
+            grown[:count] = buffer[:count]
+        buffer = grown
+    buffer[count:needed] = rows
+    return buffer
+
+
+class _IndexState:
+    """VectorIndex 某一时刻的完整状态：向量矩阵、记录ID、metadata、ID→行号以及量化编码
+
+    每次写入都构造新的状态对象，再整体替换 VectorIndex._state 这一个引用；查询开始时取一次引用并全程只读它，
+    不会看到向量行与记录ID不对应的中间状态。
+    追加写入时新旧状态共享只增不减的 ids / metadatas 列表和 ID→行号字典（避免每次写入复制整个索引），
+    每个状态只访问前 count 行，行号不小于 count 的ID对该状态不存在；前 count 行的向量和 metadata 从不原位修改，
+    删除或覆盖已有记录时生成全新的列表、字典和索引文件。
+    """
+
+    __slots__ = ('vectors', 'ids', 'metadatas', 'id_to_row', 'codes', 'scales', 'count')
+
+    def __init__(self, vectors: Optional[np.ndarray] = None, ids: Optional[List[str]] = None,
+                 metadatas: Optional[List[Dict]] = None, id_to_row: Optional[Dict[str, int]] = None,
+                 count: Optional[int] = None):
+        self.vectors = vectors
+        self.ids = ids if ids is not None else []
+        self.metadatas = metadatas if metadatas is not None else []
+        self.id_to_row = id_to_row if id_to_row is not None else {record_id: row for row, record_id in enumerate(self.ids)}
+        self.count = len(self.ids) if count is None else count
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+
+    def row(self, record_id: str) -> Optional[int]:
+        row = self.id_to_row.get(record_id)
+        return row if row is not None and row < self.count else None
+
+
+class VectorIndex:
+    """内存映射的NumPy向量索引
+
+    目录结构：
+        vectors.npy     归一化向量矩阵（float32 或 float16），以 mmap 方式只读加载，多个worker进程共享页缓存
+        records.jsonl   每行 [记录ID, metadata]，行顺序与向量行一致
+        codes-int8.npy / scales-int8.npy / codes-binary.npy
+                        开启量化时由向量矩阵派生的量化编码，常驻内存
+    旧版目录中的 ids.npy / metadatas.json 仍可读取，第一次写入时整体改写为上述布局。
+
+    写入是追加式的：新记录的向量追加到 vectors.npy 末尾，records.jsonl 只追加新行，
+    最后改写 .npy 头部中的行数作为提交点，建库时每批写入只处理这一批记录，总开销与记录数成线性关系。
+    删除或覆盖已有记录（同步时变更的记录会先删除再追加，只有运行时重复添加同一ID才会覆盖）时，
+    写临时文件后原子替换，整体重写索引目录：旧状态仍映射原来的文件，不会读到新旧混合的行。
+    内存中的索引状态保存在单个 _IndexState 对象中：写入（串行，持有写锁）构造新状态后一次性替换引用，
+    查询无需加锁，始终使用调用开始时的那个状态。
+    开启量化后，全库检索先在量化编码上求前 rerank_candidates 个候选，再只读取这些行的原始向量精确重排，
+    原始向量矩阵只有候选行会被换入内存。
+    """
+
+    VECTORS_FILE = 'vectors.npy'
+    RECORDS_FILE = 'records.jsonl'
+    # 旧版布局
+    IDS_FILE = 'ids.npy'
+    METADATA_FILE = 'metadatas.json'
+
+    # float16 矩阵按块转换为 float32 计算，避免一次性复制整个矩阵
+    SCAN_CHUNK_ROWS = 8192
+
+    def __init__(self, index_dir: str, dtype: str = 'float32', quantization: str = QUANTIZATION_NONE,
+                 rerank_candidates: int = 200):
+        """
+        Args:
+            index_dir: 索引目录
+            dtype: 向量存储精度，"float32" 或 "float16"
+            quantization: 首轮检索的量化方式，"none"、"int8" 或 "binary"
+            rerank_candidates: 量化检索后用原始向量精确重排的候选数
+        """
+        if dtype not in ('float32', 'float16'):
+            raise ValueError(f"不支持的向量存储类型: {dtype}")
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"不支持的量化方式: {quantization}")
+
+        self.index_dir = index_dir
+        self.dtype = np.dtype(dtype)
+        self.quantization = quantization
+        self.rerank_candidates = rerank_candidates
+        self._state = _IndexState()
+        # 写入（add/delete/reset/attach/load）串行执行；查询不加锁
+        self._write_lock = threading.RLock()
+        # 以下只在持有写锁时访问：records.jsonl 中已提交内容的长度、索引目录是否可以直接追加、量化编码的内存缓冲区
+        self._records_end = 0
+        self._appendable = True
+        self._code_buffer: Optional[np.ndarray] = None
+        self._scale_buffer: Optional[np.ndarray] = None
+        os.makedirs(index_dir, exist_ok=True)
+        self.load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def load(self):
+        """从磁盘加载索引（向量矩阵以只读 mmap 方式映射）"""
+        with self._write_lock:
+            self._state = self._read_state()
+
+    def _read_state(self) -> _IndexState:
+        self._records_end = 0
+        self._appendable = True
+        self._code_buffer = self._scale_buffer = None
+        if not os.path.exists(self._path(self.VECTORS_FILE)):
+            return _IndexState()
+
+        vectors = np.load(self._path(self.VECTORS_FILE), mmap_mode='r')
+        records_path = self._path(self.RECORDS_FILE)
+        if os.path.exists(records_path):
+            ids, metadatas, id_to_row = [], [], {}
+            with open(records_path, 'rb') as f:
+                for line in f:
+                    # 写到一半的行，或向量尚未提交的新记录：之后的内容都未提交
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record_id, metadata = json.loads(line)
+                    except ValueError:
+                        break
+                    row = id_to_row.get(record_id)
+                    if row is not None:
+                        metadatas[row] = metadata
+                    elif len(ids) < len(vectors):
+                        id_to_row[record_id] = len(ids)
+                        ids.append(record_id)
+                        metadatas.append(metadata)
+                    else:
+                        break
+                    self._records_end += len(line)
+        else:
+            ids = np.load(self._path(self.IDS_FILE), allow_pickle=False).tolist()
+            metadata_path = self._path(self.METADATA_FILE)
+            if os.path.exists(metadata_path):
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    metadatas = json.load(f)
+            else:
+                metadatas = [{} for _ in range(len(ids))]
+            id_to_row = None
+            self._appendable = False
+        if len(ids) != len(vectors):
+            # 记录与向量行数不一致（中断的写入）：只使用对齐的部分，下次写入时整体重写
+            vectors = vectors[:len(ids)]
+            self._appendable = False
+        return self._with_codes(_IndexState(vectors, ids, metadatas, id_to_row))
+
+    def attach(self, ids: Sequence[str], vectors: np.ndarray, metadatas: List[Dict]):
+        """直接使用外部的向量矩阵（如索引制品中内存映射的矩阵），不写入索引目录
+
+        之后的写入（add/delete）会把完整索引写入索引目录，不修改外部矩阵。
+        """
+        with self._write_lock:
+            self._code_buffer = self._scale_buffer = None
+            self._state = self._with_codes(_IndexState(vectors, list(ids), list(metadatas)))
+            self._appendable = False
+
+    def _codes_file(self) -> str:
+        return f'codes-{self.quantization}.npy'
+
+    def _scales_file(self) -> str:
+        return f'scales-{self.quantization}.npy'
+
+    def _with_codes(self, state: _IndexState) -> _IndexState:
+        """为新状态加载量化编码；编码文件缺失或与向量矩阵行数不一致（如建库后才开启量化）时重新生成"""
+        if self.quantization == QUANTIZATION_NONE or state.vectors is None:
+            return state
+
+        codes_path = self._path(self._codes_file())
+        scales_path = self._path(self._scales_file())
+        codes = np.load(codes_path) if os.path.exists(codes_path) else None
+        scales = np.load(scales_path) if self.quantization == QUANTIZATION_INT8 and os.path.exists(scales_path) else None
+        if codes is None or len(codes) != state.count or \
+                (self.quantization == QUANTIZATION_INT8 and (scales is None or len(scales) != state.count)):
+            codes, scales = self._write_codes(state.vectors)
+        self._code_buffer, self._scale_buffer = codes, scales
+        state.codes, state.scales = codes, scales
+        return state
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if self.quantization == QUANTIZATION_INT8:
+            return quantize_int8(vectors)
+        return quantize_binary(vectors), None
+
+    def _write_codes(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """由向量矩阵分块生成量化编码并原子写入"""
+        if self.quantization == QUANTIZATION_INT8:
+            codes = np.empty(vectors.shape, dtype=np.int8)
+            scales = np.empty(len(vectors), dtype=np.float32)
+        else:
+            codes = np.empty((len(vectors), (vectors.shape[1] + 7) // 8), dtype=np.uint8)
+            scales = None
+        for start in range(0, len(vectors), self.SCAN_CHUNK_ROWS):
+            end = start + self.SCAN_CHUNK_ROWS
+            chunk_codes, chunk_scales = self._quantize(np.asarray(vectors[start:end], dtype=np.float32))
+            codes[start:end] = chunk_codes
+            if scales is not None:
+                scales[start:end] = chunk_scales
+
+        if scales is not None:
+            _save_npy(self._path(self._scales_file()), scales, scales.dtype)
+        _save_npy(self._path(self._codes_file()), codes, codes.dtype)
+        return codes, scales
+
+    def memory_usage(self) -> Dict[str, int]:
+        """首轮扫描矩阵的字节数：原始向量矩阵与量化编码"""
+        state = self._state
+        usage = {'vectors': int(state.vectors.nbytes) if state.vectors is not None else 0}
+        if state.codes is not None:
+            usage['codes'] = int(state.codes.nbytes) + (int(state.scales.nbytes) if state.scales is not None else 0)
+        return usage
+
+    def count(self) -> int:
+        return self._state.count
+
+    def add(self, ids: Sequence[str], embeddings: np.ndarray,
+            documents: Optional[Sequence[str]] = None, metadatas: Optional[Sequence[Dict]] = None):
+        """添加或覆盖向量（同ID覆盖）：只有新记录时追加到索引文件末尾，不重写整个索引；
+        覆盖已有记录时整体重写索引目录（写时复制，正在进行的查询仍使用旧状态）"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in ids]
+
+        with self._write_lock:
+            state = self._state
+            if not self._appendable:
+                state = self._rewrite(state.ids[:state.count], state.vectors, state.metadatas[:state.count])
+            # 同一批中重复的ID以最后一次为准
+            new_positions: Dict[str, int] = {}
+            updates: Dict[int, int] = {}
+            for position, record_id in enumerate(ids):
+                row = state.row(record_id)
+                if row is None:
+                    new_positions.pop(record_id, None)
+                    new_positions[record_id] = position
+                else:
+                    updates[row] = position
+            if not new_positions and not updates:
+                return
+
+            new_ids = list(new_positions)
+            new_vectors = embeddings[list(new_positions.values())]
+            new_metadatas = [metadatas[position] for position in new_positions.values()]
+            if updates:
+                # 覆盖已有记录：复制向量矩阵和 metadata 列表后修改，整体重写到新文件
+                update_rows = np.array(sorted(updates), dtype=np.int64)
+                vectors = np.array(state.vectors[:state.count], dtype=np.float32)
+                vectors[update_rows] = embeddings[[updates[row] for row in update_rows]]
+                all_metadatas = state.metadatas[:state.count]
+                for row in update_rows:
+                    all_metadatas[row] = metadatas[updates[row]]
+                self._state = self._rewrite(state.ids[:state.count] + new_ids,
+                                            np.concatenate([vectors, new_vectors]), all_metadatas + new_metadatas)
+                return
+
+            appended = self._append(state, new_ids, new_vectors, new_metadatas)
+            if appended is None:
+                # 索引文件无法原位追加（如其他工具写出的 .npy）：整体重写一次后再追加
+                state = self._rewrite(state.ids[:state.count], state.vectors, state.metadatas[:state.count])
+                appended = self._append(state, new_ids, new_vectors, new_metadatas)
+                if appended is None:
+                    raise RuntimeError(f"向量索引目录无法追加写入: {self.index_dir}")
+            self._state = appended
+
+    def _append(self, state: _IndexState, new_ids: List[str], new_vectors: np.ndarray,
+                new_metadatas: List[Dict]) -> Optional[_IndexState]:
+        """把一批新记录追加到索引文件并构造新状态；索引文件不能原位追加时返回 None（不做任何修改）"""
+        count, new_count = state.count, state.count + len(new_ids)
+        vectors_path = self._path(self.VECTORS_FILE)
+
+        # (文件, 追加的行)：量化编码在前，向量文件最后提交
+        files = []
+        new_codes = new_scales = None
+        if self.quantization != QUANTIZATION_NONE:
+            new_codes, new_scales = self._quantize(new_vectors)
+            files.append((self._path(self._codes_file()), new_codes))
+            if new_scales is not None:
+                files.append((self._path(self._scales_file()), new_scales))
+        files.append((vectors_path, new_vectors.astype(self.dtype)))
+        if count == 0:
+            # 空索引：先创建只有头部的空文件
+            for path, rows in files:
+                if not os.path.exists(path):
+                    _save_npy(path, rows[:0], rows.dtype)
+        if not all(_can_append_npy(path, count, rows.dtype, rows.shape[1:], new_count) for path, rows in files):
+            return None
+
+        records_path = self._path(self.RECORDS_FILE)
+        with open(records_path, 'r+b' if os.path.exists(records_path) else 'wb') as f:
+            # 丢弃上次中断的写入留下的未提交内容
+            f.truncate(self._records_end)
+            f.seek(self._records_end)
+            for record_id, metadata in zip(new_ids, new_metadatas):
+                f.write(json.dumps([record_id, metadata], ensure_ascii=False).encode('utf-8') + b'\n')
+            self._records_end = f.tell()
+        for path, rows in files:
+            _append_npy(path, count, rows)
+
+        # 内存中的共享列表和缓冲区只追加，旧状态看不到前 count 行之后的内容
+        for record_id, metadata in zip(new_ids, new_metadatas):
+            state.id_to_row[record_id] = len(state.ids)
+            state.ids.append(record_id)
+            state.metadatas.append(metadata)
+        appended = _IndexState(np.load(vectors_path, mmap_mode='r'), state.ids, state.metadatas, state.id_to_row, new_count)
+        if new_codes is not None:
+            self._code_buffer = _grow(self._code_buffer, count, new_codes)
+            appended.codes = self._code_buffer[:new_count]
+            if new_scales is not None:
+                self._scale_buffer = _grow(self._scale_buffer, count, new_scales)
+                appended.scales = self._scale_buffer[:new_count]
+        return appended
+
+    def delete(self, ids: Sequence[str]):
+        """按ID删除记录，并原子地重写索引文件"""
+        with self._write_lock:
+            state = self._state
+            rows = {row for row in (state.row(record_id) for record_id in ids) if row is not None}
+            if not rows:
+                return
+            keep = np.array([row for row in range(state.count) if row not in rows], dtype=np.int64)
+            self._state = self._rewrite([state.ids[row] for row in keep], np.asarray(state.vectors[keep]),
+                                        [state.metadatas[row] for row in keep])
+
+    def reset(self):
+        """删除索引文件（包括各量化方式的编码和旧版布局），清空索引"""
+        with self._write_lock:
+            names = [self.VECTORS_FILE, self.RECORDS_FILE, self.IDS_FILE, self.METADATA_FILE]
+            for mode in (QUANTIZATION_INT8, QUANTIZATION_BINARY):
+                names += [f'codes-{mode}.npy', f'scales-{mode}.npy']
+            for name in names:
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            self._records_end = 0
+            self._appendable = True
+            self._code_buffer = self._scale_buffer = None
+            self._state = _IndexState()
+
+    def _rewrite(self, ids: List[str], vectors: Optional[np.ndarray], metadatas: List[Dict]) -> _IndexState:
+        """整体重写索引目录（删除记录、首次写入挂载的矩阵、旧版布局或中断后的目录），写临时文件后原子替换
+
+        返回新状态（不替换当前状态，由调用方决定何时发布）。
+        """
+        with open(self._path(self.RECORDS_FILE + '.tmp'), 'wb') as f:
+            for record_id, metadata in zip(ids, metadatas):
+                f.write(json.dumps([record_id, metadata], ensure_ascii=False).encode('utf-8') + b'\n')
+        if vectors is not None:
+            _save_npy(self._path(self.VECTORS_FILE + '.tmp'), vectors, self.dtype)
+            if self.quantization != QUANTIZATION_NONE:
+                self._write_codes(vectors)
+
+        # 向量文件最后替换：load() 以向量文件存在作为索引可用的标志
+        os.replace(self._path(self.RECORDS_FILE + '.tmp'), self._path(self.RECORDS_FILE))
+        for name in (self.IDS_FILE, self.METADATA_FILE):
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        if vectors is not None:
+            os.replace(self._path(self.VECTORS_FILE + '.tmp'), self._path(self.VECTORS_FILE))
+        elif os.path.exists(self._path(self.VECTORS_FILE)):
+            os.remove(self._path(self.VECTORS_FILE))
+        return self._read_state()
+
+    def get(self, ids: Sequence[str]) -> Dict[str, Tuple[np.ndarray, Dict]]:
+        """按ID取回向量和metadata"""
+        state = self._state
+        found = {}
+        for record_id in ids:
+            row = state.row(record_id)
+            if row is not None:
+                found[record_id] = (np.asarray(state.vectors[row], dtype=np.float32), state.metadatas[row])
+        return found
+
+    def similarities(self, query_embeddings: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """计算查询向量与全部向量（或指定行）的内积（余弦相似度），形状为 (查询数, 记录数)"""
+        return self._similarities(self._state, query_embeddings, rows)
+
+    def _similarities(self, state: _IndexState, query_embeddings: np.ndarray,
+                      rows: Optional[np.ndarray] = None) -> np.ndarray:
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if state.vectors is None or state.count == 0:
+            return np.zeros((len(queries), 0), dtype=np.float32)
+
+        if rows is not None:
+            return queries @ np.asarray(state.vectors[rows], dtype=np.float32).T
+
+        if state.vectors.dtype == np.float32:
+            return queries @ state.vectors.T
+
+        scores = np.empty((len(queries), state.count), dtype=np.float32)
+        for start in range(0, state.count, self.SCAN_CHUNK_ROWS):
+            end = start + self.SCAN_CHUNK_ROWS
+            scores[:, start:end] = queries @ state.vectors[start:end].astype(np.float32).T
+        return scores
+
+    def approximate_similarities(self, query_embeddings: np.ndarray) -> np.ndarray:
+        """在量化编码上计算近似相似度（二值编码为负汉明距离），形状为 (查询数, 记录数)"""
+        return self._approximate_similarities(self._state, query_embeddings)
+
+    def _approximate_similarities(self, state: _IndexState, query_embeddings: np.ndarray) -> np.ndarray:
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        scores = np.empty((len(queries), state.count), dtype=np.float32)
+        if state.scales is not None:
+            for start in range(0, state.count, self.SCAN_CHUNK_ROWS):
+                end = start + self.SCAN_CHUNK_ROWS
+                scores[:, start:end] = (queries @ state.codes[start:end].astype(np.float32).T) * state.scales[start:end]
+        else:
+            for i, query_bits in enumerate(quantize_binary(queries)):
+                for start in range(0, state.count, self.SCAN_CHUNK_ROWS):
+                    end = start + self.SCAN_CHUNK_ROWS
+                    distances = _POPCOUNT[np.bitwise_xor(state.codes[start:end], query_bits)].sum(axis=1, dtype=np.int32)
+                    scores[i, start:end] = -distances
+        return scores
+
+    @staticmethod
+    def _top_hits(state: _IndexState, row_scores: np.ndarray, rows: Optional[np.ndarray],
+                  top_k: int) -> List[Tuple[str, float, Dict]]:
+        """按相似度取前 top_k 个位置；rows 为各位置对应的索引行（None 表示位置即行号）"""
+        count = len(row_scores)
+        k = min(top_k, count)
+        if k == 0:
+            return []
+        if k < count:
+            top_positions = np.argpartition(-row_scores, k - 1)[:k]
+        else:
+            top_positions = np.arange(count)
+        top_positions = top_positions[np.argsort(-row_scores[top_positions], kind='stable')]
+        index_rows = rows[top_positions] if rows is not None else top_positions
+        return [
+            (str(state.ids[row]), float(2.0 - 2.0 * row_scores[position]), state.metadatas[row])
+            for position, row in zip(top_positions, index_rows)
+        ]
+
+    def query(self, query_embeddings: np.ndarray, top_k: int,
+              candidate_ids: Optional[Sequence[str]] = None) -> QueryHits:
+        """批量 top-k 查询；candidate_ids 非空时只在这些记录中检索
+
+        开启量化且记录数多于重排候选数时，全库检索走“量化粗排 + 原始向量精确重排”，返回的距离仍为精确值。
+        整个查询只使用调用开始时的索引状态，与并发的写入互不影响。
+        """
+        state = self._state
+        if candidate_ids is not None:
+            rows = np.array(sorted({row for row in (state.row(record_id) for record_id in candidate_ids)
+                                    if row is not None}), dtype=np.int64)
+            return [self._top_hits(state, row_scores, rows, top_k)
+                    for row_scores in self._similarities(state, query_embeddings, rows)]
+
+        candidate_count = max(self.rerank_candidates, top_k)
+        if state.codes is None or state.count <= candidate_count:
+            return [self._top_hits(state, row_scores, None, top_k)
+                    for row_scores in self._similarities(state, query_embeddings)]
+
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        hits = []
+        for query, approximate in zip(queries, self._approximate_similarities(state, queries)):
+            # 候选行按行号排序后再读取原始向量，mmap 顺序访问
+            rows = np.sort(np.argpartition(-approximate, candidate_count - 1)[:candidate_count])
+            exact = np.asarray(state.vectors[rows], dtype=np.float32) @ query
+            hits.append(self._top_hits(state, exact, rows, top_k))
+        return hits
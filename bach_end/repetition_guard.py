@@ -0,0 +1,179 @@
+"""
+生成重复检测
+诊断模型（mine）偶尔陷入段落或短语的循环，一直生成到 max_tokens 才停止。RepetitionGuard 在流式生成过程中
+逐段检查已生成的文本，一旦发现段落或长片段在紧邻地反复出现就判定为循环：调用方立即关闭上游流（上游随之停止生成），
+并使用去重后的前缀作为结果。截断后的结果不完整，不写入补全缓存。
+"""
+
+import os
+import threading
+from bisect import bisect_right
+
+from logger_config import log_info
+
+# 是否对诊断生成启用重复检测（启用后非流式调用也改为流式请求，以便检测到循环时提前中止）；
+# 只用于诊断建议，病例报告常套用相同的行模板，调用时关闭（chat_with_diagnosis_api(repetition_guard=False)）
+DIAGNOSIS_REPETITION_GUARD = os.environ.get('DIAGNOSIS_REPETITION_GUARD', '1') == '1'
+# n-gram 长度（字符）：同一 n-gram 连续、等间距地出现 max_ngram_repeats 次且间隔中的文本完全相同，即判定为循环
+REPETITION_NGRAM_SIZE = int(os.environ.get('REPETITION_NGRAM_SIZE', '20'))
+REPETITION_MAX_NGRAM_REPEATS = int(os.environ.get('REPETITION_MAX_NGRAM_REPEATS', '3'))
+# 参与段落重复判断的最短段落长度（字符），更短的行（如小标题）不计
+REPETITION_MIN_PARAGRAPH_CHARS = int(os.environ.get('REPETITION_MIN_PARAGRAPH_CHARS', '10'))
+# 同一行（不要求相邻）出现多少次判定为循环；正常报告中同一条建议出现在两三个诊断下很常见
+REPETITION_MAX_PARAGRAPH_REPEATS = int(os.environ.get('REPETITION_MAX_PARAGRAPH_REPEATS', '4'))
+# 检查紧邻重复的段落块时，块的最大行数
+REPETITION_MAX_BLOCK_LINES = int(os.environ.get('REPETITION_MAX_BLOCK_LINES', '8'))
+
+
+class RepetitionGuard:
+    """流式生成的重复检测器
+
+    用法：每收到一段增量文本调用 feed()，返回 False 时停止读取上游流，text 为去重后的前缀。
+    只在出现真正的循环时判定，正常报告中分散出现的相同行（如多个诊断下相同的护理建议）不受影响：
+    1. 段落块紧邻重复：最近的 k 行（1 ≤ k ≤ max_block_lines，合计不短于 min_paragraph_chars）与紧挨着的前 k 行
+       完全相同，截断到第二遍之前；
+    2. 同一行累计出现 max_paragraph_repeats 次（覆盖夹杂少量变化的循环），截断到最后一次出现之前；
+    3. n-gram 循环：同一个长度为 ngram_size 的片段等间距出现 max_ngram_repeats 次，且相邻两次之间的文本完全相同
+       （覆盖没有换行、周期短于一行的循环），截断到第二遍之前，只保留第一遍内容。
+    只含空白和标点的行与片段（如分隔线）不参与判定。
+    流式接口每个增量通常对应一个token，token数按增量个数估算。
+    """
+
+    def __init__(self, max_tokens: int = None, ngram_size: int = None, max_ngram_repeats: int = None,
+                 min_paragraph_chars: int = None, max_paragraph_repeats: int = None, max_block_lines: int = None):
+        """
+        Args:
+            max_tokens: 请求的 max_tokens，用于估算提前中止节省的token数
+            ngram_size: n-gram 长度（字符）
+            max_ngram_repeats: 判定为循环的 n-gram 连续出现次数
+            min_paragraph_chars: 参与段落重复判断的最短段落（块）长度
+            max_paragraph_repeats: 判定为循环的同一行出现次数
+            max_block_lines: 紧邻重复判断中段落块的最大行数
+        """
+        self.max_tokens = max_tokens
+        self.ngram_size = ngram_size or REPETITION_NGRAM_SIZE
+        self.max_ngram_repeats = max(max_ngram_repeats or REPETITION_MAX_NGRAM_REPEATS, 2)
+        self.min_paragraph_chars = min_paragraph_chars or REPETITION_MIN_PARAGRAPH_CHARS
+        self.max_paragraph_repeats = max(max_paragraph_repeats or REPETITION_MAX_PARAGRAPH_REPEATS, 2)
+        self.max_block_lines = max_block_lines or REPETITION_MAX_BLOCK_LINES
+        self.tokens = 0
+        self.tripped = False
+        self.reason = None
+        self._text = ''
+        self._cut = None
+        # 每个增量结束时的文本长度，用于计算截断位置之前保留了多少token
+        self._boundaries = []
+        self._ngrams = {}
+        self._ngram_scanned = 0
+        # 已完成的非空行 (内容, 起始位置) 及各行出现次数
+        self._lines = []
+        self._line_counts = {}
+        self._line_start = 0
+
+    def feed(self, chunk: str) -> bool:
+        """加入一段增量文本，检测到循环时返回 False（之后的增量不再处理）"""
+        if self.tripped:
+            return False
+        self.tokens += 1
+        self._text += chunk
+        self._boundaries.append(len(self._text))
+        if self._check_paragraphs() or self._check_ngrams():
+            self.tripped = True
+            _record_abort(self)
+            return False
+        return True
+
+    def _check_paragraphs(self) -> bool:
+        text = self._text
+        newline = text.find('\n', self._line_start)
+        while newline != -1:
+            line, start = text[self._line_start:newline].strip(), self._line_start
+            self._line_start = newline + 1
+            newline = text.find('\n', self._line_start)
+            if not any(ch.isalnum() for ch in line):
+                continue
+            self._lines.append((line, start))
+            if self._check_repeated_block():
+                return True
+            if len(line) >= self.min_paragraph_chars:
+                count = self._line_counts[line] = self._line_counts.get(line, 0) + 1
+                if count >= self.max_paragraph_repeats:
+                    self._trip(start, 'paragraph')
+                    return True
+        return False
+
+    def _check_repeated_block(self) -> bool:
+        """最近的 k 行与紧挨着的前 k 行相同时判定为循环"""
+        lines = self._lines
+        for size in range(1, min(self.max_block_lines, len(lines) // 2) + 1):
+            block = [line for line, _ in lines[-size:]]
+            if sum(len(line) for line in block) < self.min_paragraph_chars:
+                continue
+            if block == [line for line, _ in lines[-2 * size:-size]]:
+                self._trip(lines[-size][1], 'paragraph')
+                return True
+        return False
+
+    def _check_ngrams(self) -> bool:
+        text, n, repeats = self._text, self.ngram_size, self.max_ngram_repeats
+        for start in range(self._ngram_scanned, len(text) - n + 1):
+            ngram = text[start:start + n]
+            self._ngram_scanned = start + 1
+            if sum(ch.isalnum() for ch in ngram) * 2 < n:
+                continue
+            positions = self._ngrams.setdefault(ngram, [])
+            positions.append(start)
+            if len(positions) < repeats:
+                continue
+            # 最近几次出现等间距，且每个间隔内的文本相同：同一段文本在紧邻地重复
+            recent = positions[-repeats:]
+            period = recent[1] - recent[0]
+            if all(b - a == period for a, b in zip(recent, recent[1:])) and \
+                    all(text[a:b] == text[recent[0]:recent[1]] for a, b in zip(recent[1:], recent[2:])):
+                self._trip(recent[1], 'ngram')
+                return True
+        return False
+
+    def _trip(self, cut: int, reason: str):
+        self._cut = cut
+        self.reason = reason
+
+    @property
+    def text(self) -> str:
+        """已生成的文本；检测到循环时为去重后的前缀"""
+        if self._cut is None:
+            return self._text
+        return self._text[:self._cut].rstrip()
+
+    @property
+    def tokens_trimmed(self) -> int:
+        """已生成但因重复被丢弃的token数"""
+        if self._cut is None:
+            return 0
+        return self.tokens - bisect_right(self._boundaries, self._cut)
+
+    @property
+    def tokens_saved(self) -> int:
+        """提前中止而未生成的token数（循环不会自行结束，否则会一直生成到 max_tokens）"""
+        if not self.tripped or not self.max_tokens:
+            return 0
+        return max(self.max_tokens - self.tokens, 0)
+
+
+_stats = {'aborted': 0, 'tokens_saved': 0, 'tokens_trimmed': 0}
+_stats_lock = threading.Lock()
+
+
+def _record_abort(guard: RepetitionGuard):
+    with _stats_lock:
+        _stats['aborted'] += 1
+        _stats['tokens_saved'] += guard.tokens_saved
+        _stats['tokens_trimmed'] += guard.tokens_trimmed
+    log_info(f"检测到重复生成（{guard.reason}），提前中止：已生成 {guard.tokens} 个token，"
+             f"丢弃 {guard.tokens_trimmed} 个，节省约 {guard.tokens_saved} 个")
+
+
+def repetition_stats() -> dict:
+    """进程内累计的提前中止次数、节省和丢弃的token数"""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+测试预构建索引制品：导出/读取往返、哈希校验、向量矩阵内存映射与 NumPy 索引直接挂载
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.artifact import KnowledgeArtifact, corpus_hash, write_artifact
+from rag.docstore import KnowledgeDocStore
+from rag.vector_index import VectorIndex
+
+IDS = ['a', 'b', 'c']
+METADATAS = [
+    {'category': '呼吸系统疾病', 'disease': '肺炎', 'symptoms': '咳嗽, 发热', 'description': '肺部感染'},
+    {'category': '呼吸系统疾病', 'disease': '支气管炎', 'symptoms': '咳嗽, 咳痰', 'description': '支气管炎症'},
+    {'category': '消化系统疾病', 'disease': '胃炎', 'symptoms': '腹痛, 恶心', 'description': '胃黏膜炎症'},
+]
+MANIFEST = {'version': 1, 'model_id': 'test-model', 'records': {'a': 'h1', 'b': 'h2', 'c': 'h3'}, 'runtime': {}}
+
+
+def _vectors() -> np.ndarray:
+    vectors = np.random.default_rng(0).normal(size=(len(IDS), 16)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _write(path: str) -> np.ndarray:
+    docstore = KnowledgeDocStore()
+    docstore.add(IDS, METADATAS)
+    vectors = _vectors()
+    write_artifact(path, 'test-model', IDS, vectors,
+                   [{'record_id': record_id, 'category': m['category']} for record_id, m in zip(IDS, METADATAS)],
+                   docstore, MANIFEST, source_sha256='abc')
+    return vectors
+
+
+def test_roundtrip():
+    """测试头部、各数据段与内存映射的向量矩阵"""
+    print("🧪 测试制品导出与读取...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'index.ragidx')
+        vectors = _write(path)
+        artifact = KnowledgeArtifact(path)
+        artifact.verify()
+
+        assert artifact.model_id == 'test-model' and len(artifact) == 3 and artifact.source_sha256 == 'abc'
+        assert artifact.corpus_hash == corpus_hash(MANIFEST['records'])
+        assert artifact.ids() == IDS
+        assert artifact.metadatas()[2] == {'record_id': 'c', 'category': '消化系统疾病'}
+        assert artifact.manifest_data() == MANIFEST
+        assert artifact.docstore().get_metadata('b')['disease'] == '支气管炎'
+
+        mapped = artifact.vectors()
+        assert isinstance(mapped, np.memmap) and mapped.shape == (3, 16)
+        assert np.array_equal(np.asarray(mapped), vectors)
+        del mapped
+    print("✅ 制品导出与读取测试通过")
+
+
+def test_verify_detects_corruption():
+    """测试数据段损坏和非制品文件被拒绝"""
+    print("🧪 测试哈希校验...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'index.ragidx')
+        _write(path)
+        artifact = KnowledgeArtifact(path)
+        with open(path, 'r+b') as f:
+            f.seek(artifact.data_start + artifact.header['sections']['vectors']['offset'] + 5)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        try:
+            artifact.verify()
+            raise AssertionError("损坏的制品未被发现")
+        except ValueError as e:
+            assert 'vectors' in str(e)
+
+        other = os.path.join(tmp, 'other.bin')
+        with open(other, 'wb') as f:
+            f.write(b'not an artifact')
+        try:
+            KnowledgeArtifact(other)
+            raise AssertionError("非制品文件未被拒绝")
+        except ValueError:
+            pass
+    print("✅ 哈希校验测试通过")
+
+
+def test_attach_to_vector_index():
+    """测试 NumPy 索引直接挂载制品中的向量矩阵，之后的写入落盘到索引目录"""
+    print("🧪 测试向量索引挂载制品...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'index.ragidx')
+        vectors = _write(path)
+        artifact = KnowledgeArtifact(path)
+        index = VectorIndex(os.path.join(tmp, 'vector_index'))
+        index.attach(artifact.ids(), artifact.vectors(), artifact.metadatas())
+        assert index.count() == 3
+
+        hits = index.query(vectors[1], top_k=1)[0]
+        assert hits[0][0] == 'b' and abs(hits[0][1]) < 1e-5
+        # 挂载不写索引目录；写入新记录后完整索引落盘，制品文件不变
+        assert not os.path.exists(os.path.join(tmp, 'vector_index', VectorIndex.VECTORS_FILE))
+        index.add(['d'], -vectors[:1], metadatas=[{'record_id': 'd', 'category': '呼吸系统疾病'}])
+        reopened = VectorIndex(os.path.join(tmp, 'vector_index'))
+        assert reopened.count() == 4 and reopened.query(-vectors[0], top_k=1)[0][0][0] == 'd'
+        artifact.verify()
+        del index, hits
+    print("✅ 向量索引挂载制品测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 预构建索引制品测试")
+    print("=" * 60)
+
+    test_roundtrip()
+    test_verify_detects_corruption()
+    test_attach_to_vector_index()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
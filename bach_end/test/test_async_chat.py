@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+测试异步医疗AI工作流程：完整两步流程、每个上游的并发上限、同步代码经事件循环线程调用
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import completion_cache
+from async_chat import AsyncSymptomExtractor, AsyncUpstreamClient, EventLoopThread
+from chat import SymptomExtractor
+from upstream_stub import NoRAGService, StubUpstreamHandler, start_upstream
+
+# 测试对象是对本地上游的实际调用：不使用补全缓存，也不读写 bach_end/cache 下的共享缓存文件。
+# 缓存开关在 get_completion_cache() 调用时读取，即使 completion_cache 已被其他测试先导入也生效
+completion_cache.COMPLETION_CACHE_ENABLED = False
+
+UPSTREAM_DELAY = 0.3
+
+
+class UpstreamHandler(StubUpstreamHandler):
+    """本地模拟的图床、症状提取和诊断服务，记录同时处理的请求数峰值"""
+
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def do_POST(self):
+        with UpstreamHandler.lock:
+            UpstreamHandler.active += 1
+            UpstreamHandler.peak = max(UpstreamHandler.peak, UpstreamHandler.active)
+        self.read_body()
+        time.sleep(UPSTREAM_DELAY)
+        if self.path == '/upload':
+            result = {'success': True, 'data': {'url': 'http://images.local/a.png'}}
+        elif self.path == '/symptoms':
+            result = {'choices': [{'message': {'content': '肺部阴影，咳嗽'}}]}
+        else:
+            result = {'choices': [{'message': {'content': '【可能诊断】：肺炎'}}]}
+        with UpstreamHandler.lock:
+            UpstreamHandler.active -= 1
+        self.send_json(200, result)
+
+
+def _start_upstream():
+    server, _ = start_upstream(UpstreamHandler)
+    UpstreamHandler.active = UpstreamHandler.peak = 0
+    return server
+
+
+def test_pipeline_and_concurrency_limit():
+    """测试完整流程输出与同步版本一致，且并发请求数不超过每个上游的信号量"""
+    print("🧪 测试异步工作流程与并发上限...")
+    server = _start_upstream()
+    try:
+        extractor = SymptomExtractor(rag_service=NoRAGService())
+        expected = extractor.chat_top('分析影像', b'image')
+
+        async def run(count):
+            pipeline = AsyncSymptomExtractor(extractor, AsyncUpstreamClient(concurrency=8))
+            try:
+                return await asyncio.gather(*(pipeline.chat_top('分析影像', b'image') for _ in range(count)))
+            finally:
+                await pipeline.close()
+
+        UpstreamHandler.peak = 0
+        start = time.time()
+        replies = asyncio.run(run(40))
+        elapsed = time.time() - start
+        assert replies == [expected] * 40
+        assert UpstreamHandler.peak <= 8, UpstreamHandler.peak
+        # 40 个请求 × 3 次上游调用，每个上游最多 8 个并发：远快于串行的 40 × 3 × 0.3s
+        assert elapsed < 40 * 3 * UPSTREAM_DELAY / 4, elapsed
+    finally:
+        server.shutdown()
+    print(f"✅ 异步工作流程与并发上限测试通过（40 个请求 {elapsed:.1f}s）")
+
+
+def test_event_loop_thread_from_sync_code():
+    """测试多个同步线程共享同一个事件循环线程执行工作流程"""
+    print("🧪 测试事件循环线程...")
+    server = _start_upstream()
+    loop_thread = EventLoopThread(name='test-async-pipeline')
+    try:
+        extractor = SymptomExtractor(rag_service=NoRAGService())
+        pipeline = AsyncSymptomExtractor(extractor, AsyncUpstreamClient())
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            replies = list(pool.map(lambda _: loop_thread.run(pipeline.chat_top('分析影像', b'image'), timeout=30),
+                                    range(10)))
+        assert all('【可能诊断】：肺炎' in reply for reply in replies)
+
+        try:
+            loop_thread.run(asyncio.sleep(5), timeout=0.2)
+            raise AssertionError("未触发超时")
+        except FutureTimeoutError:
+            pass
+        loop_thread.run(pipeline.close(), timeout=5)
+    finally:
+        loop_thread.stop()
+        server.shutdown()
+    print("✅ 事件循环线程测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 异步医疗AI工作流程测试")
+    print("=" * 60)
+
+    test_pipeline_and_concurrency_limit()
+    test_event_loop_thread_from_sync_code()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
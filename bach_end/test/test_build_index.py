@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+测试离线建库：只构建向量索引（不构建症状倒排索引、不加载交叉编码器），全量重建时不装载预构建的索引制品
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag import build_index as build_index_module
+from rag import medical_rag
+from rag.build_index import build_index
+
+RECORDS = [
+    {'id': 'pneumonia_001', 'category': '呼吸系统疾病', 'disease': '肺炎', 'symptoms': ['咳嗽', '发热'],
+     'imaging_findings': ['肺部阴影'], 'diagnosis_criteria': '胸片', 'treatment': '抗感染', 'content': '肺部感染'},
+    {'id': 'gastritis_001', 'category': '消化系统疾病', 'disease': '胃炎', 'symptoms': ['腹痛', '恶心'],
+     'imaging_findings': [], 'diagnosis_criteria': '胃镜', 'treatment': '抑酸', 'content': '胃黏膜炎症'},
+]
+
+
+class HashEmbedder:
+    """按文本哈希生成确定性单位向量的编码器替身，记录编码过的文本数"""
+
+    model_id = 'hash-embedder'
+    dimension = 16
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, texts, batch_size=None, use_cache=False):
+        texts = list(texts)
+        self.encoded += len(texts)
+        vectors = np.stack([np.random.default_rng(int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16))
+                            .normal(size=self.dimension) for text in texts]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def __call__(self, input):
+        return self.encode(input).tolist()
+
+
+def _setup(tmp):
+    data_path = os.path.join(tmp, 'knowledge.jsonl')
+    with open(data_path, 'w', encoding='utf-8') as f:
+        for record in RECORDS:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    embedder = HashEmbedder()
+    build_index_module.create_embedder = lambda *args, **kwargs: embedder
+    return data_path, embedder
+
+
+class ForbiddenReranker:
+    def __init__(self, *args, **kwargs):
+        raise AssertionError("离线建库不应加载交叉编码器")
+
+
+def test_index_only():
+    """测试离线建库只写入向量索引，不构建症状倒排索引和BM25索引，不加载交叉编码器"""
+    print("🧪 测试离线建库...")
+    reranker_enabled, reranker_class = medical_rag.RERANKER_ENABLED, medical_rag.CrossEncoderReranker
+    medical_rag.RERANKER_ENABLED, medical_rag.CrossEncoderReranker = True, ForbiddenReranker
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_path, embedder = _setup(tmp)
+            db_path = os.path.join(tmp, 'db')
+            stats = build_index(db_path=db_path, data_path=data_path, vector_backend='numpy', sharded=False)
+            assert stats['records'] == len(RECORDS) and stats['indexed'] == len(RECORDS)
+
+            knowledge_base = medical_rag.MedicalKnowledgeBase(db_path=db_path, embedder=embedder, vector_backend='numpy',
+                                                              sharded=False, index_only=True)
+            assert knowledge_base.symptom_index is None and knowledge_base.lexical_index is None
+            assert knowledge_base.reranker is None
+            # 没有症状倒排索引时不做预过滤，检索仍可用
+            hits = knowledge_base.search_relevant_knowledge('咳嗽 发热', top_k=1, prefilter='union')
+            assert len(hits) == 1
+            knowledge_base.close()
+    finally:
+        medical_rag.RERANKER_ENABLED, medical_rag.CrossEncoderReranker = reranker_enabled, reranker_class
+    print("✅ 离线建库测试通过")
+
+
+def test_rebuild_ignores_artifact():
+    """测试 --rebuild 按知识数据重新编码，而不是装载磁盘上的索引制品"""
+    print("🧪 测试全量重建不装载制品...")
+    artifact_path = medical_rag.INDEX_ARTIFACT_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_path, embedder = _setup(tmp)
+            db_path = os.path.join(tmp, 'db')
+            build_index(db_path=db_path, data_path=data_path, vector_backend='numpy', sharded=False)
+
+            # 从当前知识库导出制品，再把向量存储清空（模拟需要重建的知识库）
+            medical_rag.INDEX_ARTIFACT_PATH = None
+            knowledge_base = medical_rag.MedicalKnowledgeBase(db_path=db_path, embedder=embedder, vector_backend='numpy',
+                                                              sharded=False, index_only=True)
+            medical_rag.INDEX_ARTIFACT_PATH = os.path.join(tmp, 'index.ragidx')
+            knowledge_base.export_artifact(medical_rag.INDEX_ARTIFACT_PATH)
+            knowledge_base.vector_store.reset()
+            knowledge_base.close()
+
+            embedder.encoded = 0
+            stats = build_index(db_path=db_path, data_path=data_path, vector_backend='numpy', sharded=False,
+                                rebuild=True)
+            assert stats['indexed'] == len(RECORDS) and embedder.encoded == len(RECORDS), stats
+    finally:
+        medical_rag.INDEX_ARTIFACT_PATH = artifact_path
+    print("✅ 全量重建不装载制品测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 离线建库测试")
+    print("=" * 60)
+
+    test_index_only()
+    test_rebuild_ignores_artifact()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+测试大模型补全缓存：缓存键、TTL与条目数淘汰、多进程共享文件、工作流程命中缓存后不再请求上游、按请求绕过缓存
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_chat import AsyncSymptomExtractor, AsyncUpstreamClient
+from chat import SymptomExtractor
+from completion_cache import CompletionCache, completion_key
+from upstream_stub import NoRAGService, StubUpstreamHandler, start_upstream
+
+UPSTREAM_DELAY = 0.3
+REQUEST = {'model': 'mine', 'messages': [{'role': 'user', 'content': '症状：咳嗽'}], 'temperature': 0.1}
+
+
+class CountingHandler(StubUpstreamHandler):
+    """本地模拟的图床、症状提取和诊断服务，按路径记录补全请求次数"""
+
+    calls = {}
+    fail = False
+
+    def do_POST(self):
+        self.read_body()
+        if self.path == '/upload':
+            self.send_json(200, {'success': True, 'data': {'url': 'http://images.local/a.png'}})
+            return
+        CountingHandler.calls[self.path] = CountingHandler.calls.get(self.path, 0) + 1
+        time.sleep(UPSTREAM_DELAY)
+        if CountingHandler.fail:
+            self.send_json(503, {'error': 'overloaded'})
+        elif self.path == '/symptoms':
+            self.send_json(200, {'choices': [{'message': {'content': '肺部阴影，咳嗽'}}]})
+        else:
+            self.send_json(200, {'choices': [{'message': {'content': '【可能诊断】：肺炎'}}]})
+
+
+def _start_upstream():
+    server, _ = start_upstream(CountingHandler)
+    CountingHandler.calls = {}
+    CountingHandler.fail = False
+    return server
+
+
+def test_cache_key():
+    """测试缓存键覆盖模型、消息和采样参数，但不受字段顺序和 stream 参数影响"""
+    print("🧪 测试缓存键...")
+    key = completion_key('http://llm/v1', REQUEST)
+    assert completion_key('http://llm/v1', dict(reversed(list(REQUEST.items())))) == key
+    assert completion_key('http://llm/v1', dict(REQUEST, stream=True)) == key
+    assert completion_key('http://llm/v1', dict(REQUEST, temperature=0.2)) != key
+    assert completion_key('http://llm/v1', dict(REQUEST, model='other')) != key
+    assert completion_key('http://llm/v1', dict(REQUEST, messages=[{'role': 'user', 'content': '症状：发热'}])) != key
+    assert completion_key('http://other/v1', REQUEST) != key
+    print("✅ 缓存键测试通过")
+
+
+def test_ttl_eviction_and_sharing():
+    """测试过期失效、超出条目数按最近访问淘汰，以及两个实例（模拟两个worker）共享同一缓存文件"""
+    print("🧪 测试过期、淘汰与共享...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'completions.sqlite3')
+        worker_a = CompletionCache(path, max_entries=2)
+        worker_b = CompletionCache(path, max_entries=2)
+        worker_a.set('u', REQUEST, '诊断一')
+        assert worker_b.get('u', REQUEST) == '诊断一'
+        assert worker_b.stats() == {'hits': 1, 'misses': 0}
+
+        worker_a.set('u', dict(REQUEST, temperature=0.2), '诊断二')
+        time.sleep(0.01)
+        worker_b.get('u', REQUEST)
+        worker_a.set('u', dict(REQUEST, temperature=0.3), '诊断三')
+        worker_a.disk.prune()
+        assert worker_a.get('u', dict(REQUEST, temperature=0.2)) is None, "最久未访问的条目被淘汰"
+        assert worker_a.get('u', REQUEST) == '诊断一'
+
+        short = CompletionCache(os.path.join(tmp, 'short.sqlite3'), ttl=0.05)
+        short.set('u', REQUEST, '诊断一')
+        time.sleep(0.1)
+        assert short.get('u', REQUEST) is None
+        for cache in (worker_a, worker_b, short):
+            cache.close()
+    print("✅ 过期、淘汰与共享测试通过")
+
+
+def test_pipeline_hits_and_bypass():
+    """测试相同请求第二次命中缓存（同步、流式、异步），绕过缓存时重新请求，失败结果不缓存"""
+    print("🧪 测试工作流程命中缓存...")
+    server = _start_upstream()
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CompletionCache(os.path.join(tmp, 'completions.sqlite3'))
+        try:
+            extractor = SymptomExtractor(rag_service=NoRAGService(), completion_cache=cache)
+            first = extractor.chat_top('分析影像', b'image')
+            assert CountingHandler.calls == {'/symptoms': 1, '/diagnosis': 1}
+
+            start = time.time()
+            assert extractor.chat_top('分析影像', b'image') == first
+            assert time.time() - start < UPSTREAM_DELAY
+            assert CountingHandler.calls == {'/symptoms': 1, '/diagnosis': 1}
+
+            events = list(extractor.chat_top_stream('分析影像', b'image'))
+            assert events[-1] == ('done', {'reply': first})
+            assert CountingHandler.calls == {'/symptoms': 1, '/diagnosis': 1}
+
+            async def run(use_cache):
+                pipeline = AsyncSymptomExtractor(extractor, AsyncUpstreamClient())
+                try:
+                    return await pipeline.chat_top('分析影像', b'image', use_cache)
+                finally:
+                    await pipeline.close()
+
+            assert asyncio.run(run(True)) == first
+            assert CountingHandler.calls == {'/symptoms': 1, '/diagnosis': 1}
+
+            # 绕过缓存：同步和异步各重新请求一次
+            assert extractor.chat_top('分析影像', b'image', use_cache=False) == first
+            assert asyncio.run(run(False)) == first
+            assert CountingHandler.calls == {'/symptoms': 3, '/diagnosis': 3}
+
+            # 失败的补全不写入缓存
+            CountingHandler.fail = True
+            assert extractor.chat_with_gpt('文本问题').startswith('抱歉')
+            CountingHandler.fail = False
+            assert extractor.chat_with_gpt('文本问题') == '肺部阴影，咳嗽'
+            assert CountingHandler.calls['/symptoms'] == 5
+        finally:
+            server.shutdown()
+            cache.close()
+    print("✅ 工作流程命中缓存测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 大模型补全缓存测试")
+    print("=" * 60)
+
+    test_cache_key()
+    test_ttl_eviction_and_sharing()
+    test_pipeline_hits_and_bypass()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+测试列式知识记录存储：字段还原、词条驻留、同ID覆盖、预渲染片段与二进制文件往返
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.docstore import KnowledgeDocStore
+from rag.snippets import SNIPPET_DIAGNOSIS, SNIPPET_MARKDOWN, render_snippets
+
+METADATAS = [
+    {'category': '呼吸系统疾病', 'disease': '肺炎', 'symptoms': '咳嗽, 发热, 胸痛', 'causes': '细菌感染',
+     'prevention': '', 'treatment': '抗生素治疗', 'diagnosis_methods': '胸部CT, 血常规', 'severity': '中等',
+     'imaging_findings': '肺部阴影', 'description': '肺实质的急性感染性炎症'},
+    {'category': '呼吸系统疾病', 'disease': '支气管炎', 'symptoms': '咳嗽, 咳痰', 'causes': '', 'prevention': '',
+     'treatment': '对症治疗', 'diagnosis_methods': '', 'severity': '', 'imaging_findings': '',
+     'description': '支气管黏膜炎症'},
+]
+
+
+def test_roundtrip_and_interning():
+    """测试 metadata 还原与词表共享"""
+    print("🧪 测试字段还原与词条驻留...")
+    store = KnowledgeDocStore()
+    store.add(['a', 'b'], METADATAS)
+    assert len(store) == 2 and 'a' in store and 'missing' not in store
+
+    metadata = store.get_metadata('a')
+    for key, value in METADATAS[0].items():
+        assert metadata[key] == value, key
+    assert metadata['record_id'] == 'a' and metadata['id'] == '呼吸系统疾病_肺炎'
+    assert store.get_metadata('b')['diagnosis_methods'] == ''
+    assert store.record_terms('b') == ['支气管炎', '咳嗽', '咳痰']
+    assert store.get_metadata('missing') is None
+
+    # "咳嗽" 只在词表中出现一次，两条记录共享同一个字符串对象
+    assert store._vocab.count('咳嗽') == 1
+    assert store.record_terms('a')[1] is store.record_terms('b')[1]
+    print("✅ 字段还原与词条驻留测试通过")
+
+
+def test_overwrite_and_binary_file():
+    """测试同ID覆盖以及单文件保存/加载"""
+    print("🧪 测试同ID覆盖与二进制文件...")
+    store = KnowledgeDocStore()
+    store.add(['a', 'b'], METADATAS)
+    store.add(['a'], [dict(METADATAS[0], treatment='抗病毒治疗')])
+    assert len(store) == 2 and store.get_metadata('a')['treatment'] == '抗病毒治疗'
+    store.fingerprint = 'data.py:1:2'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'docstore.bin')
+        store.save(path)
+        loaded = KnowledgeDocStore.load(path)
+        assert loaded.fingerprint == 'data.py:1:2'
+        assert loaded.record_ids == ['a', 'b']
+        assert loaded.get_metadata('a') == store.get_metadata('a')
+        assert loaded.get_metadata('b') == store.get_metadata('b')
+        assert KnowledgeDocStore.load(os.path.join(tmp, 'missing.bin')) is None
+    print("✅ 同ID覆盖与二进制文件测试通过")
+
+
+class _Exploit:
+    """反序列化时执行代码的 pickle 载荷"""
+
+    executed = False
+
+    def __reduce__(self):
+        return (setattr, (_Exploit, 'executed', True))
+
+
+def test_no_pickle():
+    """测试序列化结果不是 pickle，旧版或恶意的 pickle 数据不会被反序列化"""
+    print("🧪 测试不使用 pickle...")
+    store = KnowledgeDocStore()
+    store.add(['a', 'b'], METADATAS)
+    data = store.to_bytes()
+    assert not data.startswith(b'\x80'), "序列化结果不应是 pickle"
+    assert KnowledgeDocStore.from_bytes(data).get_metadata('b') == store.get_metadata('b')
+
+    payload = pickle.dumps({'version': 2, 'exploit': _Exploit()}, protocol=pickle.HIGHEST_PROTOCOL)
+    assert KnowledgeDocStore.from_bytes(payload) is None
+    assert not _Exploit.executed
+    print("✅ 不使用 pickle 测试通过")
+
+
+def test_snippets():
+    """测试预渲染片段随记录保存、覆盖和加载"""
+    print("🧪 测试预渲染片段...")
+    knowledge = {'disease': '肺炎', 'category': '呼吸系统疾病', 'symptoms': ['咳嗽', '发热', '胸痛'],
+                 'causes': '细菌感染', 'treatment': '抗生素治疗', 'diagnosis_methods': ['胸部CT', '血常规']}
+    store = KnowledgeDocStore()
+    store.add(['a', 'b'], METADATAS, [render_snippets(knowledge), {}])
+    assert store.snippet('a', SNIPPET_MARKDOWN).startswith('肺炎 (呼吸系统疾病)\n**常见症状：** 咳嗽, 发热, 胸痛\n')
+    assert store.snippet('a', SNIPPET_DIAGNOSIS) == (
+        "疾病：肺炎 (分类：呼吸系统疾病)\n   常见症状：咳嗽, 发热, 胸痛\n   病因：细菌感染\n"
+        "   治疗：抗生素治疗\n   诊断方法：胸部CT, 血常规\n")
+    # 未保存片段的记录和不存在的记录返回 None，由调用方当场渲染
+    assert store.snippet('b', SNIPPET_MARKDOWN) is None and store.snippet('missing', SNIPPET_MARKDOWN) is None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'docstore.bin')
+        store.save(path)
+        loaded = KnowledgeDocStore.load(path)
+        assert loaded.snippet('a', SNIPPET_DIAGNOSIS) == store.snippet('a', SNIPPET_DIAGNOSIS)
+    print("✅ 预渲染片段测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 知识记录存储测试")
+    print("=" * 60)
+
+    test_roundtrip_and_interning()
+    test_overwrite_and_binary_file()
+    test_no_pickle()
+    test_snippets()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+测试查询向量缓存
+验证LRU淘汰、磁盘持久化以及模型变化时的缓存失效
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.embedding import EmbeddingCache
+
+
+def test_memory_lru():
+    """测试进程内LRU命中与淘汰"""
+    print("🧪 测试进程内LRU缓存...")
+    cache = EmbeddingCache("test-model", max_entries=2)
+    vectors = np.eye(3, dtype=np.float32)
+    cache.put_many(["咳嗽", "发热", "胸痛"], vectors)
+
+    results = cache.get_many(["咳嗽", "发热", "  胸痛  "])
+    assert results[0] is None, "最早写入的条目应被淘汰"
+    assert np.allclose(results[1], vectors[1])
+    assert np.allclose(results[2], vectors[2]), "首尾空白应被规范化"
+
+    stats = cache.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 1
+    print(f"✅ LRU缓存测试通过: {stats}")
+
+
+def test_disk_cache_and_model_invalidation():
+    """测试磁盘缓存跨实例复用，以及模型变化时自动清空"""
+    print("🧪 测试磁盘缓存...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "embedding_cache.sqlite3")
+        vector = np.array([[0.6, 0.8]], dtype=np.float32)
+
+        EmbeddingCache("model-a", disk_path=path).put_many(["右肺下叶片状阴影"], vector)
+
+        reloaded = EmbeddingCache("model-a", disk_path=path)
+        result = reloaded.get_many(["右肺下叶片状阴影"])[0]
+        assert result is not None and np.allclose(result, vector[0])
+        assert reloaded.stats()['disk_hits'] == 1
+
+        switched = EmbeddingCache("model-b", disk_path=path)
+        assert switched.get_many(["右肺下叶片状阴影"])[0] is None, "更换模型后旧向量应失效"
+        assert len(switched.disk) == 0
+    print("✅ 磁盘缓存测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 查询向量缓存测试")
+    print("=" * 60)
+
+    test_memory_lru()
+    test_disk_cache_and_model_invalidation()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
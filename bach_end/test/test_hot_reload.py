@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+测试知识库热重载：后台构建新版本、原子切换、在途请求结束后释放旧版本、重启后沿用最新版本
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag import runtime
+
+
+class FakeKnowledgeBase:
+    """只记录目录和构建次数的知识库替身；build_gate 未放行时构建阻塞"""
+
+    builds = []
+    closed = []
+    use_artifact = []
+    build_gate = threading.Event()
+
+    def __init__(self, db_path, embedder=None, reranker=None, use_artifact=True):
+        FakeKnowledgeBase.build_gate.wait(10)
+        with open(os.path.join(db_path, 'marker'), 'a', encoding='utf-8') as f:
+            f.write('x')
+        self.db_path = db_path
+        self.reranker = reranker
+        self.write_lock = threading.RLock()
+        FakeKnowledgeBase.builds.append(db_path)
+        FakeKnowledgeBase.use_artifact.append(use_artifact)
+
+    def get_knowledge_count(self):
+        return len(FakeKnowledgeBase.builds)
+
+    def close(self):
+        FakeKnowledgeBase.closed.append(self.db_path)
+
+
+def _service(tmp):
+    runtime.create_embedder = lambda db_path: object()
+    runtime.MedicalKnowledgeBase = FakeKnowledgeBase
+    runtime.get_term_matcher = lambda: None
+    FakeKnowledgeBase.builds = []
+    FakeKnowledgeBase.closed = []
+    FakeKnowledgeBase.use_artifact = []
+    FakeKnowledgeBase.build_gate.set()
+    db_path = os.path.join(tmp, 'medical_knowledge_db')
+    os.makedirs(db_path)
+    service = runtime.RAGService(db_path).start()
+    assert service.wait(10)
+    return service, db_path
+
+
+def test_swap_and_drain():
+    """测试重载期间请求仍使用旧版本，切换后旧版本在请求结束时释放"""
+    print("🧪 测试原子切换与旧版本释放...")
+    with tempfile.TemporaryDirectory() as tmp:
+        service, db_path = _service(tmp)
+        assert service.status()['version']['version'] == runtime.BASE_VERSION
+
+        FakeKnowledgeBase.build_gate.clear()
+        with service.lease() as old_retriever:
+            assert service.reload()
+            assert not service.reload(), "同一时间只允许一次重载"
+            # 新版本构建完成前，新请求仍拿到旧版本
+            with service.lease() as retriever:
+                assert retriever is old_retriever
+            FakeKnowledgeBase.build_gate.set()
+            assert service.wait_reload(10)
+
+            status = service.status()
+            new_version = status['version']['version']
+            assert new_version != runtime.BASE_VERSION
+            assert [v['version'] for v in status['draining']] == [runtime.BASE_VERSION]
+            with service.lease() as retriever:
+                assert retriever is not old_retriever
+            assert old_retriever.knowledge_base.db_path == db_path
+        assert service.status()['draining'] == []
+        # 旧版本的向量存储已关闭，基础目录不会被删除
+        assert FakeKnowledgeBase.closed == [db_path]
+        assert os.path.isdir(db_path)
+
+        # 再次重载后，上一个热重载版本的目录被删除
+        first_path = service._active.db_path
+        assert service.reload() and service.wait_reload(10)
+        assert not os.path.exists(first_path)
+        assert FakeKnowledgeBase.closed == [db_path, first_path]
+        with open(os.path.join(service._active.db_path, 'marker'), encoding='utf-8') as f:
+            assert f.read() == 'xxx', "默认以当前版本目录为起点增量构建"
+
+        # 重启后沿用 CURRENT 指向的版本
+        restarted = runtime.RAGService(db_path).start()
+        assert restarted.wait(10)
+        assert restarted.status()['version']['version'] == service.status()['version']['version']
+    print("✅ 原子切换与旧版本释放测试通过")
+
+
+def test_snapshot_uses_sqlite_backup():
+    """测试增量重载复制的是 SQLite 数据库的一致快照：包含仍在 WAL 中的事务，不复制 -wal/-shm 和编码缓存"""
+    print("🧪 测试知识库目录快照...")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'db')
+        os.makedirs(os.path.join(source, 'segment'))
+        with open(os.path.join(source, 'segment', 'data_level0.bin'), 'wb') as f:
+            f.write(b'hnsw')
+        with open(os.path.join(source, 'embedding_cache.sqlite3'), 'wb') as f:
+            f.write(b'cache')
+
+        # 模拟正在服务的 chroma.sqlite3：WAL 模式、关闭自动检查点，写入的数据只在 -wal 文件中
+        writer = sqlite3.connect(os.path.join(source, 'chroma.sqlite3'))
+        writer.execute('PRAGMA journal_mode=WAL')
+        writer.execute('PRAGMA wal_autocheckpoint=0')
+        writer.execute('CREATE TABLE embeddings (id TEXT)')
+        writer.executemany('INSERT INTO embeddings VALUES (?)', [(f'r{i}',) for i in range(500)])
+        writer.commit()
+        assert os.path.getsize(os.path.join(source, 'chroma.sqlite3-wal')) > 0
+        try:
+            target = os.path.join(tmp, 'green')
+            runtime.snapshot_db_dir(source, target)
+        finally:
+            writer.close()
+
+        assert sorted(os.listdir(target)) == ['chroma.sqlite3', 'segment']
+        with open(os.path.join(target, 'segment', 'data_level0.bin'), 'rb') as f:
+            assert f.read() == b'hnsw'
+        copy = sqlite3.connect(os.path.join(target, 'chroma.sqlite3'))
+        try:
+            assert copy.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+            assert copy.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0] == 500
+        finally:
+            copy.close()
+    print("✅ 知识库目录快照测试通过")
+
+
+def test_full_rebuild_skips_artifact():
+    """测试全量重建从空目录按知识数据建库，不装载预构建的索引制品；增量重载仍允许装载"""
+    print("🧪 测试全量重建不装载制品...")
+    with tempfile.TemporaryDirectory() as tmp:
+        service, db_path = _service(tmp)
+        assert service.reload(full_rebuild=True) and service.wait_reload(10)
+        with open(os.path.join(service._active.db_path, 'marker'), encoding='utf-8') as f:
+            assert f.read() == 'x', "全量重建不复制当前版本目录"
+        assert service.reload() and service.wait_reload(10)
+        assert FakeKnowledgeBase.use_artifact == [True, False, True]
+    print("✅ 全量重建不装载制品测试通过")
+
+
+def test_failed_build_keeps_current():
+    """测试新版本构建失败时继续使用当前版本"""
+    print("🧪 测试构建失败保留当前版本...")
+    with tempfile.TemporaryDirectory() as tmp:
+        service, db_path = _service(tmp)
+
+        def failing(db_path, embedder=None, reranker=None, use_artifact=True):
+            raise RuntimeError('embedding model unavailable')
+
+        runtime.MedicalKnowledgeBase = failing
+        assert service.reload(full_rebuild=True)
+        assert not service.wait_reload(10)
+        status = service.status()
+        assert status['reload']['state'] == runtime.STATE_FAILED
+        assert status['version']['version'] == runtime.BASE_VERSION
+        assert os.listdir(service.versions_dir) == []
+    print("✅ 构建失败保留当前版本测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 知识库热重载测试")
+    print("=" * 60)
+
+    test_swap_and_drain()
+    test_snapshot_uses_sqlite_backup()
+    test_full_rebuild_skips_artifact()
+    test_failed_build_keeps_current()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
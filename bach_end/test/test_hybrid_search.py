@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+测试BM25词法检索与倒数排名融合(RRF)
+"""
+
+import os
+import sys
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+def test_medical_dictionary_tokenize():
+    """测试医学词典生效：疾病名作为整体切分"""
+    print("🧪 测试医学词典分词...")
+    tokens = tokenize("患者出现颅内高压综合征表现，伴有头痛")
+    assert "颅内高压综合征" in tokens, tokens
+    assert "患者" not in tokens, "停用词应被过滤"
+    print(f"✅ 分词结果: {tokens}")
+
+
+def test_bm25_ranking():
+    """测试BM25排序及同ID覆盖"""
+    print("🧪 测试BM25检索...")
+    index = BM25Index()
+    index.add(
+        ["pneumonia", "appendicitis", "hypertension"],
+        ["肺炎 咳嗽 发热 胸痛 肺部阴影", "阑尾炎 右下腹痛 发热 恶心", "高血压 头痛 头晕"]
+    )
+    hits = index.search("咳嗽、胸痛，影像显示肺部阴影", top_k=2)
+    assert hits[0][0] == "pneumonia", hits
+
+    index.add(["hypertension"], ["高血压 咳嗽 咳嗽 咳嗽"])
+    assert len(index) == 3
+    assert index.search("头晕", top_k=3) == [], "覆盖后旧文档的词不应再命中"
+    print(f"✅ BM25检索测试通过: {hits}")
+
+
+def test_reciprocal_rank_fusion():
+    """测试RRF融合：两路都靠前的结果排在最前"""
+    print("🧪 测试RRF融合...")
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+    assert [record_id for record_id, _ in fused][:2] == ["b", "a"], fused
+    print(f"✅ RRF融合测试通过: {fused}")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 混合检索测试")
+    print("=" * 60)
+
+    test_medical_dictionary_tokenize()
+    test_bm25_ranking()
+    test_reciprocal_rank_fusion()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
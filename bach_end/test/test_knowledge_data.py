@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+测试JSONL知识数据文件：写出、流式读取、按序号随机访问以及导入开销
+"""
+
+import os
+import json
+import subprocess
+import sys
+import tempfile
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.knowledge_data import KnowledgeDataFile, INDEX_SUFFIX, write_knowledge_data
+
+RECORDS = [
+    {'disease': '肺炎', 'category': '呼吸系统疾病', 'symptoms': ['咳嗽', '发热'], 'description': '第一行\n含换行'},
+    {'disease': '冠心病', 'category': '心血管疾病', 'symptoms': ['胸痛'], 'description': ''},
+    {'disease': '胃炎', 'category': '消化系统疾病', 'symptoms': ['上腹痛', '恶心'], 'description': '胃粘膜炎症'},
+]
+
+
+def test_write_and_read():
+    """测试写出后流式读取与随机访问结果一致"""
+    print("🧪 测试JSONL数据文件读写...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'knowledge.jsonl')
+        assert write_knowledge_data(iter(RECORDS), path) == len(RECORDS)
+
+        data = KnowledgeDataFile(path)
+        assert len(data) == len(RECORDS)
+        assert list(data) == RECORDS
+        assert [data[i] for i in (2, 0, 1)] == [RECORDS[2], RECORDS[0], RECORDS[1]]
+        data.close()
+
+        # 缺少偏移量索引时扫描数据文件重建
+        os.remove(path + INDEX_SUFFIX)
+        rebuilt = KnowledgeDataFile(path)
+        assert len(rebuilt) == len(RECORDS) and rebuilt[1] == RECORDS[1]
+        rebuilt.close()
+    print("✅ JSONL数据文件读写测试通过")
+
+
+def test_stale_index_rebuilt():
+    """测试编辑数据文件后旧的偏移量索引失效，随机访问读到编辑后的记录"""
+    print("🧪 测试偏移量索引失效重建...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'knowledge.jsonl')
+        write_knowledge_data(iter(RECORDS), path)
+        data = KnowledgeDataFile(path)
+        assert data[1] == RECORDS[1]
+
+        # 手工编辑：在第一条记录前插入一条，之后每行的偏移量都发生变化
+        edited = [{'disease': '哮喘', 'category': '呼吸系统疾病', 'symptoms': ['喘息'], 'description': '气道高反应'}]
+        edited += RECORDS
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in edited:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        # 已打开的实例和新实例都按编辑后的内容读取
+        assert len(data) == len(edited)
+        assert [data[i] for i in range(len(edited))] == edited
+        data.close()
+        reopened = KnowledgeDataFile(path)
+        assert reopened[0] == edited[0] and reopened[3] == RECORDS[2]
+        reopened.close()
+
+        # 重建后的索引已重写：文件头 24 字节 + 每条记录 8 字节
+        assert os.path.getsize(path + INDEX_SUFFIX) == 24 + 8 * len(edited)
+    print("✅ 偏移量索引失效重建测试通过")
+
+
+def test_import_does_not_load_data():
+    """测试导入 rag 包时不会导入任何知识数据模块"""
+    print("🧪 测试导入开销...")
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("import sys, time; start = time.perf_counter(); import rag; "
+            "print(time.perf_counter() - start); "
+            "print(any(name.startswith('rag.data.') for name in sys.modules))")
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=backend_dir, text=True).split()
+    print(f"   导入耗时: {float(output[-2]) * 1000:.1f}ms")
+    assert output[-1] == 'False'
+    print("✅ 导入开销测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 知识数据文件测试")
+    print("=" * 60)
+
+    test_write_and_read()
+    test_stale_index_rebuilt()
+    test_import_does_not_load_data()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
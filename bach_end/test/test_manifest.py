@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+测试知识库清单：稳定ID、内容哈希对比与持久化
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.manifest import KnowledgeManifest, content_hash, stable_record_id
+
+
+def test_stable_record_id():
+    """测试稳定ID不依赖记录顺序，重复记录依次加后缀"""
+    print("🧪 测试稳定记录ID...")
+    seen = {}
+    first = stable_record_id({'category': '呼吸系统疾病', 'disease': '肺炎'}, seen)
+    duplicate = stable_record_id({'category': '呼吸系统疾病', 'disease': '肺炎'}, seen)
+    explicit = stable_record_id({'id': 'pneumonia_001', 'disease': '肺炎'}, seen)
+    assert first.startswith('kb_') and duplicate == first + '#2' and explicit == 'pneumonia_001'
+
+    # 在前面插入其他记录不影响ID
+    seen = {}
+    stable_record_id({'category': '心血管疾病', 'disease': '冠心病'}, seen)
+    assert stable_record_id({'category': '呼吸系统疾病', 'disease': '肺炎'}, seen) == first
+    print("✅ 稳定记录ID测试通过")
+
+
+def test_diff_and_persist():
+    """测试新增/变更/删除的识别以及清单落盘"""
+    print("🧪 测试清单对比与持久化...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'manifest.json')
+        manifest = KnowledgeManifest(path)
+        assert not manifest.exists
+
+        manifest.reset('model-a')
+        manifest.update(['a', 'b', 'c'], [content_hash('文档a', {}), content_hash('文档b', {}), content_hash('文档c', {})])
+        manifest.runtime['runtime_1'] = content_hash('运行时', {})
+        manifest.save()
+
+        reopened = KnowledgeManifest(path)
+        assert reopened.exists and reopened.model_id == 'model-a'
+        added, changed, removed = reopened.diff(
+            ['a', 'b', 'd'],
+            [content_hash('文档a', {}), content_hash('文档b', {'severity': '重度'}), content_hash('文档d', {})]
+        )
+        assert (added, changed, removed) == ([2], [1], ['c'])
+        assert 'runtime_1' in reopened.runtime
+    print("✅ 清单对比与持久化测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 知识库清单测试")
+    print("=" * 60)
+
+    test_stable_record_id()
+    test_diff_and_persist()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
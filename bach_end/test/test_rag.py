@@ -96,6 +96,31 @@ def test_knowledge_search():
     except Exception as e:
         print(f"❌ 知识搜索测试失败: {e}")
 
+def test_batch_search_matches_single():
+    """测试批量检索与逐条检索的结果一致"""
+    print("\n🔍 测试批量检索与逐条检索一致...")
+    
+    try:
+        kb, retriever = initialize_medical_rag()
+        search_queries = ["肺炎", "发热咳嗽", "右下腹痛", "多饮多尿"]
+        
+        # 清空检索结果缓存，确保两种方式都实际检索
+        kb.result_cache.clear()
+        single = [kb.search_relevant_knowledge(query, top_k=2) for query in search_queries]
+        kb.result_cache.clear()
+        batch = kb.search_relevant_knowledge_many(search_queries, top_k=2)
+        
+        assert len(batch) == len(single)
+        for query, one, many in zip(search_queries, single, batch):
+            assert [k['disease'] for k in one] == [k['disease'] for k in many], query
+            for a, b in zip(one, many):
+                assert abs(a['relevance_score'] - b['relevance_score']) < 1e-5, query
+        print("✅ 批量检索与逐条检索结果一致")
+        
+    except Exception as e:
+        print(f"❌ 批量检索一致性测试失败: {e}")
+        traceback.print_exc()
+
 if __name__ == "__main__":
     print("=" * 60)
     print("🏥 医学RAG系统测试")
@@ -103,6 +128,7 @@ if __name__ == "__main__":
     
     test_rag_system()
     test_knowledge_search()
+    test_batch_search_matches_single()
     
     print("\n" + "=" * 60)
     print("测试完成！")
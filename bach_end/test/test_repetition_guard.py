@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+测试生成重复检测：段落重复、短周期循环、正常诊断不误判，诊断调用检测到循环后中止上游流，以及病例报告不做检测
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import completion_cache
+from async_chat import AsyncSymptomExtractor, AsyncUpstreamClient
+from chat import SymptomExtractor
+from completion_cache import CompletionCache
+from repetition_guard import RepetitionGuard, repetition_stats
+from upstream_stub import NoRAGService, StubUpstreamHandler, start_upstream
+
+# 测试对象是对本地上游的实际调用：不使用补全缓存，也不读写 bach_end/cache 下的共享缓存文件。
+# 缓存开关在 get_completion_cache() 调用时读取，即使 completion_cache 已被其他测试先导入也生效
+completion_cache.COMPLETION_CACHE_ENABLED = False
+
+NORMAL_DIAGNOSIS = """【可能诊断】：
+1. 社区获得性肺炎（概率：高）
+2. 急性支气管炎（概率：中）
+3. 肺结核（概率：低）
+
+【建议检查】：
+• 胸部CT平扫，明确病变范围
+• 血常规及C反应蛋白检查
+• 痰培养及药敏试验
+
+【处理建议】：
+• 经验性抗感染治疗，根据痰培养结果调整
+• 3-5天后复查血常规，2周后复查胸片
+• 注意休息，多饮水，避免受凉
+
+═══════════════════════════════════════
+
+【注意事项】：
+本分析仅供参考，请务必咨询专业医生确诊。"""
+
+# 三个诊断下出现相同的护理建议：正常报告，不是循环
+REPEATED_ADVICE_REPORT = """【可能诊断】：
+1. 湿疹（概率：高）
+- 表现：皮肤红斑、丘疹伴瘙痒
+- 建议：保持皮肤清洁干燥，避免搔抓。
+2. 接触性皮炎（概率：中）
+- 表现：接触部位边界清楚的红斑
+- 建议：保持皮肤清洁干燥，避免搔抓。
+3. 荨麻疹（概率：低）
+- 表现：风团时起时消
+- 建议：保持皮肤清洁干燥，避免搔抓。
+
+【建议检查】：
+• 皮肤科专科检查
+• 斑贴试验
+
+【注意事项】：
+本分析仅供参考，请务必咨询专业医生确诊。"""
+
+# 病例报告按模板逐项列出检查结果：同一行出现 4 次，诊断建议中会被判定为循环，病例报告中是正常内容
+TEMPLATED_CASE_REPORT = """**检查结果**
+1. 血常规
+结果：未见明显异常，建议定期复查。
+2. 尿常规
+结果：未见明显异常，建议定期复查。
+3. 肝功能
+结果：未见明显异常，建议定期复查。
+4. 肾功能
+结果：未见明显异常，建议定期复查。
+
+**医疗免责声明**
+本报告仅供参考。"""
+
+LOOP_PREFIX = "【可能诊断】：\n1. 社区获得性肺炎（概率：高）\n"
+LOOP_PARAGRAPH = "建议尽快完善胸部CT检查，并结合血常规结果综合判断病情。\n"
+
+
+def _feed(guard, text, size=3):
+    """按固定长度切分成增量逐段送入，返回检测到循环前送入的增量数"""
+    for start in range(0, len(text), size):
+        if not guard.feed(text[start:start + size]):
+            break
+    return guard.tokens
+
+
+def test_paragraph_loop():
+    """测试整段重复时截断到重复段落之前"""
+    print("🧪 测试段落重复...")
+    guard = RepetitionGuard(max_tokens=800)
+    _feed(guard, LOOP_PREFIX + LOOP_PARAGRAPH * 20)
+    assert guard.tripped and guard.reason == 'paragraph'
+    assert guard.text == (LOOP_PREFIX + LOOP_PARAGRAPH).rstrip()
+    assert guard.tokens < len(LOOP_PREFIX + LOOP_PARAGRAPH * 2) // 3 + 2
+    assert guard.tokens_saved == 800 - guard.tokens
+    assert 0 < guard.tokens_trimmed < guard.tokens
+    assert not guard.feed('继续'), "检测到循环后不再处理增量"
+    print(f"✅ 段落重复测试通过（{guard.tokens} 个增量后中止）")
+
+
+def test_short_period_loop():
+    """测试没有换行的短周期循环由 n-gram 判定"""
+    print("🧪 测试短周期循环...")
+    guard = RepetitionGuard(max_tokens=800)
+    _feed(guard, LOOP_PREFIX + "定期复查，" * 100)
+    assert guard.tripped and guard.reason == 'ngram'
+    text = guard.text
+    assert text.startswith(LOOP_PREFIX) and text.count("定期复查") <= 5, text
+    print("✅ 短周期循环测试通过")
+
+
+def test_no_false_positive():
+    """测试格式化的正常诊断（含重复的小标题格式和分隔线）不被误判"""
+    print("🧪 测试正常诊断不误判...")
+    guard = RepetitionGuard(max_tokens=800)
+    _feed(guard, NORMAL_DIAGNOSIS)
+    assert not guard.tripped
+    assert guard.text == NORMAL_DIAGNOSIS and guard.tokens_saved == 0 and guard.tokens_trimmed == 0
+    print("✅ 正常诊断不误判测试通过")
+
+
+def test_repeated_advice_lines_pass_through():
+    """测试多个诊断下重复出现的建议行不被当作循环，报告完整保留"""
+    print("🧪 测试重复建议行不误判...")
+    guard = RepetitionGuard(max_tokens=800)
+    _feed(guard, REPEATED_ADVICE_REPORT)
+    assert not guard.tripped, guard.reason
+    assert guard.text == REPEATED_ADVICE_REPORT
+    assert '3. 荨麻疹（概率：低）' in guard.text
+    print("✅ 重复建议行不误判测试通过")
+
+
+def test_scattered_line_repeats():
+    """测试不相邻的同一行累计出现达到上限时判定为循环，截断到最后一次出现之前"""
+    print("🧪 测试分散的重复行...")
+    line = "建议尽快完善胸部CT检查，并结合血常规结果综合判断病情。\n"
+    text = "".join(f"{i}. 第{i}项\n{line}" for i in range(1, 7))
+    guard = RepetitionGuard(max_tokens=800, max_paragraph_repeats=4)
+    _feed(guard, text)
+    assert guard.tripped and guard.reason == 'paragraph'
+    assert guard.text.count(line.strip()) == 3 and guard.text.endswith('4. 第4项'), guard.text
+    print("✅ 分散的重复行测试通过")
+
+
+class LoopingHandler(StubUpstreamHandler):
+    """本地模拟的诊断服务：陷入段落循环，一直生成到 max_tokens，记录实际发出的增量数"""
+
+    sent = []
+
+    def do_POST(self):
+        request = json.loads(self.read_body())
+        assert request['stream'] is True
+        text = LOOP_PREFIX + LOOP_PARAGRAPH * 100
+        self.start_event_stream()
+        sent = 0
+        try:
+            for start in range(0, min(len(text), request['max_tokens'] * 3), 3):
+                self.write_delta(text[start:start + 3])
+                sent += 1
+                time.sleep(0.005)
+            self.end_event_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        LoopingHandler.sent.append(sent)
+
+
+class TemplatedReportHandler(StubUpstreamHandler):
+    """本地模拟的诊断服务：按请求方式（流式或非流式）返回模板化的病例报告，记录每次请求是否流式"""
+
+    streamed = []
+
+    def do_POST(self):
+        request = json.loads(self.read_body())
+        TemplatedReportHandler.streamed.append(bool(request.get('stream')))
+        if not request.get('stream'):
+            self.send_json(200, {'choices': [{'message': {'content': TEMPLATED_CASE_REPORT}}]})
+            return
+        self.start_event_stream()
+        try:
+            for start in range(0, len(TEMPLATED_CASE_REPORT), 3):
+                self.write_delta(TEMPLATED_CASE_REPORT[start:start + 3])
+            self.end_event_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def test_diagnosis_stream_aborted():
+    """测试同步和异步的诊断调用检测到循环后返回去重前缀，并关闭上游流"""
+    print("🧪 测试诊断调用提前中止...")
+    server, _ = start_upstream(LoopingHandler)
+    LoopingHandler.sent = []
+    expected = (LOOP_PREFIX + LOOP_PARAGRAPH).rstrip()
+    try:
+        before = repetition_stats()['aborted']
+        extractor = SymptomExtractor(rag_service=NoRAGService())
+        start = time.time()
+        assert extractor.chat_with_diagnosis_api('症状：咳嗽') == expected
+        # 全部 800 个增量约需 4 秒
+        assert time.time() - start < 2
+
+        async def run():
+            pipeline = AsyncSymptomExtractor(extractor, AsyncUpstreamClient())
+            try:
+                return await pipeline.chat_with_diagnosis_api('症状：咳嗽')
+            finally:
+                await pipeline.close()
+
+        assert asyncio.run(run()) == expected
+        assert repetition_stats()['aborted'] == before + 2
+
+        deadline = time.time() + 5
+        while len(LoopingHandler.sent) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert len(LoopingHandler.sent) == 2 and max(LoopingHandler.sent) < 100, LoopingHandler.sent
+    finally:
+        server.shutdown()
+    print(f"✅ 诊断调用提前中止测试通过（上游发出 {LoopingHandler.sent} 个增量后停止）")
+
+
+def test_truncated_diagnosis_not_cached():
+    """测试截断后的诊断不写入补全缓存，下次请求重新生成"""
+    print("🧪 测试截断结果不缓存...")
+    server, _ = start_upstream(LoopingHandler)
+    LoopingHandler.sent = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CompletionCache(os.path.join(tmp, 'completions.sqlite3'))
+        try:
+            extractor = SymptomExtractor(rag_service=NoRAGService(), completion_cache=cache)
+            first = extractor.chat_with_diagnosis_api('症状：咳嗽')
+            assert extractor.chat_with_diagnosis_api('症状：咳嗽') == first
+
+            async def run():
+                pipeline = AsyncSymptomExtractor(extractor, AsyncUpstreamClient())
+                try:
+                    return await pipeline.chat_with_diagnosis_api('症状：咳嗽')
+                finally:
+                    await pipeline.close()
+
+            assert asyncio.run(run()) == first
+
+            deadline = time.time() + 5
+            while len(LoopingHandler.sent) < 3 and time.time() < deadline:
+                time.sleep(0.05)
+            assert len(LoopingHandler.sent) == 3, "每次请求都重新生成"
+            assert len(cache.disk) == 0
+            assert cache.stats()['hits'] == 0
+        finally:
+            server.shutdown()
+            cache.close()
+    print("✅ 截断结果不缓存测试通过")
+
+
+def test_case_report_not_guarded():
+    """测试病例报告不做重复检测：模板化的检查结果行完整保留，诊断建议仍受检测"""
+    print("🧪 测试病例报告不截断...")
+    guard = RepetitionGuard(max_tokens=800)
+    _feed(guard, TEMPLATED_CASE_REPORT)
+    assert guard.tripped, "模板化报告在诊断建议的检测规则下会被截断"
+
+    server, _ = start_upstream(TemplatedReportHandler)
+    TemplatedReportHandler.streamed = []
+    try:
+        extractor = SymptomExtractor(rag_service=NoRAGService())
+        report = extractor.generate_case_report({'name': '张三', 'age': 45, 'gender': '男'})
+        assert TEMPLATED_CASE_REPORT in report, report
+        assert extractor.chat_with_diagnosis_api('症状：咳嗽') == guard.text
+        assert TemplatedReportHandler.streamed == [False, True]
+    finally:
+        server.shutdown()
+    print("✅ 病例报告不截断测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 生成重复检测测试")
+    print("=" * 60)
+
+    test_paragraph_loop()
+    test_short_period_loop()
+    test_no_false_positive()
+    test_repeated_advice_lines_pass_through()
+    test_scattered_line_repeats()
+    test_diagnosis_stream_aborted()
+    test_truncated_diagnosis_not_cached()
+    test_case_report_not_guarded()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+测试交叉编码器重排器：批量打分、时间预算超时退回以及按耗时估计跳过
+"""
+
+import os
+import sys
+import time
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.reranker import CrossEncoderReranker, PROBE_INTERVAL
+
+
+class _OverlapModel:
+    """按字符重合度打分的假模型，可模拟耗时"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [len(set(query) & set(passage)) / len(set(query)) for query, passage in pairs]
+
+
+def test_batched_scores():
+    """测试一次批量前向得到每条知识的分数"""
+    print("🧪 测试批量打分...")
+    model = _OverlapModel()
+    reranker = CrossEncoderReranker(model=model, time_budget_ms=1000)
+    scores = reranker.score("咳嗽发热", ["肺炎：咳嗽、发热", "冠心病：胸痛", "支气管炎：咳嗽"])
+    assert model.calls == 1 and scores[0] > scores[2] > scores[1] == 0.0
+    assert reranker.score("咳嗽", []) == []
+    assert reranker.stats()['reranked'] == 1 and reranker.ewma_ms_per_pair is not None
+    reranker.close()
+    print("✅ 批量打分测试通过")
+
+
+def test_time_budget_fallback():
+    """测试超出时间预算时返回 None，并在耗时估计超出预算后直接跳过"""
+    print("🧪 测试时间预算...")
+    model = _OverlapModel(delay=0.2)
+    reranker = CrossEncoderReranker(model=model, time_budget_ms=50)
+
+    start = time.time()
+    assert reranker.score("咳嗽", ["肺炎"]) is None
+    assert time.time() - start < 0.15, "超时后不应继续等待模型"
+    # 上一批次仍在计算时直接跳过
+    assert reranker.score("咳嗽", ["肺炎"]) is None and model.calls == 1
+
+    # 后台计算完成后耗时估计已超出预算，后续请求不再调用模型，直到定期放行一次重新测量
+    time.sleep(0.3)
+    for _ in range(PROBE_INTERVAL - 1):
+        assert reranker.score("咳嗽", ["肺炎"]) is None
+    assert model.calls == 1
+    stats = reranker.stats()
+    assert stats['timeouts'] == 1 and stats['skipped'] == PROBE_INTERVAL
+    reranker.close()
+    print(f"   统计: {stats}")
+    print("✅ 时间预算测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 交叉编码器重排测试")
+    print("=" * 60)
+
+    test_batched_scores()
+    test_time_budget_fallback()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
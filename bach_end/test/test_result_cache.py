@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+测试检索结果缓存：键规范化、LRU/TTL 淘汰与版本号失效
+"""
+
+import os
+import sys
+import time
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.result_cache import RetrievalResultCache
+
+
+def test_hit_and_copy():
+    """测试规范化后的相同查询命中缓存，且返回值与缓存内容互不影响"""
+    print("🧪 测试缓存命中...")
+    cache = RetrievalResultCache(max_entries=8, ttl_seconds=None)
+    cache.put(cache.make_key(1, '咳嗽 发热', 3, 'none'), [{'disease': '肺炎', 'relevance_score': 0.8}])
+
+    hits = cache.get(cache.make_key(1, '  咳嗽   发热 ', 3, 'none'))
+    assert hits and hits[0]['disease'] == '肺炎'
+    hits[0]['disease'] = '已修改'
+    assert cache.get(cache.make_key(1, '咳嗽 发热', 3, 'none'))[0]['disease'] == '肺炎'
+
+    # top_k、预过滤模式或知识库版本不同都不命中
+    assert cache.get(cache.make_key(1, '咳嗽 发热', 5, 'none')) is None
+    assert cache.get(cache.make_key(1, '咳嗽 发热', 3, 'union')) is None
+    assert cache.get(cache.make_key(2, '咳嗽 发热', 3, 'none')) is None
+    print(f"   统计: {cache.stats()}")
+    print("✅ 缓存命中测试通过")
+
+
+def test_query_terms_in_key():
+    """测试查询术语计入缓存键：术语不同不命中，术语顺序和重复不影响"""
+    print("🧪 测试查询术语缓存键...")
+    cache = RetrievalResultCache(max_entries=8, ttl_seconds=None)
+    cache.put(cache.make_key(1, '咳嗽 发热', 3, 'union', ['咳嗽', '发热']), [{'disease': '肺炎'}])
+
+    assert cache.get(cache.make_key(1, '咳嗽 发热', 3, 'union', ['发热', '咳嗽', '咳嗽']))[0]['disease'] == '肺炎'
+    assert cache.get(cache.make_key(1, '咳嗽 发热', 3, 'union', ['咳嗽'])) is None
+    assert cache.get(cache.make_key(1, '咳嗽 发热', 3, 'union')) is None
+    print("✅ 查询术语缓存键测试通过")
+
+
+def test_eviction():
+    """测试LRU淘汰与TTL过期"""
+    print("🧪 测试缓存淘汰...")
+    cache = RetrievalResultCache(max_entries=2, ttl_seconds=None)
+    for query in ('a', 'b'):
+        cache.put(cache.make_key(0, query, 3, 'none'), [])
+    cache.get(cache.make_key(0, 'a', 3, 'none'))
+    cache.put(cache.make_key(0, 'c', 3, 'none'), [])
+    assert cache.get(cache.make_key(0, 'b', 3, 'none')) is None
+    assert cache.get(cache.make_key(0, 'a', 3, 'none')) == []
+
+    cache = RetrievalResultCache(max_entries=2, ttl_seconds=0.05)
+    cache.put(cache.make_key(0, 'a', 3, 'none'), [])
+    time.sleep(0.1)
+    assert cache.get(cache.make_key(0, 'a', 3, 'none')) is None and len(cache) == 0
+
+    # 条目数为 0 时关闭缓存
+    cache = RetrievalResultCache(max_entries=0)
+    cache.put(cache.make_key(0, 'a', 3, 'none'), [])
+    assert cache.get(cache.make_key(0, 'a', 3, 'none')) is None
+    print("✅ 缓存淘汰测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 检索结果缓存测试")
+    print("=" * 60)
+
+    test_hit_and_copy()
+    test_query_terms_in_key()
+    test_eviction()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+测试流式医疗AI工作流程：SSE增量解析、事件顺序、首个事件无需等待上游、上游失败时的 error 事件、跳过无法解析的数据
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_chat
+import chat
+import completion_cache
+from async_chat import AsyncSymptomExtractor, AsyncUpstreamClient
+from chat import SymptomExtractor
+from upstream_stub import NoRAGService, StubUpstreamHandler, start_upstream
+
+# 测试对象是对本地上游的实际调用：不使用补全缓存，也不读写 bach_end/cache 下的共享缓存文件。
+# 缓存开关在 get_completion_cache() 调用时读取，即使 completion_cache 已被其他测试先导入也生效
+completion_cache.COMPLETION_CACHE_ENABLED = False
+
+CHUNK_DELAY = 0.2
+SYMPTOM_CHUNKS = ['【影像类型】：X光片\n', '【观察到的症状】：', '肺部阴影']
+DIAGNOSIS_CHUNKS = ['【可能诊断】：', '肺炎（概率：高）']
+# 上游偶尔发出的保活事件和无法解析的行
+NOISE_LINES = [b": keep-alive", b"data:", b"data: {broken", b'data: "text"', b"data: \xff\xfe",
+               b'data: {"choices": {}}', b'data: {"choices": [{"delta": {"content": 1}}]}']
+
+
+class StreamingHandler(StubUpstreamHandler):
+    """本地模拟的图床与流式补全服务：每个增量之间间隔 CHUNK_DELAY 秒"""
+
+    requests = []
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.path == '/upload':
+            self.send_json(200, {'success': True, 'data': {'url': 'http://images.local/a.png'}})
+            return
+        if self.path == '/broken':
+            self.send_json(503, {'error': 'overloaded'})
+            return
+        StreamingHandler.requests.append(json.loads(body))
+        chunks = SYMPTOM_CHUNKS if self.path == '/symptoms' else DIAGNOSIS_CHUNKS
+        noisy = self.path == '/noisy'
+        # 不声明字符集，验证按UTF-8解码
+        self.start_event_stream()
+        try:
+            for text in chunks:
+                time.sleep(CHUNK_DELAY)
+                if noisy:
+                    self.write_chunk(b"".join(line + b"\n\n" for line in NOISE_LINES))
+                self.write_delta(text)
+            self.end_event_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def _start_upstream():
+    server, base_url = start_upstream(StreamingHandler)
+    StreamingHandler.requests = []
+    return server, base_url
+
+
+def test_event_sequence():
+    """测试事件顺序、增量内容与 done 中的完整报告"""
+    print("🧪 测试流式事件顺序...")
+    server, _ = _start_upstream()
+    try:
+        extractor = SymptomExtractor(rag_service=NoRAGService())
+        start = time.time()
+        events = []
+        for event, data in extractor.chat_top_stream('分析影像', b'image'):
+            events.append((event, data, time.time() - start))
+
+        names = [event for event, _, _ in events]
+        assert names == (['started', 'uploaded'] + ['symptoms_delta'] * len(SYMPTOM_CHUNKS) +
+                         ['symptoms', 'rag'] + ['diagnosis_delta'] * len(DIAGNOSIS_CHUNKS) + ['done']), names
+        # 首个事件不等待任何上游调用；症状增量在诊断开始前就已送达
+        assert events[0][2] < 0.1
+        first_symptom = names.index('symptoms_delta')
+        assert events[first_symptom][2] < CHUNK_DELAY * 2
+        assert events[names.index('symptoms')][1]['content'] == ''.join(SYMPTOM_CHUNKS)
+        assert events[names.index('rag')][1] == {'use_rag': False, 'max_relevance_score': 0.0}
+
+        symptoms = ''.join(SYMPTOM_CHUNKS)
+        diagnosis = ''.join(DIAGNOSIS_CHUNKS)
+        assert events[-1][1]['reply'] == SymptomExtractor.format_report(symptoms, diagnosis)
+        assert all(request['stream'] is True for request in StreamingHandler.requests)
+        assert StreamingHandler.requests[1]['model'] == 'mine'
+    finally:
+        server.shutdown()
+    print(f"✅ 流式事件顺序测试通过（首个症状增量 {events[first_symptom][2]:.2f}s）")
+
+
+def test_upstream_error():
+    """测试上游返回非200时产出 error 事件并结束"""
+    print("🧪 测试上游失败...")
+    server, base_url = _start_upstream()
+    try:
+        chat.DIAGNOSIS_API_URL = f"{base_url}/broken"
+        extractor = SymptomExtractor(rag_service=NoRAGService())
+        events = list(extractor.chat_top_stream('分析影像', b'image'))
+        event, data = events[-1]
+        assert event == 'error' and '503' in data['message'], events[-1]
+        assert 'done' not in [event for event, _ in events]
+    finally:
+        server.shutdown()
+    print("✅ 上游失败测试通过")
+
+
+def test_malformed_lines_skipped():
+    """测试保活事件和无法解析的流式数据被跳过，不中断症状提取和诊断（同步与异步）"""
+    print("🧪 测试无法解析的流式数据...")
+    for line in NOISE_LINES:
+        assert chat.parse_stream_line(line) == (False, None), line
+    assert chat.parse_stream_line(b"data: [DONE]") == (True, None)
+
+    server, base_url = _start_upstream()
+    try:
+        chat.DEEPSEEK_CHAT_URL = chat.DIAGNOSIS_API_URL = f"{base_url}/noisy"
+        async_chat.DIAGNOSIS_API_URL = f"{base_url}/noisy"
+        extractor = SymptomExtractor(rag_service=NoRAGService())
+        events = list(extractor.chat_top_stream('分析影像', b'image'))
+        assert events[-1][0] == 'done', events[-1]
+        assert extractor.chat_with_diagnosis_api('症状：咳嗽') == ''.join(DIAGNOSIS_CHUNKS)
+
+        async def run():
+            pipeline = AsyncSymptomExtractor(extractor, AsyncUpstreamClient())
+            try:
+                return await pipeline.chat_with_diagnosis_api('症状：咳嗽')
+            finally:
+                await pipeline.close()
+
+        assert asyncio.run(run()) == ''.join(DIAGNOSIS_CHUNKS)
+    finally:
+        server.shutdown()
+    print("✅ 无法解析的流式数据测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 流式医疗AI工作流程测试")
+    print("=" * 60)
+
+    test_event_sequence()
+    test_upstream_error()
+    test_malformed_lines_skipped()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
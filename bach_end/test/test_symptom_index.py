@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+测试症状倒排索引预过滤
+"""
+
+import os
+import sys
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.symptom_index import SymptomInvertedIndex, PREFILTER_UNION, PREFILTER_INTERSECTION
+
+
+def _build_index():
+    index = SymptomInvertedIndex()
+    index.add(
+        ["肺炎", "支气管炎", "冠心病", "胃炎"],
+        [["肺炎", "咳嗽", "发热", "胸痛"],
+         ["支气管炎", "咳嗽", "咳痰", "发热"],
+         ["冠心病", "胸痛", "胸闷"],
+         ["胃炎", "上腹痛", "恶心"]]
+    )
+    return index
+
+
+def test_union_and_intersection():
+    """测试并集/交集候选及按命中数排序"""
+    print("🧪 测试症状倒排索引候选...")
+    index = _build_index()
+    assert index.term_count == 11
+
+    union = index.candidates(["咳嗽", "胸痛"], mode=PREFILTER_UNION)
+    assert union[0] == "肺炎" and set(union) == {"肺炎", "支气管炎", "冠心病"}, union
+
+    assert index.candidates(["咳嗽", "发热", "胸痛"], mode=PREFILTER_INTERSECTION) == ["肺炎"]
+    # 没有记录命中全部症状时，取命中数最多的记录
+    assert set(index.candidates(["咳痰", "胸闷"], mode=PREFILTER_INTERSECTION)) == {"支气管炎", "冠心病"}
+
+    assert index.candidates(["头痛"]) == []
+    assert len(index.candidates(["咳嗽", "胸痛"], limit=1)) == 1
+    print("✅ 症状倒排索引候选测试通过")
+
+
+def test_readd_replaces_terms():
+    """测试重复添加同一记录时以新的词替换旧的词，不再按已移除的症状命中"""
+    print("🧪 测试重复添加...")
+    index = _build_index()
+    index.add(["胃炎"], [["反酸", "恶心"]])
+    assert len(index) == 4
+    assert index.postings("恶心") == ["胃炎"]
+    assert index.postings("反酸") == ["胃炎"]
+    assert index.postings("上腹痛") == [] and index.candidates(["上腹痛"]) == []
+    # 只属于该记录的旧词（胃炎、上腹痛）被删除
+    assert index.term_count == 10
+
+    # 其他记录共享的词只删除该记录的倒排项
+    index.add(["肺炎"], [["肺炎", "胸痛"]])
+    assert index.postings("咳嗽") == ["支气管炎"] and index.postings("发热") == ["支气管炎"]
+    assert set(index.postings("胸痛")) == {"肺炎", "冠心病"}
+    assert index.candidates(["咳嗽", "发热"], mode=PREFILTER_INTERSECTION) == ["支气管炎"]
+    print("✅ 重复添加测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 症状倒排索引测试")
+    print("=" * 60)
+
+    test_union_and_intersection()
+    test_readd_replaces_terms()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
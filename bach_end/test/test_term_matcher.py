@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+测试Aho-Corasick医学术语匹配器
+"""
+
+import os
+import sys
+import time
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.term_matcher import AhoCorasickMatcher, get_term_matcher
+
+
+def test_automaton_matches():
+    """测试自动机输出全部重叠匹配以及最左最长选择"""
+    print("🧪 测试Aho-Corasick自动机...")
+    automaton = AhoCorasickMatcher()
+    for pattern in ["he", "she", "his", "hers"]:
+        automaton.add(pattern)
+    matches = sorted((start, end) for start, end, _ in automaton.iter_matches("ushers"))
+    assert matches == [(1, 4), (2, 4), (2, 6)], matches
+
+    longest = [(start, end) for start, end, _ in automaton.find_longest("ushers")]
+    assert longest == [(1, 4)], longest
+    print("✅ 自动机匹配测试通过")
+
+
+def test_extract_from_llm_report():
+    """测试从症状提取模板中识别规范术语"""
+    print("🧪 测试症状报告术语识别...")
+    report = """
+【影像类型】：胸部X光片
+【观察到的症状】：
+1. 肺纹理增粗
+2. 胸腔积液，伴咳嗽、胸痛
+【异常区域】：右肺下叶
+【严重程度】：中等
+"""
+    matcher = get_term_matcher()
+    terms = matcher.extract(report)
+    for expected in ["肺纹理增粗", "胸腔积液", "咳嗽", "胸痛"]:
+        assert expected in terms.symptoms, terms.to_dict()
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        matcher.extract(report)
+    elapsed_us = (time.perf_counter() - start) * 1000
+    print(f"✅ 识别结果: {terms.to_dict()}，词典规模 {len(matcher)}，单次耗时约 {elapsed_us:.1f} 微秒")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 医学术语匹配测试")
+    print("=" * 60)
+
+    test_automaton_matches()
+    test_extract_from_llm_report()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
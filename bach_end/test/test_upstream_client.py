@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+测试上游HTTP客户端：按主机复用长连接、多线程共享、读取超时
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat import UpstreamClient
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    """返回固定补全结果的本地上游服务，记录每个请求来自的客户端连接"""
+
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_POST(self):
+        CompletionHandler.connections.add(self.client_address)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/slow':
+            time.sleep(2)
+        body = json.dumps({'choices': [{'message': {'content': 'ok'}}]}).encode('utf-8')
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已因超时断开
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def test_keep_alive_reuse():
+    """测试顺序请求复用同一连接，多线程并发时连接数不超过连接池大小"""
+    print("🧪 测试长连接复用...")
+    server, base_url = _start_server()
+    try:
+        client = UpstreamClient(pool_size=4)
+        CompletionHandler.connections = set()
+        for _ in range(10):
+            assert client.post(f"{base_url}/chat", json={'prompt': 'x'}).json()['choices'][0]['message']['content'] == 'ok'
+        assert len(CompletionHandler.connections) == 1
+        assert client.session(f"{base_url}/other") is client.session(f"{base_url}/chat")
+
+        CompletionHandler.connections = set()
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            statuses = list(pool.map(lambda _: client.post(f"{base_url}/chat", json={}).status_code, range(40)))
+        assert statuses == [200] * 40
+        assert len(CompletionHandler.connections) <= 4
+        client.close()
+    finally:
+        server.shutdown()
+    print("✅ 长连接复用测试通过")
+
+
+def test_read_timeout():
+    """测试上游迟迟不响应时按读取超时抛出异常"""
+    print("🧪 测试读取超时...")
+    server, base_url = _start_server()
+    try:
+        client = UpstreamClient(read_timeout=0.5)
+        start = time.time()
+        try:
+            client.post(f"{base_url}/slow", json={})
+            raise AssertionError("未触发读取超时")
+        except requests.exceptions.Timeout:
+            pass
+        assert time.time() - start < 2
+        # 单次调用可放宽读取超时
+        assert client.post(f"{base_url}/slow", read_timeout=5, json={}).status_code == 200
+    finally:
+        server.shutdown()
+    print("✅ 读取超时测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 上游HTTP客户端测试")
+    print("=" * 60)
+
+    test_keep_alive_reuse()
+    test_read_timeout()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
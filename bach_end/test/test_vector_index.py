@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+测试内存映射NumPy向量索引
+验证 top-k 检索结果与暴力计算一致、距离与ChromaDB l2空间一致、覆盖写入和重新加载、量化粗排 + 精确重排、
+追加式写入（不重写已有数据、兼容旧版目录、中断后恢复）、写入期间并发查询的一致性，以及类别分片路由
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.vector_index import VectorIndex
+from rag.sharding import ShardedVectorStore
+
+
+def _random_unit_vectors(count, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_topk_matches_bruteforce():
+    """测试批量 top-k 与暴力排序一致"""
+    print("🧪 测试 top-k 检索...")
+    vectors = _random_unit_vectors(500, 32)
+    queries = _random_unit_vectors(4, 32, seed=1)
+    ids = [f"record_{i}" for i in range(len(vectors))]
+
+    for dtype in ("float32", "float16"):
+        with tempfile.TemporaryDirectory() as tmp:
+            index = VectorIndex(tmp, dtype=dtype)
+            index.add(ids, vectors, metadatas=[{'row': i} for i in range(len(ids))])
+            hits = index.query(queries, top_k=5)
+
+            expected = np.argsort(-(queries @ vectors.T), axis=1)[:, :5]
+            for query_hits, expected_rows in zip(hits, expected):
+                assert [hit[0] for hit in query_hits] == [ids[row] for row in expected_rows], dtype
+                assert query_hits[0][2] == {'row': int(expected_rows[0])}
+
+            # 归一化向量的平方L2距离 = 2 - 2cos
+            cos = float(queries[0] @ vectors[expected[0][0]])
+            assert abs(hits[0][0][1] - (2 - 2 * cos)) < 1e-2
+    print("✅ top-k 检索测试通过")
+
+
+def test_upsert_and_reload():
+    """测试同ID覆盖写入以及重新打开后的持久化"""
+    print("🧪 测试覆盖写入与重新加载...")
+    vectors = _random_unit_vectors(3, 8)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = VectorIndex(tmp)
+        index.add(["a", "b"], vectors[:2])
+        index.add(["b"], vectors[2:3], metadatas=[{'disease': '肺炎'}])
+        assert index.count() == 2
+
+        reopened = VectorIndex(tmp)
+        assert reopened.count() == 2
+        top = reopened.query(vectors[2:3], top_k=1)[0][0]
+        assert top[0] == "b" and top[2] == {'disease': '肺炎'}
+    print("✅ 覆盖写入与重新加载测试通过")
+
+
+def test_append_without_rewrite():
+    """测试分批写入只追加：向量文件和记录文件原位增长，不被替换重写；覆盖已有记录不影响旧状态；重新打开后内容一致"""
+    print("🧪 测试追加式写入...")
+    vectors = _random_unit_vectors(1000, 16)
+    ids = [f"record_{i}" for i in range(len(vectors))]
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("none", "int8", "binary"):
+            index_dir = os.path.join(tmp, mode)
+            index = VectorIndex(index_dir, quantization=mode)
+            index.add(ids[:100], vectors[:100], metadatas=[{'row': i} for i in range(100)])
+            names = [name for name in os.listdir(index_dir) if not name.endswith('.tmp')]
+            inodes = {name: os.stat(os.path.join(index_dir, name)).st_ino for name in names}
+            for start in range(100, len(ids), 100):
+                index.add(ids[start:start + 100], vectors[start:start + 100],
+                          metadatas=[{'row': i} for i in range(start, start + 100)])
+            assert {name: os.stat(os.path.join(index_dir, name)).st_ino for name in names} == inodes, "文件被整体重写"
+
+            # 覆盖已有记录写时复制：覆盖前取得的状态仍看到原来的向量和 metadata
+            old_state = index._state
+            index.add(["record_5"], vectors[6:7], metadatas=[{'row': 6}])
+            assert index._state is not old_state
+            assert np.allclose(old_state.vectors[5], vectors[5]) and old_state.metadatas[5] == {'row': 5}
+            if old_state.codes is not None:
+                assert np.array_equal(old_state.codes[5], index._quantize(vectors[5:6])[0][0])
+
+            expected = vectors.copy()
+            expected[5] = vectors[6]
+            for reopened in (index, VectorIndex(index_dir, quantization=mode)):
+                assert reopened.count() == len(ids)
+                found = reopened.get(["record_5", "record_999"])
+                assert np.allclose(found["record_5"][0], vectors[6]) and found["record_5"][1] == {'row': 6}
+                assert found["record_999"][1] == {'row': 999}
+                hits = reopened.query(vectors[998:999], top_k=1)[0]
+                assert hits[0][0] == "record_998" and abs(hits[0][1]) < 1e-4
+            if mode == "int8":
+                codes = np.load(os.path.join(index_dir, "codes-int8.npy"))
+                scales = np.load(os.path.join(index_dir, "scales-int8.npy"))
+                assert np.abs(codes * scales[:, None] - expected).max() < 0.02
+    print("✅ 追加式写入测试通过")
+
+
+def test_legacy_layout_and_recovery():
+    """测试旧版 ids.npy/metadatas.json 目录可直接读取并在写入时迁移，以及中断的追加写入不影响已提交内容"""
+    print("🧪 测试旧版目录与中断恢复...")
+    vectors = _random_unit_vectors(20, 8)
+    ids = [f"record_{i}" for i in range(len(vectors))]
+    with tempfile.TemporaryDirectory() as tmp:
+        np.save(os.path.join(tmp, VectorIndex.VECTORS_FILE), vectors[:10])
+        np.save(os.path.join(tmp, VectorIndex.IDS_FILE), np.array(ids[:10], dtype=str))
+        with open(os.path.join(tmp, VectorIndex.METADATA_FILE), 'w', encoding='utf-8') as f:
+            json.dump([{'row': i} for i in range(10)], f)
+
+        index = VectorIndex(tmp)
+        assert index.count() == 10 and index.query(vectors[3:4], top_k=1)[0][0][:1] == ("record_3",)
+        index.add(ids[10:15], vectors[10:15], metadatas=[{'row': i} for i in range(10, 15)])
+        assert not os.path.exists(os.path.join(tmp, VectorIndex.IDS_FILE))
+        assert VectorIndex(tmp).get(["record_2"])["record_2"][1] == {'row': 2}
+
+        # 模拟写到一半中断：记录文件末尾有未提交的新记录和半行，向量文件末尾有多余字节
+        with open(os.path.join(tmp, VectorIndex.RECORDS_FILE), 'ab') as f:
+            f.write(json.dumps(["record_99", {}]).encode('utf-8') + b'\n["record_')
+        with open(os.path.join(tmp, VectorIndex.VECTORS_FILE), 'ab') as f:
+            f.write(b'\x00' * 7)
+        recovered = VectorIndex(tmp)
+        assert recovered.count() == 15 and recovered.get(["record_99"]) == {}
+        recovered.add(ids[15:], vectors[15:], metadatas=[{'row': i} for i in range(15, 20)])
+        reopened = VectorIndex(tmp)
+        assert reopened.count() == 20 and reopened.get(["record_19"])["record_19"][1] == {'row': 19}
+        assert reopened.query(vectors[17:18], top_k=1)[0][0][0] == "record_17"
+    print("✅ 旧版目录与中断恢复测试通过")
+
+
+def test_candidate_filter():
+    """测试只在候选记录中检索"""
+    print("🧪 测试候选集过滤检索...")
+    vectors = _random_unit_vectors(100, 16)
+    ids = [f"record_{i}" for i in range(len(vectors))]
+    candidates = ids[10:20] + ["missing"]
+    with tempfile.TemporaryDirectory() as tmp:
+        index = VectorIndex(tmp)
+        index.add(ids, vectors)
+        hits = index.query(vectors[:1], top_k=3, candidate_ids=candidates)[0]
+        assert len(hits) == 3 and all(hit[0] in candidates for hit in hits)
+
+        expected = np.argsort(-(vectors[:1] @ vectors[10:20].T)[0])[:3]
+        assert [hit[0] for hit in hits] == [ids[10 + row] for row in expected]
+        assert index.query(vectors[:1], top_k=3, candidate_ids=["missing"]) == [[]]
+    print("✅ 候选集过滤检索测试通过")
+
+
+def test_quantized_rerank():
+    """测试量化粗排 + 精确重排：距离为精确值，候选数足够时与全量扫描一致，编码随写入更新"""
+    print("🧪 测试量化检索与精确重排...")
+    vectors = _random_unit_vectors(400, 32)
+    queries = _random_unit_vectors(5, 32, seed=4)
+    ids = [f"record_{i}" for i in range(len(vectors))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        exact = VectorIndex(tmp)
+        exact.add(ids, vectors)
+        expected = exact.query(queries, top_k=5)
+
+        for mode in ("int8", "binary"):
+            # 建库后才开启量化：打开时由向量矩阵生成编码
+            index = VectorIndex(tmp, quantization=mode, rerank_candidates=50)
+            usage = index.memory_usage()
+            assert usage['codes'] * (3 if mode == "int8" else 16) < usage['vectors'], usage
+            hits = index.query(queries, top_k=5)
+            for query, query_hits in zip(queries, hits):
+                for record_id, distance, _ in query_hits:
+                    cos = float(query @ vectors[int(record_id.split('_')[1])])
+                    assert abs(distance - (2 - 2 * cos)) < 1e-4
+            if mode == "int8":
+                assert [[hit[0] for hit in h] for h in hits] == [[hit[0] for hit in h] for h in expected]
+
+            # 重排候选覆盖全库时结果与全量扫描一致
+            index.rerank_candidates = len(ids) - 1
+            assert [[hit[0] for hit in h] for h in index.query(queries, top_k=5)] == \
+                [[hit[0] for hit in h] for h in expected]
+
+        # 覆盖写入后编码同步更新
+        index = VectorIndex(tmp, quantization="int8", rerank_candidates=20)
+        index.add(["record_0"], queries[:1])
+        assert index.query(queries[:1], top_k=1)[0][0][0] == "record_0"
+    print("✅ 量化检索与精确重排测试通过")
+
+
+def test_queries_during_writes():
+    """测试写入（追加、覆盖、删除）期间的并发查询：每条结果的ID、metadata与距离始终属于同一行"""
+    print("🧪 测试写入期间的并发查询...")
+    vectors = _random_unit_vectors(2000, 16)
+    queries = _random_unit_vectors(3, 16, seed=5)
+    ids = [f"record_{i}" for i in range(len(vectors))]
+    errors = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("none", "int8"):
+            index = VectorIndex(os.path.join(tmp, mode), quantization=mode, rerank_candidates=20)
+            stop = threading.Event()
+
+            def reader():
+                while not stop.is_set():
+                    try:
+                        for candidate_ids in (None, ids[::7]):
+                            for query, query_hits in zip(queries, index.query(queries, top_k=5, candidate_ids=candidate_ids)):
+                                for record_id, distance, metadata in query_hits:
+                                    row = int(record_id.split('_')[1])
+                                    assert metadata == {'record_id': record_id}, (record_id, metadata)
+                                    assert abs(distance - (2 - 2 * float(query @ vectors[row]))) < 1e-4
+                    except Exception as e:
+                        errors.append(repr(e))
+                        return
+
+            threads = [threading.Thread(target=reader) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            try:
+                for start in range(0, len(ids), 100):
+                    index.add(ids[start:start + 100], vectors[start:start + 100],
+                              metadatas=[{'record_id': record_id} for record_id in ids[start:start + 100]])
+                    # 覆盖写入同样的向量，删除后再补回
+                    index.add(ids[:50], vectors[:50], metadatas=[{'record_id': record_id} for record_id in ids[:50]])
+                    index.delete(ids[start:start + 10])
+                    index.add(ids[start:start + 10], vectors[start:start + 10],
+                              metadatas=[{'record_id': record_id} for record_id in ids[start:start + 10]])
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+            assert not errors, errors[:3]
+            assert index.count() == len(ids)
+            assert VectorIndex(os.path.join(tmp, mode), quantization=mode).count() == len(ids)
+    print("✅ 写入期间的并发查询测试通过")
+
+
+def test_sharded_routing():
+    """测试按类别分片写入、质心路由以及与全量检索结果一致"""
+    print("🧪 测试类别分片与质心路由...")
+    rng = np.random.default_rng(2)
+    categories = ["呼吸系统疾病", "心血管疾病", "消化系统疾病", "神经系统疾病"]
+    centers = _random_unit_vectors(len(categories), 32, seed=3)
+    ids, vectors, metadatas = [], [], []
+    for c, category in enumerate(categories):
+        for i in range(50):
+            vector = centers[c] + 0.3 * rng.normal(size=32).astype(np.float32) / np.sqrt(32)
+            ids.append(f"{category}_{i}")
+            vectors.append(vector / np.linalg.norm(vector))
+            metadatas.append({'category': category})
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ShardedVectorStore(tmp, lambda name: VectorIndex(os.path.join(tmp, name)), route_top_n=1)
+        store.add(ids, vectors, metadatas=metadatas)
+        assert store.count() == len(ids) and sorted(store.categories) == sorted(categories)
+
+        queries = vectors[[0, 60, 120]]
+        assert store.route(queries) == [["呼吸系统疾病"], ["心血管疾病"], ["消化系统疾病"]]
+
+        flat = VectorIndex(os.path.join(tmp, "flat"))
+        flat.add(ids, vectors)
+        for sharded_hits, flat_hits in zip(store.query(queries, top_k=5), flat.query(queries, top_k=5)):
+            assert [hit[0] for hit in sharded_hits] == [hit[0] for hit in flat_hits]
+
+        # 重新打开后路由信息仍然可用
+        reopened = ShardedVectorStore(tmp, lambda name: VectorIndex(os.path.join(tmp, name)), route_top_n=1)
+        assert reopened.route(queries[:1]) == [["呼吸系统疾病"]]
+        assert set(reopened.get(["心血管疾病_3", "missing"])) == {"心血管疾病_3"}
+        store.close()
+        reopened.close()
+    print("✅ 类别分片与质心路由测试通过")
+
+
+def test_sharded_delete_and_close():
+    """测试分片删除只在尚未找到的ID中查找、全部找到后不再查询其余分片，以及共用资源只在关闭时释放一次"""
+    print("🧪 测试分片删除与关闭...")
+    lookups, closed = [], []
+
+    class RecordingIndex(VectorIndex):
+        def get(self, ids):
+            lookups.append(list(ids))
+            return super().get(ids)
+
+        def close(self):
+            closed.append(self.index_dir)
+
+    categories = ["呼吸系统疾病", "心血管疾病", "消化系统疾病"]
+    vectors = _random_unit_vectors(30, 8, seed=4)
+    ids = [f"record_{i}" for i in range(30)]
+    metadatas = [{'category': categories[i % 3]} for i in range(30)]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ShardedVectorStore(tmp, lambda name: RecordingIndex(os.path.join(tmp, name)),
+                                   on_close=lambda: closed.append('shared'))
+        store.add(ids, vectors, metadatas=metadatas)
+
+        # record_0 和 record_3 都在第一个分片：找到后不再查询其余分片
+        store.delete(["record_0", "record_3"])
+        assert lookups == [["record_0", "record_3"]], lookups
+        lookups.clear()
+        store.delete(["record_1", "record_2", "missing"])
+        assert lookups[0] == ["record_1", "record_2", "missing"] and lookups[1] == ["record_1", "record_2", "missing"]
+        assert lookups[2] == ["record_2", "missing"], lookups
+        assert store.count() == 26 and not store.get(["record_0", "record_1", "record_2", "record_3"])
+
+        store.close()
+        assert closed[-1] == 'shared' and len(closed) == len(categories) + 1, closed
+    print("✅ 分片删除与关闭测试通过")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("🏥 NumPy向量索引测试")
+    print("=" * 60)
+
+    test_topk_matches_bruteforce()
+    test_upsert_and_reload()
+    test_append_without_rewrite()
+    test_legacy_layout_and_recovery()
+    test_candidate_filter()
+    test_quantized_rerank()
+    test_queries_during_writes()
+    test_sharded_routing()
+    test_sharded_delete_and_close()
+
+    print("\n" + "=" * 60)
+    print("测试完成！")
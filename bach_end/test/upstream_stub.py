@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+上游服务测试替身：在本地随机端口启动模拟的图床、症状提取和诊断服务，并提供未就绪的RAG服务替身。
+test_async_chat / test_stream_chat / test_repetition_guard / test_completion_cache 共用，
+各测试文件只定义自己的请求处理器（继承 StubUpstreamHandler）和断言。
+"""
+
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_chat
+import chat
+
+
+class NoRAGService:
+    """未就绪的RAG服务替身：诊断使用传统提示词"""
+
+    state = 'loading'
+
+    def start(self):
+        return self
+
+    @contextmanager
+    def lease(self, timeout=None):
+        yield None
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """本地上游请求处理器基类：HTTP/1.1 长连接，提供JSON应答和SSE流式应答，不输出访问日志"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def send_json(self, status, result):
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_event_stream(self):
+        """开始分块传输的 SSE 响应（不声明字符集，客户端应按UTF-8解码）"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def write_delta(self, text):
+        """发送一个 OpenAI 兼容的增量事件"""
+        chunk = {'choices': [{'delta': {'content': text}}]}
+        self.write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+    def end_event_stream(self):
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_upstream(handler_class):
+    """启动本地上游，并把 chat / async_chat 的图床、症状提取和诊断地址指向它
+
+    路径分别为 /upload、/symptoms 和 /diagnosis。返回 (server, base_url)，测试结束时调用 server.shutdown()。
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    for module in (chat, async_chat):
+        module.SMMS_UPLOAD_URL = f"{base_url}/upload"
+        module.DEEPSEEK_CHAT_URL = f"{base_url}/symptoms"
+        module.DIAGNOSIS_API_URL = f"{base_url}/diagnosis"
+    return server, base_url